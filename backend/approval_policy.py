@@ -0,0 +1,233 @@
+"""
+Approval Policy
+Decides the approval chain of a requisition from a declarative rule list,
+compiled at load time into lookup tables so a decision takes microseconds.
+
+Configured with APPROVAL_POLICY (inline JSON or a path to a JSON file; see
+approval_policy.example.json). Unset = the built-in policy below, which is
+the old hardcoded chain: Manager over 1,000, + VP Finance over 5,000, + CFO
+over 20,000.
+
+    {
+      "version": "2025-02",
+      "rules": [
+        {"approver": "{department} Manager", "min_amount": 1000},
+        {"approver": "CISO", "department": ["IT"], "category": ["software"], "min_amount": 10000},
+        {"approver": "Procurement Risk", "vendor_risk": ["high"]},
+        {"vendor": ["Blocked Supplies Ltd"], "compliance_status": "VENDOR_BLOCKED"}
+      ]
+    }
+
+A rule applies when every condition it lists matches (department, cost_center,
+category, vendor, vendor_risk: lists of values, case-insensitive; absent =
+any) and min_amount < amount <= max_amount (either bound optional). The
+chain is the approvers of all applying rules in file order, without
+duplicates; "{department}" is filled in. The first applying rule with a
+compliance_status overrides the budget-based COMPLIANT / BUDGET_EXCEEDED.
+
+Compilation: every rule is a bit. Each condition becomes a table value ->
+bitmask of the rules it allows (rules without the condition are in every
+entry), the amount bounds become a sorted breakpoint list with one bitmask
+per interval (found with bisect). A decision ANDs a handful of masks; the
+chain for a (mask, department) pair is built once and memoized.
+
+A policy file is re-read when its mtime changes (checked at most every
+APPROVAL_POLICY_RELOAD_SECONDS). A file that fails to compile is reported
+and the previous policy stays in force.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from metrics import REGISTRY
+
+APPROVAL_POLICY = os.getenv("APPROVAL_POLICY", "")
+APPROVAL_POLICY_RELOAD_SECONDS = float(os.getenv("APPROVAL_POLICY_RELOAD_SECONDS", "2"))
+
+MAX_MEMOIZED = 100_000
+
+DIMENSIONS = ("department", "cost_center", "category", "vendor", "vendor_risk")
+
+DEFAULT_POLICY = {
+    "version": "builtin",
+    "rules": [
+        {"approver": "{department} Manager", "min_amount": 1000},
+        {"approver": "VP Finance", "min_amount": 5000},
+        {"approver": "CFO", "min_amount": 20000},
+    ],
+}
+
+POLICY_RELOADS = REGISTRY.counter(
+    "visionflow_approval_policy_reloads_total", "Approval policy loads by outcome (ok, error)", ("service", "outcome"))
+POLICY_DECISIONS = REGISTRY.counter(
+    "visionflow_approval_decisions_total", "Approval chains decided (single checks and bulk)", ("service", "mode"))
+
+
+def _key(value) -> str:
+    return str(value).strip().lower() if value is not None else ""
+
+
+class CompiledPolicy:
+    def __init__(self, config: dict):
+        rules = config.get("rules")
+        if not isinstance(rules, list):
+            raise ValueError("approval policy needs a \"rules\" list")
+        self.version = str(config.get("version", "unversioned"))
+        self.rules = rules
+        everything = (1 << len(rules)) - 1
+
+        # Condition tables: value -> rules allowing it; "wildcard" = rules without the condition
+        self.tables: Dict[str, Tuple[Dict[str, int], int]] = {}
+        for dim in DIMENSIONS:
+            table: Dict[str, int] = {}
+            wildcard = 0
+            for bit, rule in enumerate(rules):
+                values = rule.get(dim)
+                if values is None:
+                    wildcard |= 1 << bit
+                    continue
+                for value in ([values] if isinstance(values, str) else values):
+                    table[_key(value)] = table.get(_key(value), 0) | 1 << bit
+            for value in table:
+                table[value] |= wildcard
+            self.tables[dim] = (table, wildcard)
+
+        # Amount intervals: (breakpoints[i-1], breakpoints[i]] -> rules covering it
+        bounds = set()
+        for bit, rule in enumerate(rules):
+            unknown = set(rule) - set(DIMENSIONS) - {"approver", "min_amount", "max_amount", "compliance_status", "name"}
+            if unknown:
+                raise ValueError(f"approval rule {bit} has unknown keys {sorted(unknown)}")
+            if not rule.get("approver") and not rule.get("compliance_status"):
+                raise ValueError(f"approval rule {bit} needs an approver or a compliance_status")
+            for bound in ("min_amount", "max_amount"):
+                if rule.get(bound) is not None:
+                    bounds.add(float(rule[bound]))
+        self.breakpoints = sorted(bounds)
+        edges = [float("-inf")] + self.breakpoints + [float("inf")]
+        self.amount_masks = []
+        for i in range(len(self.breakpoints) + 1):
+            lo, hi = edges[i], edges[i + 1]
+            mask = 0
+            for bit, rule in enumerate(rules):
+                low = rule.get("min_amount")
+                high = rule.get("max_amount")
+                if (low is None or float(low) <= lo) and (high is None or hi <= float(high)):
+                    mask |= 1 << bit
+            self.amount_masks.append(mask & everything)
+        self.approvers = [rule.get("approver") for rule in rules]
+        self.statuses = [rule.get("compliance_status") for rule in rules]
+        self._chains: Dict[Tuple[int, str], Tuple[List[str], Optional[str]]] = {}
+
+    def _mask(self, requisition: dict) -> int:
+        mask = self.amount_masks[bisect.bisect_left(self.breakpoints, float(requisition.get("amount") or 0.0))]
+        for dim, (table, wildcard) in self.tables.items():
+            if not mask:
+                break
+            mask &= table.get(_key(requisition.get(dim)), wildcard)
+        return mask
+
+    def decide(self, requisition: dict) -> Tuple[List[str], Optional[str]]:
+        """(approval chain, compliance status override or None)"""
+        department = requisition.get("department") or ""
+        memo_key = (self._mask(requisition), department)
+        decision = self._chains.get(memo_key)
+        if decision is None:
+            mask = memo_key[0]
+            chain, status = [], None
+            bit = 0
+            while mask:
+                if mask & 1:
+                    approver = self.approvers[bit]
+                    if approver:
+                        approver = approver.replace("{department}", department)
+                        if approver not in chain:
+                            chain.append(approver)
+                    if status is None:
+                        status = self.statuses[bit]
+                mask >>= 1
+                bit += 1
+            if len(self._chains) >= MAX_MEMOIZED:
+                self._chains.clear()  # departments are free text; keep the memo bounded
+            decision = self._chains[memo_key] = (chain, status)
+        return decision
+
+
+def _read(source: str) -> dict:
+    if source.lstrip().startswith("{"):
+        return json.loads(source)
+    with open(source) as f:
+        return json.load(f)
+
+
+class PolicyStore:
+    """Current compiled policy, re-read when its file changes"""
+
+    def __init__(self, source: str = APPROVAL_POLICY, reload_seconds: float = APPROVAL_POLICY_RELOAD_SECONDS):
+        self.source = source
+        self.reload_seconds = reload_seconds
+        self.is_file = bool(source) and not source.lstrip().startswith("{")
+        self.error: Optional[str] = None
+        self.loaded_at: Optional[float] = None
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.policy = CompiledPolicy(DEFAULT_POLICY)
+        if source:
+            self.reload(force=True)
+
+    def reload(self, force: bool = False) -> bool:
+        """Recompile if the file changed (or force); False if the new policy was rejected"""
+        if not self.source:
+            return True  # built-in policy, nothing to re-read
+        with self._lock:
+            if self.is_file:
+                try:
+                    mtime = os.stat(self.source).st_mtime_ns
+                except OSError as e:
+                    mtime = None
+                    if force:
+                        self._fail(e)
+                        return False
+                if mtime is None or (mtime == self._mtime and not force):
+                    return self.error is None
+                self._mtime = mtime
+            try:
+                policy = CompiledPolicy(_read(self.source))
+            except Exception as e:
+                self._fail(e)
+                return False
+            self.policy = policy
+            self.error = None
+            self.loaded_at = time.time()
+            POLICY_RELOADS.inc(metrics.SERVICE, "ok")
+            print(f"📜 Approval policy {policy.version}: {len(policy.rules)} rules, "
+                  f"{len(policy.breakpoints)} amount breakpoints")
+            return True
+
+    def _fail(self, error: Exception):
+        self.error = f"{type(error).__name__}: {error}"
+        POLICY_RELOADS.inc(metrics.SERVICE, "error")
+        print(f"❌ Approval policy not loaded ({self.error}), keeping version {self.policy.version}")
+
+    def current(self) -> CompiledPolicy:
+        if self.is_file and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.reload_seconds
+            self.reload()
+        return self.policy
+
+    def info(self) -> dict:
+        policy = self.policy
+        return {"source": "builtin" if not self.source else ("file" if self.is_file else "inline"),
+                "path": self.source if self.is_file else None, "version": policy.version,
+                "rules": len(policy.rules), "amount_breakpoints": policy.breakpoints,
+                "loaded_at": self.loaded_at, "error": self.error}
+
+
+def compliance_status(override: Optional[str], budget_available: bool) -> str:
+    return override or ("COMPLIANT" if budget_available else "BUDGET_EXCEEDED")
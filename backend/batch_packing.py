@@ -0,0 +1,126 @@
+"""
+Batch Image Packing
+Throughput mode for /inspect/batch: several boxes go to the model in one
+request, sharing a single copy of the instruction block.
+
+    BATCH_PACK_SIZE=0       one model call per box (default)
+    BATCH_PACK_SIZE=6       up to 6 boxes per call
+    BATCH_PACK_LAYOUT=parts each box is its own image part, preceded by "BOX <i>:"
+    BATCH_PACK_LAYOUT=grid  one composite image, each cell labelled BOX <i>
+
+The model answers with a JSON array of per-box objects carrying box_index.
+split_packed() validates it; boxes missing from a usable answer, and every box
+of an unusable one, are re-inspected one per call.
+
+visionflow_batch_boxes_total / visionflow_batch_model_calls_total per mode give
+calls per box; visionflow_cascade_cost_usd_total for the box_inspection and
+box_inspection_packed routes divided by boxes gives cost per box.
+"""
+
+import math
+import os
+from typing import Dict, List
+
+from PIL import Image, ImageDraw, ImageFont
+
+import metrics
+from metrics import REGISTRY
+from model_cascade import EscalationError
+
+BATCH_PACK_SIZE = int(os.getenv("BATCH_PACK_SIZE", "0"))
+BATCH_PACK_LAYOUT = os.getenv("BATCH_PACK_LAYOUT", "parts").lower()
+# Longest side of each box image inside a packed request
+BATCH_PACK_MAX_SIDE = int(os.getenv("BATCH_PACK_MAX_SIDE", "768"))
+
+BATCH_BOXES = REGISTRY.counter(
+    "visionflow_batch_boxes_total", "Boxes inspected through /inspect/batch by mode", ("service", "mode"))
+BATCH_MODEL_CALLS = REGISTRY.counter(
+    "visionflow_batch_model_calls_total", "Model calls made by /inspect/batch by mode", ("service", "mode"))
+PACK_FALLBACKS = REGISTRY.counter(
+    "visionflow_batch_pack_fallbacks_total",
+    "Boxes re-inspected one per call after a packed answer (malformed = whole pack, missing/invalid = one box)",
+    ("service", "reason"))
+
+
+def observe_batch(mode: str, boxes: int, model_calls: int):
+    BATCH_BOXES.inc(metrics.SERVICE, mode, amount=boxes)
+    BATCH_MODEL_CALLS.inc(metrics.SERVICE, mode, amount=model_calls)
+
+
+def record_fallback(reason: str, boxes: int = 1):
+    PACK_FALLBACKS.inc(metrics.SERVICE, reason, amount=boxes)
+
+
+def _fit(image: Image.Image, side: int) -> Image.Image:
+    image = image.convert("RGB")
+    if max(image.size) > side:
+        image = image.copy()
+        image.thumbnail((side, side))
+    return image
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1: fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def grid_composite(images: List[Image.Image], cell: int = BATCH_PACK_MAX_SIDE) -> Image.Image:
+    """Images on a near-square grid, each cell labelled 'BOX <i>' (1-based) top-left"""
+    cols = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / cols)
+    # Keep the whole composite within a 3x3 grid of model tiles
+    cell = min(cell, 2304 // max(cols, rows))
+    gap = 8
+    canvas = Image.new("RGB", (cols * (cell + gap) - gap, rows * (cell + gap) - gap), "white")
+    draw = ImageDraw.Draw(canvas)
+    font = _font(max(16, cell // 16))
+    for i, image in enumerate(images):
+        x, y = (i % cols) * (cell + gap), (i // cols) * (cell + gap)
+        canvas.paste(_fit(image, cell), (x, y))
+        label = f"BOX {i + 1}"
+        box = draw.textbbox((x + 6, y + 6), label, font=font)
+        draw.rectangle((box[0] - 4, box[1] - 4, box[2] + 4, box[3] + 4), fill="black")
+        draw.text((x + 6, y + 6), label, fill="yellow", font=font)
+    return canvas
+
+
+def packed_parts(prompt: str, images: List[Image.Image], layout: str = BATCH_PACK_LAYOUT) -> list:
+    if layout == "grid":
+        return [prompt, grid_composite(images)]
+    parts = [prompt]
+    for i, image in enumerate(images):
+        parts += [f"BOX {i + 1}:", _fit(image, BATCH_PACK_MAX_SIDE)]
+    return parts
+
+
+def split_packed(answer, count: int) -> Dict[int, dict]:
+    """
+    {box_index: answer} from a packed response. Raises EscalationError if the
+    answer isn't a list of objects with distinct in-range box_index values;
+    boxes the model left out are simply absent.
+    """
+    if isinstance(answer, dict) and isinstance(answer.get("boxes"), list):
+        answer = answer["boxes"]
+    if not isinstance(answer, list):
+        raise EscalationError("packed answer is not a JSON array")
+    boxes: Dict[int, dict] = {}
+    for item in answer:
+        index = item.get("box_index") if isinstance(item, dict) else None
+        if isinstance(index, str) and index.strip().isdigit():
+            index = int(index)
+        if not isinstance(index, int) or not 1 <= index <= count:
+            raise EscalationError(f"packed answer has an item without a valid box_index (1-{count})")
+        if index in boxes:
+            raise EscalationError(f"packed answer repeats box_index {index}")
+        boxes[index] = item
+    return boxes
+
+
+def packed_check(count: int):
+    """Model cascade check for a packed route: escalate malformed arrays"""
+    def check(answer, min_confidence: float):
+        split_packed(answer, count)
+        return None
+    return check
@@ -0,0 +1,308 @@
+"""
+Budget Ledger
+Per-department / cost-center budgets with encumbrance: a requisition
+reserves its amount (available drops immediately), the PO commits it
+(reserved -> spent) or it is released. Reservations nobody commits expire
+after BUDGET_RESERVATION_TTL and are released automatically.
+
+    BUDGET_DB_PATH=data/budget_ledger.db   SQLite (WAL), shared by every worker
+    BUDGET_RESERVATION_TTL=3600            seconds before an open reservation is released
+    BUDGET_GROUP_MAX=512                   operations committed in one transaction at most
+    BUDGET_GROUP_WAIT_MS=0                 extra time the writer waits to fill a group
+
+Concurrency: the availability check and the encumbrance are a single
+conditional UPDATE on the account's row (total - spent - encumbered >= amount),
+i.e. a compare-and-swap inside SQLite's write transaction. Two requisitions
+can't both take the last of a budget, in one process or across workers. A
+commit for more than was reserved charges the difference the same way. Writes
+are not striped per account: all of them go through the writer thread below
+and SQLite's single write lock, so departments share that throughput.
+
+Durability: every operation goes through one writer thread that commits the
+operations queued meanwhile in a single transaction (group commit), so the
+fsync (synchronous=FULL) is paid once per group, not once per reservation.
+Callers get their result only after the group is durable. Amounts are stored
+in integer cents.
+"""
+
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from metrics import REGISTRY
+from state_store import DATA_DIR
+
+BUDGET_DB_PATH = os.getenv("BUDGET_DB_PATH", os.path.join(DATA_DIR, "budget_ledger.db"))
+BUDGET_RESERVATION_TTL = float(os.getenv("BUDGET_RESERVATION_TTL", "3600"))
+BUDGET_GROUP_MAX = int(os.getenv("BUDGET_GROUP_MAX", "512"))
+BUDGET_GROUP_WAIT_MS = float(os.getenv("BUDGET_GROUP_WAIT_MS", "0"))
+
+# How often the writer releases expired reservations
+EXPIRY_SWEEP_SECONDS = 30
+
+BUDGET_OPS = REGISTRY.counter(
+    "visionflow_budget_operations_total", "Budget ledger operations by outcome", ("service", "op", "outcome"))
+BUDGET_GROUP_SIZE = REGISTRY.histogram(
+    "visionflow_budget_commit_group_size", "Ledger operations per committed transaction", ("service",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+BUDGET_COMMIT_SECONDS = REGISTRY.histogram(
+    "visionflow_budget_commit_seconds", "Time to apply and commit one group of ledger operations", ("service",))
+
+
+class LedgerError(Exception):
+    """Unknown reservation, one that is no longer open, or a commit the budget can't cover"""
+
+
+def to_cents(amount: float) -> int:
+    return int(round(amount * 100))
+
+
+def account_key(department: str, cost_center: Optional[str] = None) -> str:
+    return f"{department}/{cost_center}" if cost_center else department
+
+
+class BudgetLedger:
+    def __init__(self, path: str = BUDGET_DB_PATH, reservation_ttl: float = BUDGET_RESERVATION_TTL,
+                 group_max: int = BUDGET_GROUP_MAX, group_wait_ms: float = BUDGET_GROUP_WAIT_MS):
+        self.path = path
+        self.reservation_ttl = reservation_ttl
+        self.group_max = group_max
+        self.group_wait = group_wait_ms / 1000
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS budgets (
+                account TEXT PRIMARY KEY,
+                total INTEGER NOT NULL,
+                spent INTEGER NOT NULL DEFAULT 0,
+                encumbered INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS reservations (
+                id TEXT PRIMARY KEY,
+                account TEXT NOT NULL,
+                amount INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                reference TEXT,
+                created REAL NOT NULL,
+                expires_at REAL,
+                settled REAL,
+                committed_amount INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_reservations_open ON reservations(status, expires_at);
+        """)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="budget-ledger-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; reads never block the writer under WAL
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------------
+    # Group commit writer
+    # ------------------------------------------------------------------
+
+    def _write_loop(self):
+        conn = self._connect()
+        next_sweep = time.time() + EXPIRY_SWEEP_SECONDS
+        while True:
+            try:
+                group = [self._queue.get(timeout=EXPIRY_SWEEP_SECONDS)]
+            except queue.Empty:
+                group = []
+            deadline = time.perf_counter() + self.group_wait
+            while len(group) < self.group_max:
+                try:
+                    timeout = deadline - time.perf_counter()
+                    group.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if time.time() >= next_sweep:
+                group.append(("expire", BudgetLedger._expire, (), Future()))
+                next_sweep = time.time() + EXPIRY_SWEEP_SECONDS
+            if group:
+                self._apply(conn, group)
+
+    def _apply(self, conn: sqlite3.Connection, group: list):
+        start = time.perf_counter()
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for _, op, args, _ in group:
+                # A failing operation only rolls back itself, not the rest of the group
+                conn.execute("SAVEPOINT op")
+                try:
+                    results.append((op(self, conn, *args), None))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"❌ Budget ledger commit failed: {e}")
+            results = [(None, e)] * len(group)
+        BUDGET_COMMIT_SECONDS.observe(time.perf_counter() - start, metrics.SERVICE)
+        BUDGET_GROUP_SIZE.observe(len(group), metrics.SERVICE)
+        for (name, _, _, future), (result, error) in zip(group, results):
+            if error is not None:
+                BUDGET_OPS.inc(metrics.SERVICE, name, "error")
+                future.set_exception(error)
+            else:
+                BUDGET_OPS.inc(metrics.SERVICE, name, "ok" if not isinstance(result, dict) or result.get("ok", True)
+                               else "rejected")
+                future.set_result(result)
+
+    def submit(self, name: str, op: Callable, *args) -> Future:
+        future: Future = Future()
+        self._queue.put((name, op, args, future))
+        return future
+
+    async def run(self, name: str, op: Callable, *args):
+        return await asyncio.wrap_future(self.submit(name, op, *args))
+
+    # ------------------------------------------------------------------
+    # Operations (run on the writer thread, inside the group's transaction)
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _available(conn, account: str) -> Optional[int]:
+        row = conn.execute("SELECT total - spent - encumbered FROM budgets WHERE account = ?", (account,)).fetchone()
+        return row[0] if row else None
+
+    def _set_budget(self, conn, account: str, total: int, spent: int, only_if_missing: bool):
+        verb = "INSERT OR IGNORE" if only_if_missing else "INSERT OR REPLACE"
+        encumbered = conn.execute("SELECT COALESCE(SUM(amount), 0) FROM reservations WHERE account = ? "
+                                  "AND status = 'reserved'", (account,)).fetchone()[0]
+        conn.execute(f"{verb} INTO budgets (account, total, spent, encumbered) VALUES (?, ?, ?, ?)",
+                     (account, total, spent, encumbered))
+        return {"account": account}
+
+    def _reserve(self, conn, account: str, amount: int, reference: Optional[str]):
+        # Compare-and-swap: only encumber if the budget still covers the amount
+        swapped = conn.execute(
+            "UPDATE budgets SET encumbered = encumbered + ?, version = version + 1 "
+            "WHERE account = ? AND total - spent - encumbered >= ?", (amount, account, amount)).rowcount
+        reservation_id = None
+        if swapped:
+            reservation_id = f"RSV-{uuid.uuid4().hex[:12]}"
+            now = time.time()
+            conn.execute("INSERT INTO reservations (id, account, amount, status, reference, created, expires_at) "
+                         "VALUES (?, ?, ?, 'reserved', ?, ?, ?)",
+                         (reservation_id, account, amount, reference, now,
+                          now + self.reservation_ttl if self.reservation_ttl else None))
+        return {"ok": bool(swapped), "reservation_id": reservation_id, "available": self._available(conn, account)}
+
+    def _settle(self, conn, reservation_id: str, status: str, actual: Optional[int]):
+        row = conn.execute("SELECT account, amount FROM reservations WHERE id = ? AND status = 'reserved'",
+                           (reservation_id,)).fetchone()
+        if row is None:
+            raise LedgerError(f"Reservation {reservation_id} is not open")
+        account, amount = row
+        spent = (amount if actual is None else actual) if status == "committed" else 0
+        # Spending more than was reserved: the overrun must fit what is still available
+        overrun = max(0, spent - amount)
+        swapped = conn.execute(
+            "UPDATE budgets SET encumbered = encumbered - ?, spent = spent + ?, version = version + 1 "
+            "WHERE account = ? AND total - spent - encumbered >= ?", (amount, spent, account, overrun)).rowcount
+        if not swapped:
+            raise LedgerError(f"Committing {spent / 100:.2f} on reservation {reservation_id} needs "
+                              f"{overrun / 100:.2f} beyond it, more than {account} has available")
+        conn.execute("UPDATE reservations SET status = ?, settled = ?, committed_amount = ? WHERE id = ?",
+                     (status, time.time(), spent if status == "committed" else None, reservation_id))
+        return {"ok": True, "reservation_id": reservation_id, "account": account, "status": status,
+                "available": self._available(conn, account)}
+
+    def _expire(self, conn):
+        expired = conn.execute("SELECT id FROM reservations WHERE status = 'reserved' AND expires_at < ?",
+                               (time.time(),)).fetchall()
+        for (reservation_id,) in expired:
+            self._settle(conn, reservation_id, "expired", None)
+        if expired:
+            print(f"💰 Released {len(expired)} expired budget reservations")
+        return len(expired)
+
+    # ------------------------------------------------------------------
+    # Public API (async; amounts in currency units)
+    # ------------------------------------------------------------------
+
+    async def set_budget(self, account: str, total: float, spent: float = 0.0, only_if_missing: bool = False):
+        return await self.run("set_budget", BudgetLedger._set_budget, account, to_cents(total), to_cents(spent), only_if_missing)
+
+    async def reserve(self, account: str, amount: float, reference: Optional[str] = None) -> dict:
+        result = await self.run("reserve", BudgetLedger._reserve, account, to_cents(amount), reference)
+        return {**result, "available": (result["available"] or 0) / 100}
+
+    async def commit(self, reservation_id: str, actual_amount: Optional[float] = None) -> dict:
+        actual = None if actual_amount is None else to_cents(actual_amount)
+        result = await self.run("commit", BudgetLedger._settle, reservation_id, "committed", actual)
+        return {**result, "available": result["available"] / 100}
+
+    async def release(self, reservation_id: str) -> dict:
+        result = await self.run("release", BudgetLedger._settle, reservation_id, "released", None)
+        return {**result, "available": result["available"] / 100}
+
+    async def expire(self) -> int:
+        return await self.run("expire", BudgetLedger._expire)
+
+    # Reads (any thread, not queued behind writes) ----------------------
+
+    def balance(self, account: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT total, spent, encumbered FROM budgets WHERE account = ?",
+                                      (account,)).fetchone()
+        if row is None:
+            return None
+        total, spent, encumbered = row
+        return {"account": account, "total": total / 100, "spent": spent / 100, "encumbered": encumbered / 100,
+                "available": (total - spent - encumbered) / 100}
+
+    def balances(self) -> List[dict]:
+        accounts = [r[0] for r in self._connect().execute("SELECT account FROM budgets ORDER BY account")]
+        return [self.balance(a) for a in accounts]
+
+    def check_consistency(self) -> List[str]:
+        """Invariants: encumbered = open reservations, nothing overdrawn by reservations"""
+        problems = []
+        rows = self._connect().execute("""
+            SELECT b.account, b.total, b.spent, b.encumbered,
+                   COALESCE(SUM(CASE WHEN r.status = 'reserved' THEN r.amount END), 0)
+            FROM budgets b LEFT JOIN reservations r ON r.account = b.account
+            GROUP BY b.account""").fetchall()
+        for account, total, spent, encumbered, open_amount in rows:
+            if encumbered != open_amount:
+                problems.append(f"{account}: encumbered {encumbered / 100} != open reservations {open_amount / 100}")
+            if encumbered < 0:
+                problems.append(f"{account}: negative encumbrance")
+        return problems
+
+    def resolve_account(self, department: str, cost_center: Optional[str]) -> str:
+        """Cost-center budget when one exists, otherwise the department's"""
+        if cost_center:
+            account = account_key(department, cost_center)
+            if self.balance(account) is not None:
+                return account
+        return department
+
+
+def seed(ledger: BudgetLedger, budgets: Dict[str, dict]):
+    """Opening balances for accounts the ledger doesn't know yet (blocking, for startup)"""
+    futures = [ledger.submit("set_budget", BudgetLedger._set_budget, account, to_cents(b["total"]),
+                             to_cents(b.get("spent", 0.0)), True) for account, b in budgets.items()]
+    for future in futures:
+        future.result()
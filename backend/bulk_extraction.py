@@ -0,0 +1,245 @@
+"""
+Bulk Document Extraction
+Runs a backlog of documents (month-end AP runs) through the single-document
+extraction path as a pipeline: BULK_DOWNLOAD_CONCURRENCY downloads feed a
+bounded queue that BULK_EXTRACT_CONCURRENCY extractors (rasterize + model
+calls) drain, so downloads overlap model time without piling documents up
+in memory. Results are yielded as each document finishes.
+
+Rasterization is deliberately not a stage of its own. An extractor first
+checks the extraction cache and vendor layout templates, which need no
+pages at all, and a PDF's pages are then rendered lazily in the image pool,
+PDF_PAGE_CONCURRENCY at a time, so page N+1 renders while page N is with the
+model. A separate raster stage would render cache and template hits for
+nothing and hold every page of a queued document in memory.
+
+    BULK_DOWNLOAD_CONCURRENCY=8      documents downloaded at once
+    BULK_EXTRACT_CONCURRENCY=4       documents in rasterize/model at once
+    BULK_RUNS_DIR=data/bulk_runs     checkpoint files, one per run_id
+    BULK_INPUT_DIR=data/bulk_inputs  the only folder directory/manifest runs read
+
+Directories, manifests and the local files a manifest lists must resolve
+(symlinks followed) inside BULK_INPUT_DIR; anything else is rejected.
+
+Every finished document is appended to the run's checkpoint (NDJSON, flushed
+and fsynced per line). Re-submitting the same run_id replays the documents
+that already succeeded from the checkpoint and only extracts the rest;
+failed documents are retried.
+"""
+
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import metrics
+from metrics import REGISTRY
+from state_store import DATA_DIR
+
+BULK_DOWNLOAD_CONCURRENCY = int(os.getenv("BULK_DOWNLOAD_CONCURRENCY", "8"))
+BULK_EXTRACT_CONCURRENCY = int(os.getenv("BULK_EXTRACT_CONCURRENCY", "4"))
+BULK_RUNS_DIR = os.getenv("BULK_RUNS_DIR", os.path.join(DATA_DIR, "bulk_runs"))
+BULK_INPUT_DIR = os.getenv("BULK_INPUT_DIR", os.path.join(DATA_DIR, "bulk_inputs"))
+
+DOCUMENT_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff")
+
+BULK_DOCUMENTS = REGISTRY.counter(
+    "visionflow_bulk_documents_total", "Documents processed by bulk extraction runs (resumed = taken from a checkpoint)",
+    ("service", "outcome"))
+BULK_SECONDS = REGISTRY.histogram(
+    "visionflow_bulk_document_seconds", "Per-document time in a bulk run by pipeline stage", ("service", "stage"))
+
+
+@dataclass
+class BulkItem:
+    index: int
+    document_url: str
+    document_type: str
+
+    @property
+    def key(self) -> str:
+        return hashlib.sha256(f"{self.document_type}|{self.document_url}".encode()).hexdigest()[:32]
+
+
+def items_from_list(documents: List[dict], default_type: str = "invoice") -> List[BulkItem]:
+    return [BulkItem(i, d["document_url"], d.get("document_type") or default_type) for i, d in enumerate(documents)]
+
+
+def resolve_input(path: str, root: str = BULK_INPUT_DIR) -> str:
+    """path (relative to root, or absolute) as a real path inside root; ValueError otherwise"""
+    real_root = os.path.realpath(root)
+    real = os.path.realpath(os.path.join(real_root, path))
+    if os.path.commonpath([real_root, real]) != real_root:
+        raise ValueError(f"{path} is outside the bulk input directory")
+    return real
+
+
+def items_from_directory(path: str, default_type: str = "invoice", root: str = BULK_INPUT_DIR) -> List[BulkItem]:
+    """Every document file directly under path (inside root), in name order; links leading out are skipped"""
+    path = resolve_input(path, root)
+    files = []
+    for name in sorted(os.listdir(path)):
+        if not name.lower().endswith(DOCUMENT_EXTENSIONS):
+            continue
+        try:
+            files.append(resolve_input(os.path.join(path, name), root))
+        except ValueError:
+            print(f"  ⚠️ Skipping {name}: links outside the bulk input directory")
+    return [BulkItem(i, "file://" + f, default_type) for i, f in enumerate(files)]
+
+
+def items_from_manifest(path: str, default_type: str = "invoice", root: str = BULK_INPUT_DIR) -> List[BulkItem]:
+    """
+    JSON (a list, or {"documents": [...]}) or CSV with document_url (or path) and
+    optional document_type columns. Relative paths resolve against the manifest;
+    the manifest and every local file it lists must be inside root.
+    """
+    path = resolve_input(path, root)
+    base = os.path.dirname(path)
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = json.load(f)
+            rows = rows.get("documents", []) if isinstance(rows, dict) else rows
+    documents = []
+    for row in rows:
+        url = row.get("document_url") or row.get("path")
+        if not url:
+            raise ValueError(f"Manifest row without document_url/path: {row}")
+        if url.startswith("file://"):
+            url = "file://" + resolve_input(url[len("file://"):], root)
+        elif not re.match(r"^[a-z]+://", url):
+            url = "file://" + resolve_input(os.path.join(base, url), root)
+        documents.append({"document_url": url, "document_type": row.get("document_type")})
+    return items_from_list(documents, default_type)
+
+
+class Checkpoint:
+    """Append-only NDJSON record of the documents a run has finished"""
+
+    def __init__(self, run_id: str, directory: str = BULK_RUNS_DIR):
+        if not re.fullmatch(r"[A-Za-z0-9_.-]{1,100}", run_id):
+            raise ValueError("run_id may only contain letters, digits, '_', '-' and '.'")
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{run_id}.ndjson")
+        self._lock = threading.Lock()
+
+    def records(self) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass  # torn last line from an interrupted run
+        return records
+
+    def completed(self) -> Dict[str, dict]:
+        return {r["key"]: r for r in self.records() if r.get("status") == "ok"}
+
+    def append(self, record: dict):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+async def run(items: List[BulkItem], fetch: Callable[[BulkItem], Awaitable[bytes]],
+              extract: Callable[[BulkItem, bytes], Awaitable[dict]], checkpoint: Optional[Checkpoint] = None,
+              download_concurrency: int = BULK_DOWNLOAD_CONCURRENCY,
+              extract_concurrency: int = BULK_EXTRACT_CONCURRENCY) -> AsyncIterator[dict]:
+    """Yield one record per document as it finishes, then a final {"summary": ...}"""
+    start = time.perf_counter()
+    done = checkpoint.completed() if checkpoint else {}
+    counts = {"ok": 0, "error": 0, "resumed": 0}
+
+    pending: asyncio.Queue = asyncio.Queue()
+    for item in items:
+        if item.key in done:
+            counts["resumed"] += 1
+            BULK_DOCUMENTS.inc(metrics.SERVICE, "resumed")
+            yield {**done[item.key], "index": item.index, "status": "resumed"}
+        else:
+            pending.put_nowait(item)
+
+    # Bounded: downloads run ahead of the extractors by at most this many documents
+    fetched: asyncio.Queue = asyncio.Queue(maxsize=max(1, extract_concurrency) * 2)
+    finished: asyncio.Queue = asyncio.Queue()
+
+    async def downloader():
+        while True:
+            try:
+                item = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            t = time.perf_counter()
+            try:
+                content, error = await fetch(item), None
+            except Exception as e:
+                content, error = None, e
+            BULK_SECONDS.observe(time.perf_counter() - t, metrics.SERVICE, "download")
+            await fetched.put((item, content, error))
+
+    async def extractor():
+        while True:
+            entry = await fetched.get()
+            if entry is None:
+                return
+            item, content, error = entry
+            record = {"key": item.key, "index": item.index, "document_url": item.document_url,
+                      "document_type": item.document_type}
+            t = time.perf_counter()
+            if error is None:
+                try:
+                    record.update(status="ok", result=await extract(item, content))
+                except Exception as e:
+                    error = e
+            del content
+            if error is not None:
+                record.update(status="error", error=f"{type(error).__name__}: {error}")
+            BULK_SECONDS.observe(time.perf_counter() - t, metrics.SERVICE, "extract")
+            record["finished_at"] = time.time()
+            if checkpoint:
+                await asyncio.to_thread(checkpoint.append, record)
+            await finished.put(record)
+
+    async def pipeline():
+        try:
+            downloaders = [asyncio.ensure_future(downloader()) for _ in range(max(1, download_concurrency))]
+            extractors = [asyncio.ensure_future(extractor()) for _ in range(max(1, extract_concurrency))]
+            try:
+                await asyncio.gather(*downloaders)
+                for _ in extractors:
+                    await fetched.put(None)
+                await asyncio.gather(*extractors)
+            finally:
+                for task in downloaders + extractors:
+                    task.cancel()
+        finally:
+            await finished.put(None)
+
+    runner = asyncio.ensure_future(pipeline())
+    try:
+        while True:
+            record = await finished.get()
+            if record is None:
+                break
+            counts[record["status"]] += 1
+            BULK_DOCUMENTS.inc(metrics.SERVICE, record["status"])
+            yield record
+        await runner
+    finally:
+        # Client went away mid-stream: stop the pipeline; the checkpoint keeps what finished
+        runner.cancel()
+
+    yield {"summary": {"total": len(items), **counts, "seconds": round(time.perf_counter() - start, 2)}}
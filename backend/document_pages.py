@@ -0,0 +1,183 @@
+"""
+Multi-Page PDF Documents
+PDF ingestion for document extraction: pages are rasterized lazily, one page
+per image pool task at PDF_RASTER_DPI, extracted concurrently, and the
+per-page answers merged into one document.
+
+    PDF_RASTER_DPI=150        page raster resolution handed to the model
+    PDF_PAGE_CONCURRENCY=4    pages rasterized / in the model at once
+    PDF_MAX_PAGES=200         longer documents are rejected
+
+The PDF is spooled to a temp file once; each pool task opens it by path,
+renders a single page and returns it JPEG-encoded. A page is only rendered
+when a concurrency slot is free and is dropped after its model call, so a
+100-page document holds at most PDF_PAGE_CONCURRENCY page images.
+
+Merging is deterministic and in page order: header fields take the first
+non-empty value, totals the last one (they are printed at the end), and item
+lists are concatenated, skipping a row repeated across a page break.
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from io import BytesIO
+from typing import Awaitable, Callable, List, Optional
+
+from PIL import Image
+
+import image_pool
+import metrics
+from image_io import DOCUMENT_IMAGE_MAX_SIDE, MAX_DECODE_PIXELS
+from metrics import REGISTRY, record_stage
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # optional: PDFs are rejected without it
+    fitz = None
+
+PDF_RASTER_DPI = int(os.getenv("PDF_RASTER_DPI", "150"))
+PDF_PAGE_CONCURRENCY = int(os.getenv("PDF_PAGE_CONCURRENCY", "4"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "200"))
+
+# Fields that are printed once at the end of a document
+TOTAL_FIELDS = ("total_amount", "subtotal", "tax_amount", "total_estimated_cost")
+
+PDF_PAGES = REGISTRY.histogram(
+    "visionflow_document_pages", "Pages per extracted PDF document", ("service",),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 200))
+
+
+class UnsupportedDocumentError(Exception):
+    """The document can't be ingested here (no PDF support installed, too many pages)"""
+
+
+def available() -> bool:
+    return fitz is not None
+
+
+def is_pdf(data: bytes) -> bool:
+    return data[:1024].lstrip().startswith(b"%PDF-")
+
+
+def _render_page(path: str, page: int, dpi: int, max_side: int) -> dict:
+    """Pool task: rasterize one page and return it JPEG-encoded"""
+    with fitz.open(path) as doc:
+        rect = doc[page].rect
+        # Cap the raster before rendering, not after, so huge pages can't blow up memory
+        scale = min(dpi / 72, (MAX_DECODE_PIXELS / max(1.0, rect.width * rect.height)) ** 0.5)
+        pix = doc[page].get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csRGB, alpha=False)
+        image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    del pix
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.Resampling.BICUBIC)
+    mime, data = image_pool.encode_for_model(image, None)
+    return {"mime": mime, "data": data, "size": image.size}
+
+
+class PdfDocument:
+    """A PDF spooled to disk so pool workers can open it by path"""
+
+    def __init__(self, data: bytes):
+        if fitz is None:
+            raise UnsupportedDocumentError("PDF documents need PyMuPDF (pip install PyMuPDF)")
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        fd, self.path = tempfile.mkstemp(suffix=".pdf", prefix="visionflow-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            with fitz.open(self.path) as doc:
+                self.page_count = doc.page_count
+        except Exception:
+            self.close()
+            raise
+        if self.page_count > PDF_MAX_PAGES:
+            self.close()
+            raise UnsupportedDocumentError(f"PDF has {self.page_count} pages, limit is {PDF_MAX_PAGES}")
+
+    def close(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def page_image(self, page: int, dpi: int = PDF_RASTER_DPI,
+                         max_side: int = DOCUMENT_IMAGE_MAX_SIDE) -> Image.Image:
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(image_pool.get_pool(), _render_page, self.path, page, dpi, max_side)
+        record_stage("rasterize", time.perf_counter() - start)
+        image = Image.open(BytesIO(result["data"]))  # decoded only if something needs the pixels
+        # Same identity/blob convention as image_pool: hashes for replay/caches, bytes sent as-is
+        image.info["content_sha256"] = f"{self.sha256}:p{page}:{dpi}"
+        image.info["model_blob"] = (id(image), result["mime"], result["data"])
+        return image
+
+
+def page_prompt(prompt: str, page: int, page_count: int) -> str:
+    if page_count == 1:
+        return prompt
+    return (f"{prompt}\n\nThis image is PAGE {page + 1} OF {page_count} of one document. "
+            "Extract only what is printed on this page: use null for header or total fields that "
+            "are not shown here, and list only the line items visible on this page, in order.")
+
+
+def _empty(value) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+def merge_pages(pages: List[dict]) -> dict:
+    """Combine per-page extractions (in page order) into one document"""
+    if len(pages) == 1:
+        return pages[0]
+    merged: dict = {}
+    conflicts: dict = {}
+    for page_no, page in enumerate(pages, start=1):
+        for field, value in page.items():
+            if _empty(value):
+                continue
+            if isinstance(value, list):
+                items = merged.setdefault(field, [])
+                # A row split by the page break is often read on both pages
+                if items and value and items[-1] == value[0]:
+                    value = value[1:]
+                items.extend(value)
+            elif field not in merged or field in TOTAL_FIELDS:
+                merged[field] = value
+            elif merged[field] != value:
+                conflicts.setdefault(field, []).append({"page": page_no, "value": value})
+    if conflicts:
+        merged["page_conflicts"] = conflicts
+    return merged
+
+
+async def extract_pdf(data: bytes, extract_page: Callable[[Image.Image, int, int], Awaitable[dict]],
+                      concurrency: Optional[int] = None) -> tuple:
+    """
+    Rasterize and extract every page of a PDF, PDF_PAGE_CONCURRENCY pages at a
+    time; returns (merged extraction, page count). A failed page fails the document.
+    """
+    with PdfDocument(data) as doc:
+        PDF_PAGES.observe(doc.page_count, metrics.SERVICE)
+        slots = asyncio.Semaphore(concurrency or PDF_PAGE_CONCURRENCY)
+
+        async def one(page: int) -> dict:
+            async with slots:
+                image = await doc.page_image(page)
+                answer = await extract_page(image, page, doc.page_count)
+            if not isinstance(answer, dict):
+                raise ValueError(f"Page {page + 1} extraction is not a JSON object")
+            return answer
+
+        # Let every page finish before the temp file goes away, then surface the first failure
+        pages = await asyncio.gather(*(one(page) for page in range(doc.page_count)), return_exceptions=True)
+        for page in pages:
+            if isinstance(page, BaseException):
+                raise page
+        return merge_pages(list(pages)), doc.page_count
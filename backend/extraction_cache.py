@@ -0,0 +1,145 @@
+"""
+Document Extraction Cache
+Re-extracting a document that was already extracted (re-runs after a match
+failure, the same invoice attached to several emails) returns the stored
+result instead of paying for the model calls again.
+
+    EXTRACTION_CACHE=on            (default) off disables lookups and writes
+    EXTRACTION_CACHE_PATH=data/extraction_cache.db
+    EXTRACTION_CACHE_MAX_MB=256    stored results beyond this are evicted, least recently used first
+
+Entries are keyed by the sha256 of the document bytes, the document type and
+a prompt version: a hash of that type's extraction prompt and the model it is
+sent to. Editing a prompt or switching models changes the version, so older
+results stop matching without any manual flush; they are deleted at startup.
+
+The store is a SQLite file (WAL), shared by every worker process.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import metrics
+from metrics import REGISTRY
+from state_store import DATA_DIR
+
+EXTRACTION_CACHE = os.getenv("EXTRACTION_CACHE", "on").lower()
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", os.path.join(DATA_DIR, "extraction_cache.db"))
+EXTRACTION_CACHE_MAX_MB = float(os.getenv("EXTRACTION_CACHE_MAX_MB", "256"))
+
+EXTRACTION_CACHE_LOOKUPS = REGISTRY.counter(
+    "visionflow_extraction_cache_total", "Extraction cache lookups (hit, miss) and evictions", ("service", "outcome"))
+
+
+def prompt_version(prompt: str, model_name: str) -> str:
+    return hashlib.sha256(f"{model_name}\n{prompt}".encode()).hexdigest()[:16]
+
+
+class ExtractionCache:
+    def __init__(self, path: str = EXTRACTION_CACHE_PATH, max_bytes: int = int(EXTRACTION_CACHE_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                document_type TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                result TEXT NOT NULL,
+                extracted_at TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_extractions_last_used ON extractions(last_used);
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        # Same setup as SQLiteStateStore: one autocommit connection per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(content_sha256: str, document_type: str, version: str) -> str:
+        return hashlib.sha256(f"{content_sha256}|{document_type}|{version}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Stored {"result", "extracted_at"} for this key, marking it recently used"""
+        conn = self._conn()
+        row = conn.execute("SELECT result, extracted_at FROM extractions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            EXTRACTION_CACHE_LOOKUPS.inc(metrics.SERVICE, "miss")
+            return None
+        conn.execute("UPDATE extractions SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        EXTRACTION_CACHE_LOOKUPS.inc(metrics.SERVICE, "hit")
+        return {"result": json.loads(row[0]), "extracted_at": row[1]}
+
+    def put(self, key: str, document_type: str, version: str, result: dict, extracted_at: str):
+        payload = json.dumps(result, default=str)
+        if len(payload) > self.max_bytes:
+            return
+        self._conn().execute(
+            "INSERT OR REPLACE INTO extractions (key, document_type, prompt_version, result, extracted_at, size, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, document_type, version, payload, extracted_at, len(payload), time.time()))
+        self._evict()
+
+    def _evict(self):
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        while total > self.max_bytes:
+            rows = conn.execute("SELECT key, size FROM extractions ORDER BY last_used LIMIT 100").fetchall()
+            if not rows:
+                return
+            victims = []
+            for key, size in rows:
+                victims.append((key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            conn.executemany("DELETE FROM extractions WHERE key = ?", victims)
+            EXTRACTION_CACHE_LOOKUPS.inc(metrics.SERVICE, "evicted", amount=len(victims))
+
+    def purge_stale(self, versions: dict) -> int:
+        """Drop entries whose prompt version is no longer current ({document_type: version})"""
+        conn = self._conn()
+        removed = 0
+        for document_type, version in versions.items():
+            removed += conn.execute("DELETE FROM extractions WHERE document_type = ? AND prompt_version != ?",
+                                    (document_type, version)).rowcount
+        return removed
+
+    def stats(self) -> dict:
+        entries, size, hits = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM extractions").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "hits": hits}
+
+
+_cache: Optional[ExtractionCache] = None
+
+
+def configure(versions: dict, mode: str = EXTRACTION_CACHE) -> Optional[ExtractionCache]:
+    global _cache
+    if mode != "on":
+        _cache = None
+        return None
+    _cache = ExtractionCache()
+    removed = _cache.purge_stale(versions)
+    print(f"🗃️  Extraction cache: {_cache.path} (max {EXTRACTION_CACHE_MAX_MB:g} MB"
+          + (f", dropped {removed} results from older prompts)" if removed else ")"))
+    return _cache
+
+
+def get_cache() -> Optional[ExtractionCache]:
+    return _cache
@@ -0,0 +1,334 @@
+"""
+Conveyor Frame Sampling
+Turns a continuous camera stream into a few good frames per carton without
+holding the whole video in memory.
+
+- MJPEG (raw concatenated JPEGs or multipart/x-mixed-replace) is split
+  incrementally on JPEG start/end markers.
+- Other video (H.264/MP4...) is spooled to a temp file and read frame by frame
+  with OpenCV, which is optional (opencv-python-headless).
+Either way the stream is cut off at STREAM_MAX_BYTES, and a frame that fails
+to decode (corrupt or truncated JPEG) is counted and skipped.
+
+Every sampled frame is scored on a small grayscale thumbnail: motion against
+the previous sampled frame, sharpness (edge variance) and a 64-bit dHash.
+Frames are only candidates once the belt has settled; a settled frame whose
+dHash is far from the current carton's reference, or that follows a burst of
+belt motion (identical cartons in a row look the same), starts a new carton. Each
+carton keeps its top-K sharpest, non-duplicate frames. While nothing moves the
+sampling stride grows, so idle footage costs almost nothing.
+"""
+
+import os
+import tempfile
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import AsyncIterator, List, Optional, Union
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+import metrics
+from metrics import REGISTRY
+
+try:
+    import cv2
+except ImportError:  # optional: only needed for non-MJPEG video
+    cv2 = None
+
+STREAM_TOP_K = int(os.getenv("STREAM_TOP_K", "3"))
+STREAM_MAX_STRIDE = int(os.getenv("STREAM_MAX_STRIDE", "8"))
+STREAM_MAX_FRAME_BYTES = int(os.getenv("STREAM_MAX_FRAME_BYTES", str(8 * 1024 * 1024)))
+STREAM_MAX_BYTES = int(os.getenv("STREAM_MAX_BYTES", str(512 * 1024 * 1024)))
+# Mean absolute thumbnail difference (0-255) under which the belt counts as settled
+STREAM_MOTION_SETTLED = float(os.getenv("STREAM_MOTION_SETTLED", "6.0"))
+# dHash Hamming distances (out of 64 bits)
+STREAM_NEW_CARTON_BITS = int(os.getenv("STREAM_NEW_CARTON_BITS", "18"))
+STREAM_DUPLICATE_BITS = int(os.getenv("STREAM_DUPLICATE_BITS", "6"))
+# Consecutive moving frames that count as the belt advancing to the next carton
+STREAM_MOTION_BURST = int(os.getenv("STREAM_MOTION_BURST", "2"))
+
+STREAM_FRAMES_DROPPED = REGISTRY.counter(
+    "visionflow_stream_frames_dropped_total", "Stream frames skipped before scoring", ("service", "reason"))
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+THUMB_SIZE = (160, 120)
+MOTION_SIZE = (64, 48)
+
+
+class UnsupportedStreamError(ValueError):
+    """The stream is not MJPEG and OpenCV is not installed to read it"""
+
+
+# ----------------------------------------------------------------------------
+# Frame sources
+# ----------------------------------------------------------------------------
+
+class MJPEGSplitter:
+    """Incremental JPEG splitter; holds at most one partial frame"""
+
+    def __init__(self, max_frame_bytes: int = STREAM_MAX_FRAME_BYTES):
+        self.max_frame_bytes = max_frame_bytes
+        self.buf = bytearray()
+        self.oversized = 0
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        self.buf += chunk
+        frames = []
+        while True:
+            start = self.buf.find(SOI)
+            if start < 0:
+                # Keep a trailing 0xFF in case the marker is split across chunks
+                del self.buf[:-1]
+                break
+            end = self.buf.find(EOI, start + 2)
+            if end < 0:
+                del self.buf[:start]
+                if len(self.buf) > self.max_frame_bytes:
+                    self.oversized += 1
+                    self.buf.clear()
+                break
+            frames.append(bytes(self.buf[start:end + 2]))
+            del self.buf[:end + 2]
+        return frames
+
+
+def looks_like_mjpeg(first_bytes: bytes, content_type: str = "") -> bool:
+    content_type = content_type.lower()
+    if "mjpeg" in content_type or "x-mixed-replace" in content_type or content_type.startswith("image/jpeg"):
+        return True
+    return first_bytes[:2] == SOI or (first_bytes.startswith(b"--") and SOI in first_bytes)
+
+
+async def mjpeg_frames(chunks: AsyncIterator[bytes], sampler: "FrameSampler", first: bytes = b"",
+                       max_bytes: int = STREAM_MAX_BYTES):
+    """Yield the JPEG bytes of every frame the sampler wants, enforcing max_bytes"""
+    from image_io import ImageTooLargeError
+
+    splitter = MJPEGSplitter()
+    total = 0
+
+    async def all_chunks():
+        if first:
+            yield first
+        async for chunk in chunks:
+            yield chunk
+
+    try:
+        async for chunk in all_chunks():
+            total += len(chunk)
+            if total > max_bytes:
+                raise ImageTooLargeError(f"Stream exceeds {max_bytes} bytes")
+            for frame in splitter.feed(chunk):
+                if sampler.next_frame_wanted():
+                    yield frame
+    finally:
+        sampler.stats["oversized_frames"] = splitter.oversized
+        if splitter.oversized:
+            STREAM_FRAMES_DROPPED.inc(metrics.SERVICE, "oversized", amount=splitter.oversized)
+
+
+async def spool_to_file(chunks: AsyncIterator[bytes], first: bytes = b"", max_bytes: int = STREAM_MAX_BYTES) -> str:
+    """Write a stream to a temp file (caller deletes it), enforcing max_bytes"""
+    from image_io import ImageTooLargeError
+
+    fd, path = tempfile.mkstemp(prefix="visionflow-stream-", suffix=".video")
+    total = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if first:
+                f.write(first)
+                total += len(first)
+            async for chunk in chunks:
+                total += len(chunk)
+                if total > max_bytes:
+                    raise ImageTooLargeError(f"Stream exceeds {max_bytes} bytes")
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def open_video(path: str):
+    if cv2 is None:
+        raise UnsupportedStreamError("Only MJPEG streams are supported without OpenCV (pip install opencv-python-headless)")
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        cap.release()
+        raise UnsupportedStreamError("Could not open the video stream")
+    return cap
+
+
+def read_video_frame(cap, sampler: "FrameSampler"):
+    """
+    Return the next frame the sampler wants as a PIL image, or None at the end.
+    Skipped frames are only grabbed, never converted. Blocking: run in a thread.
+    """
+    while True:
+        wanted = sampler.next_frame_wanted()
+        if not cap.grab():
+            return None
+        if not wanted:
+            continue
+        ok, frame = cap.retrieve()
+        if not ok:
+            return None
+        return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+# ----------------------------------------------------------------------------
+# Scoring & carton segmentation
+# ----------------------------------------------------------------------------
+
+def dhash(gray: Image.Image) -> int:
+    small = gray.resize((9, 8), Image.Resampling.BILINEAR)
+    px = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def thumbnail(frame: Union[bytes, Image.Image]) -> Image.Image:
+    if isinstance(frame, (bytes, bytearray)):
+        image = Image.open(BytesIO(frame))
+        # Decode at 1/8 scale: scoring never needs full resolution
+        image.draft("L", THUMB_SIZE)
+    else:
+        image = frame
+    gray = image.convert("L")
+    gray.thumbnail(THUMB_SIZE)
+    return gray
+
+
+@dataclass
+class KeptFrame:
+    frame_index: int
+    sharpness: float
+    hash: int
+    jpeg: bytes
+
+
+@dataclass
+class CartonSegment:
+    index: int
+    reference_hash: int
+    frames: List[KeptFrame] = field(default_factory=list)
+
+    def best(self, n: int) -> List[KeptFrame]:
+        return sorted(self.frames, key=lambda f: f.sharpness, reverse=True)[:n]
+
+
+class FrameSampler:
+    """
+    Feed frames in stream order: call next_frame_wanted() once per decoded or
+    split frame, and add_frame() for those it wants. add_frame() returns a
+    finished CartonSegment when the frame starts a new carton; finish() returns
+    the last one.
+    """
+
+    def __init__(self, top_k: int = STREAM_TOP_K, max_stride: int = STREAM_MAX_STRIDE,
+                 settled: float = STREAM_MOTION_SETTLED, new_carton_bits: int = STREAM_NEW_CARTON_BITS,
+                 duplicate_bits: int = STREAM_DUPLICATE_BITS, motion_burst: int = STREAM_MOTION_BURST):
+        self.top_k = top_k
+        self.max_stride = max_stride
+        self.settled = settled
+        self.new_carton_bits = new_carton_bits
+        self.duplicate_bits = duplicate_bits
+        self.motion_burst = motion_burst
+
+        self.frame_index = -1
+        self.stride = 1
+        self.still_frames = 0
+        self.moving_frames = 0
+        self.last_sampled = -1
+        self.prev_motion_thumb: Optional[Image.Image] = None
+        self.segment: Optional[CartonSegment] = None
+        self.cartons = 0
+        self.stats = {"frames_received": 0, "frames_scored": 0, "frames_moving": 0,
+                      "duplicates_dropped": 0, "oversized_frames": 0, "corrupt_frames": 0}
+
+    def next_frame_wanted(self) -> bool:
+        self.frame_index += 1
+        self.stats["frames_received"] += 1
+        return self.frame_index - self.last_sampled >= self.stride
+
+    def add_frame(self, frame: Union[bytes, Image.Image]) -> Optional[CartonSegment]:
+        try:
+            gray = thumbnail(frame)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            # Corrupt or truncated frame: skip it, the next one is sampled instead
+            self.stats["corrupt_frames"] += 1
+            STREAM_FRAMES_DROPPED.inc(metrics.SERVICE, "corrupt")
+            return None
+        self.last_sampled = self.frame_index
+        self.stats["frames_scored"] += 1
+        motion_thumb = gray.resize(MOTION_SIZE)
+
+        if self.prev_motion_thumb is None:
+            motion = 0.0
+        else:
+            motion = ImageStat.Stat(ImageChops.difference(motion_thumb, self.prev_motion_thumb)).mean[0]
+        self.prev_motion_thumb = motion_thumb
+
+        # Adaptive stride: back off while nothing changes, snap back on motion
+        if motion < self.settled / 2:
+            self.still_frames += 1
+            if self.still_frames >= 3:
+                self.stride = min(self.max_stride, self.stride * 2)
+                self.still_frames = 0
+        else:
+            self.still_frames = 0
+            self.stride = 1
+
+        if motion > self.settled:
+            self.stats["frames_moving"] += 1
+            self.moving_frames += 1
+            return None
+        belt_moved = self.moving_frames >= self.motion_burst
+        self.moving_frames = 0
+
+        frame_hash = dhash(gray)
+        sharpness = ImageStat.Stat(gray.filter(ImageFilter.FIND_EDGES)).var[0]
+
+        finished = None
+        distance = hamming(frame_hash, self.segment.reference_hash) if self.segment else 64
+        if belt_moved or distance > self.new_carton_bits:
+            finished = self.segment
+            self.segment = CartonSegment(index=self.cartons, reference_hash=frame_hash)
+            self.cartons += 1
+        self._keep(frame, frame_hash, sharpness)
+        return finished if finished and finished.frames else None
+
+    def finish(self) -> Optional[CartonSegment]:
+        segment, self.segment = self.segment, None
+        return segment if segment and segment.frames else None
+
+    def _keep(self, frame, frame_hash: int, sharpness: float):
+        frames = self.segment.frames
+        for i, kept in enumerate(frames):
+            if hamming(frame_hash, kept.hash) <= self.duplicate_bits:
+                self.stats["duplicates_dropped"] += 1
+                if sharpness > kept.sharpness:
+                    frames[i] = KeptFrame(self.frame_index, sharpness, frame_hash, _as_jpeg(frame))
+                return
+        if len(frames) >= self.top_k:
+            worst = min(range(len(frames)), key=lambda i: frames[i].sharpness)
+            if frames[worst].sharpness >= sharpness:
+                return
+            frames.pop(worst)
+        frames.append(KeptFrame(self.frame_index, sharpness, frame_hash, _as_jpeg(frame)))
+
+
+def _as_jpeg(frame: Union[bytes, Image.Image]) -> bytes:
+    if isinstance(frame, (bytes, bytearray)):
+        return bytes(frame)
+    buf = BytesIO()
+    frame.save(buf, "JPEG", quality=92)
+    return buf.getvalue()
@@ -0,0 +1,135 @@
+"""
+Gemini Call Wrapper
+Single place where both backends call generate_content, so timing,
+error counting and parse-failure accounting are recorded consistently.
+"""
+
+import os
+
+import google.generativeai as genai
+from PIL import Image
+
+import time
+
+import hedging
+import image_registry
+import metrics
+import model_replay
+from metrics import stage, GEMINI_CALLS, GEMINI_ERRORS, PARSE_FAILURES, CACHE_HITS, CACHE_MISSES
+
+def configure_gemini(api_key: str):
+    """
+    genai.configure(), honouring GEMINI_API_ENDPOINT so calls can be routed
+    to a Gemini-compatible stand-in such as benchmarks/fake_gemini.py.
+    """
+    endpoint = os.getenv("GEMINI_API_ENDPOINT")
+    if endpoint:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+        print(f"🧪 Gemini calls routed to {endpoint}")
+    else:
+        genai.configure(api_key=api_key)
+
+
+def _error_kind(e: Exception) -> str:
+    text = str(e).lower()
+    if "429" in text or "quota" in text or "resource exhausted" in text:
+        return "rate_limit"
+    if "timeout" in text or "deadline" in text:
+        return "timeout"
+    return "other"
+
+
+def model_name(model) -> str:
+    return getattr(model, "model_name", None) or "unknown"
+
+
+def _wire_parts(parts, use_registry: bool = True):
+    # Images already encoded by the image pool go out as blobs, so the SDK
+    # doesn't re-encode them on the request thread. PIL copies info into
+    # derived images (crop, convert...), so the blob is only used by the
+    # exact object it was made for. With IMAGE_REGISTRY on, images are sent
+    # as file handles uploaded on first use. Returns (parts, handles used).
+    use_registry = use_registry and image_registry.enabled()
+    wired, handles = [], []
+    for part in parts:
+        blob = (getattr(part, "info", None) or {}).get("model_blob")
+        if blob and blob[0] == id(part):
+            mime_type, data = blob[1], blob[2]
+        elif use_registry and isinstance(part, Image.Image):
+            mime_type, data = image_registry.encode(part)
+        else:
+            wired.append(part)
+            continue
+        handle = image_registry.resolve(mime_type, data) if use_registry else None
+        if handle:
+            wired.append(image_registry.file_part(handle))
+            handles.append(handle)
+        else:
+            wired.append({"mime_type": mime_type, "data": data})
+    return wired, handles
+
+
+def _send(model, name: str, wired):
+    GEMINI_CALLS.inc(metrics.SERVICE, name)
+    start = time.perf_counter()
+    try:
+        response = model.generate_content(wired)
+    except Exception as e:
+        GEMINI_ERRORS.inc(metrics.SERVICE, name, _error_kind(e))
+        raise
+    hedging.LATENCY.observe(name, time.perf_counter() - start)
+    return response
+
+
+def _call_model(model, name: str, parts, hedge: bool = False):
+    hedging.BUDGET.earn()
+    wired, handles = _wire_parts(parts)
+    with stage("model_call"):
+        try:
+            if hedge:
+                return hedging.hedged_call(lambda: _send(model, name, wired), name)
+            return _send(model, name, wired)
+        except Exception as e:
+            if not handles or not image_registry.is_handle_error(e):
+                raise
+            print(f"  ⚠️ Image handle rejected ({e}), resending the image inline")
+            image_registry.forget(handles)
+            return _send(model, name, _wire_parts(parts, use_registry=False)[0])
+
+
+def generate_content(model, parts, hedge: bool = False):
+    """
+    Call model.generate_content(parts) inside the 'model_call' stage.
+    hedge=True (CRITICAL priority under HEDGE_POLICY) allows a second call if the first is slow.
+    In record/replay mode (MODEL_REPLAY_MODE) responses are stored/served from disk.
+    """
+    name = model_name(model)
+    if model_replay.REPLAY_MODE == "off":
+        return _call_model(model, name, parts, hedge)
+
+    key = model_replay.request_key(name, parts)
+    if model_replay.REPLAY_MODE == "replay":
+        with stage("model_call"):
+            response = model_replay.replay(model_replay.STORE, key)
+        if response is not None:
+            CACHE_HITS.inc(metrics.SERVICE, "model_replay")
+            return response
+        CACHE_MISSES.inc(metrics.SERVICE, "model_replay")
+        if model_replay.REPLAY_MISS != "live":
+            raise model_replay.ReplayMissError(
+                f"No recorded response for prompt {key['prompt_hash'][:12]} / images {key['images_hash'][:12]}")
+
+    start = time.perf_counter()
+    response = _call_model(model, name, parts, hedge)
+    model_replay.STORE.save(key, response.text, time.perf_counter() - start, model_replay.usage_dict(response))
+    return response
+
+
+def parse_json(parser, text: str):
+    """Run a JSON extractor inside the 'json_parse' stage, counting failures"""
+    with stage("json_parse"):
+        try:
+            return parser(text)
+        except Exception:
+            PARSE_FAILURES.inc(metrics.SERVICE)
+            raise
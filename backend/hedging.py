@@ -0,0 +1,133 @@
+"""
+Hedged Model Calls
+Cuts the Gemini latency tail for CRITICAL-priority work: if the primary call
+hasn't answered by the tracked HEDGE_PERCENTILE of recent call latency, a
+second identical call is issued and whichever finishes first wins.
+
+    HEDGE_POLICY=off        never hedge (default)
+    HEDGE_POLICY=critical   hedge calls made for CRITICAL-priority requests
+
+Hedges are paid for from a global budget: every primary call earns
+HEDGE_BUDGET (e.g. 0.05) of a token and each hedge costs one, so extra calls
+can never exceed that fraction of all calls. The SDK call is synchronous and
+cannot be aborted once it is on the wire; the losing call is cancelled if it
+hasn't started yet and otherwise its response is dropped.
+"""
+
+import contextvars
+import os
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict
+
+import metrics
+from metrics import REGISTRY
+
+HEDGE_POLICY = os.getenv("HEDGE_POLICY", "off").lower()
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+# Delay used until HEDGE_MIN_SAMPLES latencies have been seen, and the floor afterwards
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "8.0"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "500"))
+HEDGE_THREADS = int(os.getenv("HEDGE_THREADS", "16"))
+
+HEDGE_CALLS = REGISTRY.counter(
+    "visionflow_hedge_total",
+    "Hedge-eligible model calls by outcome (primary_only, primary_won, hedge_won, no_budget)",
+    ("service", "outcome"))
+HEDGE_DELAY = REGISTRY.histogram(
+    "visionflow_hedge_delay_seconds", "Wait before a hedge was considered (tracked latency percentile)", ("service",))
+
+
+def enabled_for(priority: str) -> bool:
+    return HEDGE_POLICY == "critical" and (priority or "").upper() == "CRITICAL"
+
+
+class LatencyTracker:
+    """Percentile over the last HEDGE_WINDOW successful call latencies, per model"""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, model: str, pct: float):
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def hedge_delay(self, model: str) -> float:
+        value = self.percentile(model, HEDGE_PERCENTILE)
+        return HEDGE_DEFAULT_DELAY if value is None else max(HEDGE_MIN_DELAY, value)
+
+
+class HedgeBudget:
+    """Token bucket: every model call (hedged or not) adds `fraction` of a token, each hedge spends one"""
+
+    def __init__(self, fraction: float = HEDGE_BUDGET, burst: float = 5.0):
+        self.fraction = fraction
+        self.burst = burst
+        self.tokens = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.fraction)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+LATENCY = LatencyTracker()
+BUDGET = HedgeBudget()
+_executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="hedge")
+
+
+def _submit(fn: Callable):
+    # Run in the caller's context so stage timings still reach the request
+    return _executor.submit(contextvars.copy_context().run, fn)
+
+
+def hedged_call(fn: Callable, model: str):
+    """
+    Run fn(); if it hasn't returned after the model's hedge delay and the budget
+    allows, run it again and return the first successful result.
+    """
+    delay = LATENCY.hedge_delay(model)
+    HEDGE_DELAY.observe(delay, metrics.SERVICE)
+    primary = _submit(fn)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        HEDGE_CALLS.inc(metrics.SERVICE, "primary_only")
+        return primary.result()
+    if not BUDGET.try_spend():
+        HEDGE_CALLS.inc(metrics.SERVICE, "no_budget")
+        return primary.result()
+
+    print(f"  ⏩ Model call slower than p{HEDGE_PERCENTILE:g} ({delay:.1f}s), sending a hedge")
+    hedge = _submit(fn)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.cancel()
+                HEDGE_CALLS.inc(metrics.SERVICE, "primary_won" if future is primary else "hedge_won")
+                return future.result()
+            error = error or future.exception()
+    raise error
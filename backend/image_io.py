@@ -0,0 +1,200 @@
+"""
+Image Ingestion
+Streamed, size-capped reads of uploads and URLs, followed by reduced-resolution
+decoding (JPEG draft mode + thumbnail) straight to the size the model needs.
+
+Per-request memory is bounded by MAX_IMAGE_BYTES for the encoded payload and
+MAX_DECODE_PIXELS for the decoded bitmap, whatever the input size.
+"""
+
+import hashlib
+import os
+from io import BytesIO
+from typing import Optional
+
+import requests
+from PIL import Image
+
+import metrics
+from metrics import REGISTRY
+
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+MAX_DECODE_PIXELS = int(os.getenv("MAX_DECODE_PIXELS", str(40_000_000)))
+# Longest side of the image handed to the model (0 = keep original size)
+MODEL_IMAGE_MAX_SIDE = int(os.getenv("MODEL_IMAGE_MAX_SIDE", "1536"))
+DOCUMENT_IMAGE_MAX_SIDE = int(os.getenv("DOCUMENT_IMAGE_MAX_SIDE", "2048"))
+CHUNK_SIZE = 64 * 1024
+USER_AGENT = {"User-Agent": "Mozilla/5.0"}
+
+# PIL refuses anything past 2x this as a decompression bomb
+Image.MAX_IMAGE_PIXELS = MAX_DECODE_PIXELS
+
+BYTE_BUCKETS = (64e3, 256e3, 1e6, 4e6, 16e6, 32e6, 64e6, 128e6, 256e6)
+IMAGE_BYTES = REGISTRY.histogram(
+    "visionflow_image_bytes", "Bytes held per image request (payload, decoded bitmap, estimated peak)",
+    ("service", "kind"), buckets=BYTE_BUCKETS)
+IMAGES_REJECTED = REGISTRY.counter(
+    "visionflow_images_rejected_total", "Images rejected before decoding", ("service", "reason"))
+
+
+class ImageTooLargeError(ValueError):
+    """Payload or decoded size exceeds the configured cap"""
+
+
+def _reject(reason: str, message: str):
+    IMAGES_REJECTED.inc(metrics.SERVICE, reason)
+    raise ImageTooLargeError(message)
+
+
+async def read_upload(file, max_bytes: int = MAX_IMAGE_BYTES) -> bytes:
+    """Read an UploadFile in chunks, aborting as soon as max_bytes is exceeded"""
+    size = getattr(file, "size", None)
+    if size is not None and size > max_bytes:
+        _reject("upload_too_large", f"Upload is {size} bytes, limit is {max_bytes}")
+    buf = bytearray()
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        buf += chunk
+        if len(buf) > max_bytes:
+            _reject("upload_too_large", f"Upload exceeds {max_bytes} bytes")
+    return bytes(buf)
+
+
+def download(url: str, max_bytes: int = MAX_IMAGE_BYTES, timeout: float = 10) -> bytes:
+    """Stream a URL into memory, aborting early on Content-Length or once max_bytes is exceeded"""
+    with requests.get(url, timeout=timeout, headers=USER_AGENT, stream=True) as resp:
+        resp.raise_for_status()
+        declared = resp.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            _reject("download_too_large", f"Remote file is {declared} bytes, limit is {max_bytes}")
+        buf = bytearray()
+        for chunk in resp.iter_content(CHUNK_SIZE):
+            buf += chunk
+            if len(buf) > max_bytes:
+                _reject("download_too_large", f"Remote file exceeds {max_bytes} bytes")
+    return bytes(buf)
+
+
+def read_file(path: str, max_bytes: int = MAX_IMAGE_BYTES) -> bytes:
+    size = os.path.getsize(path)
+    if size > max_bytes:
+        _reject("file_too_large", f"File is {size} bytes, limit is {max_bytes}")
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def decode_pixels(data: bytes, max_side: Optional[int] = MODEL_IMAGE_MAX_SIDE):
+    """
+    Decode straight to (at most) max_side on the longest edge and return
+    (image, bytes of the full-size decoded bitmap). JPEGs use draft mode so the
+    DCT scaler skips most of the work; other formats are decoded once and
+    thumbnailed. Touches no metrics so it can run inside a pool worker.
+    """
+    image = Image.open(BytesIO(data))
+    if max_side and image.format == "JPEG":
+        image.draft("RGB", (max_side, max_side))
+
+    width, height = image.size
+    if width * height > MAX_DECODE_PIXELS:
+        raise ImageTooLargeError(f"Image is {width}x{height}, limit is {MAX_DECODE_PIXELS} pixels")
+    image.load()
+    decoded_bytes = width * height * len(image.getbands())
+
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.Resampling.BICUBIC, reducing_gap=2.0)
+    return image, decoded_bytes
+
+
+def observe_decode(payload_bytes: int, decoded_bytes: int, image: Image.Image):
+    final_bytes = image.size[0] * image.size[1] * len(image.getbands())
+    IMAGE_BYTES.observe(payload_bytes, metrics.SERVICE, "payload")
+    IMAGE_BYTES.observe(decoded_bytes, metrics.SERVICE, "decoded")
+    IMAGE_BYTES.observe(payload_bytes + decoded_bytes + final_bytes, metrics.SERVICE, "peak")
+
+
+def decode_image(data: bytes, max_side: Optional[int] = MODEL_IMAGE_MAX_SIDE) -> Image.Image:
+    """
+    Decode in the calling thread. The content hash of the original bytes is
+    kept in image.info["content_sha256"] for caches and record/replay.
+    """
+    try:
+        image, decoded_bytes = decode_pixels(data, max_side)
+    except ImageTooLargeError:
+        IMAGES_REJECTED.inc(metrics.SERVICE, "too_many_pixels")
+        raise
+    image.info["content_sha256"] = hashlib.sha256(data).hexdigest()
+    observe_decode(len(data), decoded_bytes, image)
+    return image
+
+
+class BodySizeLimitMiddleware:
+    """
+    Reject request bodies over max_bytes before they are parsed: immediately when
+    Content-Length is too large, otherwise as soon as the streamed body crosses it.
+    """
+
+    def __init__(self, app, max_bytes: int, exempt_prefixes=()):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.exempt_prefixes = tuple(exempt_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith(self.exempt_prefixes):
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                IMAGES_REJECTED.inc(metrics.SERVICE, "body_too_large")
+                return await self._reject(send)
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    IMAGES_REJECTED.inc(metrics.SERVICE, "body_too_large")
+                    raise ImageTooLargeError(f"Request body exceeds {self.max_bytes} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded:
+                # Body parsing failed because we cut it off: answer 413 whatever the app made of it
+                if not started:
+                    started = True
+                    await self._reject(send)
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except ImageTooLargeError:
+            if not started:
+                await self._reject(send)
+
+    async def _reject(self, send):
+        body = b'{"detail":"Request body too large"}'
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def install_image_limits(app, max_bytes: int = MAX_IMAGE_BYTES + 1024 * 1024, exempt_prefixes=()):
+    """Cap request bodies and turn ImageTooLargeError into HTTP 413"""
+    from fastapi.responses import JSONResponse
+
+    app.add_middleware(BodySizeLimitMiddleware, max_bytes=max_bytes, exempt_prefixes=exempt_prefixes)
+
+    @app.exception_handler(ImageTooLargeError)
+    async def image_too_large(request, exc: ImageTooLargeError):
+        return JSONResponse(status_code=413, content={"detail": str(exc)})
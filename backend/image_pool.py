@@ -0,0 +1,192 @@
+"""
+Image Process Pool
+Runs decode, resize and model re-encode in worker processes so PIL work
+doesn't hold the GIL on the event-loop process.
+
+Payloads travel through multiprocessing.shared_memory: the parent writes the
+encoded bytes into a segment, the worker writes the decoded pixels plus the
+re-encoded model payload into another, and only segment names and shapes go
+through the pool's pipe. Images under IMAGE_POOL_MIN_BYTES are decoded in a
+thread, where the handoff would cost more than the decode.
+
+    IMAGE_POOL_SIZE=4            worker processes (0 = always decode in-thread)
+    IMAGE_POOL_MIN_BYTES=262144  smaller payloads skip the pool
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+from PIL import Image
+
+import metrics
+from image_io import (MODEL_IMAGE_MAX_SIDE, IMAGES_REJECTED, ImageTooLargeError,
+                      decode_image, decode_pixels, observe_decode)
+from metrics import REGISTRY
+
+IMAGE_POOL_SIZE = int(os.getenv("IMAGE_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+IMAGE_POOL_MIN_BYTES = int(os.getenv("IMAGE_POOL_MIN_BYTES", str(256 * 1024)))
+# JPEG quality for images re-encoded for the model (PNG sources stay PNG)
+MODEL_JPEG_QUALITY = int(os.getenv("MODEL_JPEG_QUALITY", "90"))
+
+POOL_DECODES = REGISTRY.counter(
+    "visionflow_image_decodes_total", "Image decodes by where they ran", ("service", "path"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+# ----------------------------------------------------------------------------
+# Worker side
+# ----------------------------------------------------------------------------
+
+def encode_for_model(image: Image.Image, source_format: Optional[str]):
+    # Same choice the SDK makes: lossless PNG for PNG sources / alpha, JPEG otherwise
+    buf = BytesIO()
+    if source_format == "PNG" or image.mode in ("RGBA", "LA", "P"):
+        image.save(buf, "PNG")
+        return "image/png", buf.getvalue()
+    image.convert("RGB").save(buf, "JPEG", quality=MODEL_JPEG_QUALITY)
+    return "image/jpeg", buf.getvalue()
+
+
+def _decode_in_worker(in_name: str, in_size: int, max_side: Optional[int]) -> dict:
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    try:
+        data = shm_in.buf[:in_size]
+        try:
+            sha = hashlib.sha256(data).hexdigest()
+            image, decoded_bytes = decode_pixels(data, max_side)
+        finally:
+            data.release()
+    finally:
+        shm_in.close()
+
+    source_format = image.format
+    if image.mode in ("P", "PA", "LA", "1"):
+        # Raw pixels of these modes don't carry the palette (or read back wrong):
+        # send the parent a mode frombytes() can rebuild on its own
+        alpha = image.mode in ("PA", "LA") or "transparency" in image.info
+        image = image.convert("RGBA" if alpha else "RGB")
+    pixels = image.tobytes()
+    mime, encoded = encode_for_model(image, source_format)
+
+    shm_out = shared_memory.SharedMemory(create=True, size=max(1, len(pixels) + len(encoded)))
+    shm_out.buf[:len(pixels)] = pixels
+    shm_out.buf[len(pixels):len(pixels) + len(encoded)] = encoded
+    shm_out.close()
+    return {"name": shm_out.name, "mode": image.mode, "size": image.size, "format": source_format,
+            "pixel_bytes": len(pixels), "encoded_bytes": len(encoded), "mime": mime,
+            "sha256": sha, "decoded_bytes": decoded_bytes}
+
+
+def _warm():
+    return os.getpid()
+
+
+# ----------------------------------------------------------------------------
+# Parent side
+# ----------------------------------------------------------------------------
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if IMAGE_POOL_SIZE <= 0:
+        return None
+    if _pool is None:
+        # Workers must share the parent's resource tracker, or segments created
+        # in a worker look leaked once the parent unlinks them
+        resource_tracker.ensure_running()
+        # Never fork: the server is multithreaded (to_thread workers, hedge
+        # executor, ledger writer) and a forked child can inherit a held lock.
+        # forkserver children start from a clean single-threaded process
+        # and only import this module, not the app
+        method = "forkserver" if sys.platform.startswith("linux") else "spawn"
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_POOL_SIZE, mp_context=multiprocessing.get_context(method))
+        print(f"🧵 Image pool started: {IMAGE_POOL_SIZE} workers ({method})")
+    return _pool
+
+
+def _collect(result: dict, payload_bytes: int) -> Image.Image:
+    shm_out = shared_memory.SharedMemory(name=result["name"])
+    try:
+        end = result["pixel_bytes"]
+        image = Image.frombytes(result["mode"], result["size"], bytes(shm_out.buf[:end]))
+        encoded = bytes(shm_out.buf[end:end + result["encoded_bytes"]])
+    finally:
+        shm_out.close()
+        shm_out.unlink()
+    image.format = result["format"]
+    image.info["content_sha256"] = result["sha256"]
+    image.info["model_blob"] = (id(image), result["mime"], encoded)
+    observe_decode(payload_bytes, result["decoded_bytes"], image)
+    return image
+
+
+def _discard(future: Future):
+    """Done-callback for a decode nobody awaits any more: free the worker's output segment"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    shm_out = shared_memory.SharedMemory(name=future.result()["name"])
+    shm_out.close()
+    shm_out.unlink()
+
+
+async def decode_image_async(data: bytes, max_side: Optional[int] = MODEL_IMAGE_MAX_SIDE) -> Image.Image:
+    """decode_image() off the event loop: in the process pool, or in a thread for small payloads"""
+    global _pool
+    pool = get_pool() if len(data) >= IMAGE_POOL_MIN_BYTES else None
+    if pool is None:
+        POOL_DECODES.inc(metrics.SERVICE, "inline")
+        return await asyncio.to_thread(decode_image, data, max_side)
+
+    shm_in = shared_memory.SharedMemory(create=True, size=len(data))
+    try:
+        shm_in.buf[:len(data)] = data
+        future = pool.submit(_decode_in_worker, shm_in.name, len(data), max_side)
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # A decode already running can't be cancelled: unlink its output when it lands
+            future.add_done_callback(_discard)
+            raise
+    except ImageTooLargeError:
+        IMAGES_REJECTED.inc(metrics.SERVICE, "too_many_pixels")
+        raise
+    except BrokenProcessPool:
+        print("⚠️  Image pool died, restarting it and decoding in-thread")
+        if _pool is pool:
+            _pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        POOL_DECODES.inc(metrics.SERVICE, "fallback")
+        return await asyncio.to_thread(decode_image, data, max_side)
+    finally:
+        shm_in.close()
+        shm_in.unlink()
+    POOL_DECODES.inc(metrics.SERVICE, "pool")
+    return _collect(result, len(data))
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def install_image_pool(app):
+    """Start the pool with the app (so the first request doesn't pay for worker start-up) and stop it on shutdown"""
+
+    async def start():
+        pool = get_pool()
+        if pool is not None:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(pool, _warm) for _ in range(IMAGE_POOL_SIZE)))
+
+    app.router.add_event_handler("startup", start)
+    app.router.add_event_handler("shutdown", shutdown_pool)
@@ -0,0 +1,199 @@
+"""
+Image Handle Registry
+Uploads each normalized model image once to a file service and sends later
+model calls a reference to it instead of the bytes. The same shipment photo
+is typically sent to Gemini several times (inspection, label check, fused
+check, re-checks); only the first call pays for the upload.
+
+    IMAGE_REGISTRY=off      images travel inline with every call (default)
+    IMAGE_REGISTRY=gemini   Gemini File API (files expire after ~48h)
+    IMAGE_REGISTRY=local    files written under IMAGE_REGISTRY_DIR, for tests
+                            and the fake Gemini server (benchmarks/fake_gemini.py)
+
+Handles are keyed by the sha256 of the encoded bytes actually sent, so crops
+and resized copies get their own entry and can never alias the original.
+They live in the shared state store (namespace "image_handles") with a TTL a
+little shorter than the provider's expiry, so every worker reuses them. A
+handle the provider rejects (deleted or expired early) is dropped and the
+call is resent with the bytes inline.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+import metrics
+from image_pool import encode_for_model
+from metrics import REGISTRY, stage
+from state_store import DATA_DIR, InMemoryStateStore, StateStore
+
+IMAGE_REGISTRY = os.getenv("IMAGE_REGISTRY", "off").lower()
+IMAGE_REGISTRY_DIR = os.getenv("IMAGE_REGISTRY_DIR", os.path.join(DATA_DIR, "image_files"))
+# Smaller images go inline: an extra upload round trip costs more than the bytes
+IMAGE_REGISTRY_MIN_BYTES = int(os.getenv("IMAGE_REGISTRY_MIN_BYTES", str(64 * 1024)))
+# Lifetime of local handles; Gemini handles use the expiry the File API reports
+IMAGE_HANDLE_TTL = float(os.getenv("IMAGE_HANDLE_TTL", str(47 * 3600)))
+# Handles this close to expiry are re-uploaded rather than risk a rejected call
+IMAGE_HANDLE_MARGIN = float(os.getenv("IMAGE_HANDLE_MARGIN", "600"))
+
+NAMESPACE = "image_handles"
+# Locks serializing concurrent uploads of the same image within a process
+UPLOAD_LOCK_STRIPES = 64
+
+IMAGE_HANDLES = REGISTRY.counter(
+    "visionflow_image_handles_total",
+    "Model images by how they were sent (uploaded, reused, inline, rejected, upload_failed)",
+    ("service", "outcome"))
+UPLOAD_SECONDS = REGISTRY.histogram(
+    "visionflow_image_upload_seconds", "Time to upload one image to the file service", ("service", "provider"))
+BYTES_SAVED = REGISTRY.counter(
+    "visionflow_image_bytes_saved_total", "Image bytes not re-sent because a handle was reused", ("service",))
+
+
+class FileService:
+    """Stores image bytes and returns (uri, expires_at epoch seconds)"""
+
+    name = "base"
+
+    def upload(self, data: bytes, mime_type: str, key: str) -> Tuple[str, float]:
+        raise NotImplementedError
+
+
+class GeminiFileService(FileService):
+    name = "gemini"
+
+    def upload(self, data, mime_type, key):
+        import google.generativeai as genai
+
+        uploaded = genai.upload_file(BytesIO(data), mime_type=mime_type, display_name=f"visionflow-{key[:16]}")
+        # Images are usually ACTIVE straight away; give processing a few seconds
+        deadline = time.time() + 10
+        while getattr(uploaded.state, "name", "ACTIVE") == "PROCESSING" and time.time() < deadline:
+            time.sleep(0.5)
+            uploaded = genai.get_file(uploaded.name)
+        if getattr(uploaded.state, "name", "ACTIVE") != "ACTIVE":
+            raise RuntimeError(f"Uploaded file {uploaded.name} is {uploaded.state.name}")
+        expires = uploaded.expiration_time
+        expires_at = expires.timestamp() if expires else time.time() + IMAGE_HANDLE_TTL
+        return uploaded.uri, expires_at
+
+
+class LocalFileService(FileService):
+    """Stand-in file service: files on local disk, file:// URIs"""
+
+    name = "local"
+
+    def __init__(self, directory: str = IMAGE_REGISTRY_DIR, ttl: float = IMAGE_HANDLE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def upload(self, data, mime_type, key):
+        path = os.path.join(self.directory, key + (".png" if mime_type == "image/png" else ".jpg"))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return "file://" + os.path.abspath(path), time.time() + self.ttl
+
+
+class ImageRegistry:
+    def __init__(self, service: FileService, store: Optional[StateStore] = None):
+        self.service = service
+        self.store = store or InMemoryStateStore()
+        # Striped by hash so memory stays bounded; unrelated images rarely share a stripe
+        self._locks = [threading.Lock() for _ in range(UPLOAD_LOCK_STRIPES)]
+
+    def _lock(self, key: str) -> threading.Lock:
+        return self._locks[int(key[:8], 16) % len(self._locks)]
+
+    def _valid(self, key: str) -> Optional[dict]:
+        handle = self.store.get(NAMESPACE, key)
+        if handle and handle["expires_at"] - IMAGE_HANDLE_MARGIN > time.time():
+            return handle
+        return None
+
+    def resolve(self, mime_type: str, data: bytes) -> Optional[dict]:
+        """Handle for these bytes, uploading them on first use; None = send them inline"""
+        if len(data) < IMAGE_REGISTRY_MIN_BYTES:
+            IMAGE_HANDLES.inc(metrics.SERVICE, "inline")
+            return None
+        key = hashlib.sha256(data).hexdigest()
+        handle = self._valid(key)
+        if handle is None:
+            # Concurrent calls for the same image in this process wait for one upload
+            with self._lock(key):
+                handle = self._valid(key)
+                if handle is None:
+                    return self._upload(key, mime_type, data)
+        IMAGE_HANDLES.inc(metrics.SERVICE, "reused")
+        BYTES_SAVED.inc(metrics.SERVICE, amount=len(data))
+        return handle
+
+    def _upload(self, key: str, mime_type: str, data: bytes) -> Optional[dict]:
+        start = time.perf_counter()
+        try:
+            with stage("image_upload"):
+                uri, expires_at = self.service.upload(data, mime_type, key)
+        except Exception as e:
+            print(f"  ⚠️ Image upload to {self.service.name} failed ({e}), sending it inline")
+            IMAGE_HANDLES.inc(metrics.SERVICE, "upload_failed")
+            return None
+        UPLOAD_SECONDS.observe(time.perf_counter() - start, metrics.SERVICE, self.service.name)
+        IMAGE_HANDLES.inc(metrics.SERVICE, "uploaded")
+        handle = {"key": key, "uri": uri, "mime_type": mime_type, "bytes": len(data), "expires_at": expires_at}
+        self.store.set(NAMESPACE, key, handle, ttl=max(1.0, expires_at - IMAGE_HANDLE_MARGIN - time.time()))
+        return handle
+
+    def forget(self, handles: List[dict]):
+        for handle in handles:
+            IMAGE_HANDLES.inc(metrics.SERVICE, "rejected")
+            self.store.delete(NAMESPACE, handle["key"])
+
+
+_registry: Optional[ImageRegistry] = None
+
+
+def configure(store: Optional[StateStore] = None, mode: str = IMAGE_REGISTRY) -> Optional[ImageRegistry]:
+    global _registry
+    if mode == "gemini":
+        _registry = ImageRegistry(GeminiFileService(), store)
+    elif mode == "local":
+        _registry = ImageRegistry(LocalFileService(), store)
+    else:
+        _registry = None
+        return None
+    print(f"🗂️  Image registry: {mode} (images over {IMAGE_REGISTRY_MIN_BYTES // 1024} KB uploaded once)")
+    return _registry
+
+
+def enabled() -> bool:
+    return _registry is not None
+
+
+def encode(image: Image.Image) -> Tuple[str, bytes]:
+    return encode_for_model(image, image.format)
+
+
+def file_part(handle: dict) -> dict:
+    return {"file_data": {"mime_type": handle["mime_type"], "file_uri": handle["uri"]}}
+
+
+def resolve(mime_type: str, data: bytes) -> Optional[dict]:
+    return _registry.resolve(mime_type, data) if _registry else None
+
+
+def forget(handles: List[dict]):
+    if _registry and handles:
+        _registry.forget(handles)
+
+
+def is_handle_error(error: Exception) -> bool:
+    """Provider error caused by a referenced file (deleted, expired, not visible to this key)"""
+    text = str(error).lower()
+    return "file" in text and any(s in text for s in ("not found", "not exist", "404", "403", "permission", "expired"))
@@ -0,0 +1,316 @@
+"""
+Label Region Detector
+Finds the shipping label (and, with Grounding DINO, the product) so label
+verification sends Gemini a small crop instead of the full frame.
+
+    LABEL_DETECTOR=off             send the full image (default)
+    LABEL_DETECTOR=classic         bright, unsaturated, text-dense rectangle:
+                                   OpenCV contours if installed, else PIL projections
+    LABEL_DETECTOR=grounding_dino  open-vocabulary detector from
+                                   requirements_grounding_dino.txt (loaded once per process)
+
+    LABEL_CROP_LAYOUT=composite    one image: label close-up + downscaled package view,
+                                   sized to a single 768px model tile
+    LABEL_CROP_LAYOUT=separate     two images: label crop, package view
+
+If no label is found the full image is sent, so the detector can only save
+work, never lose the check.
+"""
+
+import math
+import os
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+import metrics
+from metrics import REGISTRY
+
+LABEL_DETECTOR = os.getenv("LABEL_DETECTOR", "off").lower()
+LABEL_CROP_LAYOUT = os.getenv("LABEL_CROP_LAYOUT", "composite").lower()
+GROUNDING_DINO_MODEL = os.getenv("GROUNDING_DINO_MODEL", "IDEA-Research/grounding-dino-tiny")
+MODEL_TILE = 768
+CONTEXT_MAX_SIDE = 384
+DETECT_SIDE = 320
+
+Box = Tuple[int, int, int, int]
+
+CROP_RESULTS = REGISTRY.counter(
+    "visionflow_label_crop_total", "Label detector outcomes", ("service", "method", "outcome"))
+CROP_PIXELS = REGISTRY.counter(
+    "visionflow_label_crop_pixels_total", "Image pixels before (original) and after (sent) cropping",
+    ("service", "kind"))
+CROP_BYTES = REGISTRY.counter(
+    "visionflow_label_crop_bitmap_bytes_total", "Decoded bitmap bytes before (original) and after (sent) cropping",
+    ("service", "kind"))
+CROP_TOKENS = REGISTRY.counter(
+    "visionflow_label_crop_image_tokens_total", "Estimated Gemini image tokens before (original) and after (sent) cropping",
+    ("service", "kind"))
+VAS_MODEL_SECONDS = REGISTRY.histogram(
+    "visionflow_vas_model_seconds", "Label verification model call latency by image input", ("service", "input"))
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # optional: the classic detector falls back to PIL
+    cv2 = None
+
+
+@dataclass
+class LabelRegions:
+    method: str
+    label: Box
+    product: Optional[Box] = None
+
+
+def enabled() -> bool:
+    return LABEL_DETECTOR in ("classic", "grounding_dino")
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Gemini image pricing: 258 tokens up to 384x384, else 258 per 768x768 tile"""
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / MODEL_TILE) * math.ceil(height / MODEL_TILE)
+
+
+def _pad(box: Box, size: Tuple[int, int], fraction: float = 0.05) -> Box:
+    x0, y0, x1, y1 = box
+    px, py = int((x1 - x0) * fraction), int((y1 - y0) * fraction)
+    return max(0, x0 - px), max(0, y0 - py), min(size[0], x1 + px), min(size[1], y1 + py)
+
+
+def _plausible(box: Box, size: Tuple[int, int]) -> bool:
+    w, h = box[2] - box[0], box[3] - box[1]
+    area = w * h / float(size[0] * size[1])
+    return w > 0 and h > 0 and 0.01 <= area <= 0.7 and 0.2 <= w / h <= 5
+
+
+def _has_text(gray: Image.Image, box: Box) -> bool:
+    # Printed text/barcodes leave plenty of edges; a blank white panel doesn't
+    edges = gray.crop(box).filter(ImageFilter.FIND_EDGES)
+    return ImageStat.Stat(edges).mean[0] > 6
+
+
+# ----------------------------------------------------------------------------
+# Classic detector
+# ----------------------------------------------------------------------------
+
+def _label_mask(small: Image.Image) -> Image.Image:
+    _, sat, val = small.convert("HSV").split()
+    bright = val.point(lambda v: 255 if v > 170 else 0)
+    unsaturated = sat.point(lambda s: 255 if s < 60 else 0)
+    mask = ImageChops.multiply(bright, unsaturated)
+    # Close the gaps left by printed text, then drop speckle
+    return mask.filter(ImageFilter.MaxFilter(5)).filter(ImageFilter.MinFilter(5))
+
+
+def _longest_run(profile: List[float], threshold: float) -> Optional[Tuple[int, int]]:
+    best, start = None, None
+    for i, value in enumerate(list(profile) + [0]):
+        if value >= threshold and start is None:
+            start = i
+        elif value < threshold and start is not None:
+            if best is None or i - start > best[1] - best[0]:
+                best = (start, i)
+            start = None
+    return best
+
+
+def _projection_box(mask: Image.Image) -> Optional[Box]:
+    """Densest band of label pixels by rows, then by columns within it, then rows again"""
+    w, h = mask.size
+
+    def rows(x0, x1):
+        return list(mask.crop((x0, 0, x1, h)).resize((1, h), Image.Resampling.BOX).getdata())
+
+    def cols(y0, y1):
+        return list(mask.crop((0, y0, w, y1)).resize((w, 1), Image.Resampling.BOX).getdata())
+
+    profile = rows(0, w)
+    band = _longest_run(profile, max(profile) * 0.5) if max(profile) else None
+    if not band:
+        return None
+    profile = cols(*band)
+    span = _longest_run(profile, max(profile) * 0.5) if max(profile) else None
+    if not span:
+        return None
+    profile = rows(*span)
+    band = _longest_run(profile, max(profile) * 0.5) if max(profile) else None
+    if not band:
+        return None
+    return span[0], band[0], span[1], band[1]
+
+
+def _contour_box(small: Image.Image, gray: Image.Image) -> Optional[Box]:
+    hsv = cv2.cvtColor(np.asarray(small), cv2.COLOR_RGB2HSV)
+    mask = cv2.inRange(hsv, (0, 0, 170), (180, 60, 255))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((7, 7), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    edges = cv2.Canny(np.asarray(gray), 80, 160)
+    best, best_score = None, 0.0
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        box = (x, y, x + w, y + h)
+        if not _plausible(box, small.size) or cv2.contourArea(contour) < 0.6 * w * h:
+            continue
+        score = w * h * float(edges[y:y + h, x:x + w].mean())
+        if score > best_score:
+            best, best_score = box, score
+    return best
+
+
+def _detect_classic(image: Image.Image) -> Optional[LabelRegions]:
+    small = image.convert("RGB")
+    small.thumbnail((DETECT_SIDE, DETECT_SIDE))
+    gray = small.convert("L")
+    if cv2 is not None:
+        box, method = _contour_box(small, gray), "contour"
+    else:
+        box, method = _projection_box(_label_mask(small)), "projection"
+    if box is None or not _plausible(box, small.size) or not _has_text(gray, box):
+        return None
+    scale = image.size[0] / float(small.size[0])
+    label = tuple(int(round(v * scale)) for v in box)
+    return LabelRegions(method, _pad(label, image.size))
+
+
+# ----------------------------------------------------------------------------
+# Grounding DINO
+# ----------------------------------------------------------------------------
+
+_load_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _grounding_dino():
+    import torch
+    from transformers import AutoModelForZeroShotObjectDetection, AutoProcessor
+
+    print(f"🦖 Loading {GROUNDING_DINO_MODEL} (once per process)...")
+    processor = AutoProcessor.from_pretrained(GROUNDING_DINO_MODEL)
+    model = AutoModelForZeroShotObjectDetection.from_pretrained(GROUNDING_DINO_MODEL).eval()
+    return torch, processor, model
+
+
+def _detect_grounding_dino(image: Image.Image) -> Optional[LabelRegions]:
+    with _load_lock:
+        torch, processor, model = _grounding_dino()
+    small = image.convert("RGB")
+    small.thumbnail((800, 800))
+    inputs = processor(images=small, text="a shipping label. a product.", return_tensors="pt")
+    with torch.no_grad():
+        outputs = model(**inputs)
+    target = [small.size[::-1]]
+    try:
+        result = processor.post_process_grounded_object_detection(
+            outputs, inputs.input_ids, threshold=0.3, text_threshold=0.25, target_sizes=target)[0]
+    except TypeError:  # transformers < 4.47 calls it box_threshold
+        result = processor.post_process_grounded_object_detection(
+            outputs, inputs.input_ids, box_threshold=0.3, text_threshold=0.25, target_sizes=target)[0]
+
+    best = {}
+    labels = result.get("text_labels", result.get("labels"))
+    for score, phrase, box in zip(result["scores"].tolist(), labels, result["boxes"].tolist()):
+        kind = "label" if "label" in str(phrase) else "product" if "product" in str(phrase) else None
+        if kind and score > best.get(kind, (0, None))[0]:
+            best[kind] = (score, box)
+    if "label" not in best:
+        return None
+    scale = image.size[0] / float(small.size[0])
+    to_full = lambda b: _pad(tuple(int(round(v * scale)) for v in b), image.size)
+    product = to_full(best["product"][1]) if "product" in best else None
+    return LabelRegions("grounding_dino", to_full(best["label"][1]), product)
+
+
+# ----------------------------------------------------------------------------
+# Cropping for the model
+# ----------------------------------------------------------------------------
+
+def detect(image: Image.Image) -> Optional[LabelRegions]:
+    if not enabled():
+        return None
+    try:
+        if LABEL_DETECTOR == "grounding_dino":
+            regions = _detect_grounding_dino(image)
+        else:
+            regions = _detect_classic(image)
+    except Exception as e:
+        print(f"⚠️  Label detector failed ({LABEL_DETECTOR}): {e}")
+        regions = None
+    CROP_RESULTS.inc(metrics.SERVICE, regions.method if regions else LABEL_DETECTOR,
+                     "cropped" if regions else "not_found")
+    return regions
+
+
+def find_label(image: Image.Image) -> Optional[Box]:
+    """Classic label box whatever LABEL_DETECTOR says (no metrics); used by the reference library"""
+    try:
+        regions = _detect_classic(image)
+    except Exception:
+        return None
+    return regions.label if regions else None
+
+
+def _fit(image: Image.Image, box: Tuple[int, int]) -> Image.Image:
+    image = image.copy()
+    image.thumbnail(box, Image.Resampling.LANCZOS)
+    return image
+
+
+def model_images(image: Image.Image, regions: LabelRegions) -> Tuple[List[Image.Image], str]:
+    """
+    Images to send instead of the full frame, plus a prompt note describing them.
+    Composite: label above (wide labels) or left of (tall labels) the package view,
+    within one 768x768 tile.
+    """
+    label = image.crop(regions.label).convert("RGB")
+    context = image.crop(regions.product) if regions.product else image
+    context = context.convert("RGB")
+
+    if LABEL_CROP_LAYOUT == "separate":
+        images = [_fit(label, (MODEL_TILE, MODEL_TILE)), _fit(context, (CONTEXT_MAX_SIDE, CONTEXT_MAX_SIDE))]
+        note = "IMAGE LAYOUT: first image = label close-up, second image = the whole package."
+    else:
+        gap = 8
+        if label.width >= label.height:
+            label = _fit(label, (MODEL_TILE, MODEL_TILE * 2 // 3))
+            context = _fit(context, (MODEL_TILE, MODEL_TILE - label.height - gap))
+            canvas = Image.new("RGB", (max(label.width, context.width), label.height + gap + context.height), "white")
+            canvas.paste(label, (0, 0))
+            canvas.paste(context, (0, label.height + gap))
+            note = "IMAGE LAYOUT: label close-up on top, the whole package below it."
+        else:
+            label = _fit(label, (MODEL_TILE * 2 // 3, MODEL_TILE))
+            context = _fit(context, (MODEL_TILE - label.width - gap, MODEL_TILE))
+            canvas = Image.new("RGB", (label.width + gap + context.width, max(label.height, context.height)), "white")
+            canvas.paste(label, (0, 0))
+            canvas.paste(context, (label.width + gap, 0))
+            note = "IMAGE LAYOUT: label close-up on the left, the whole package on the right."
+        images = [canvas]
+
+    observe_savings(image, images)
+    return images, note
+
+
+def observe_model_call(seconds: float, cropped: bool):
+    VAS_MODEL_SECONDS.observe(seconds, metrics.SERVICE, "cropped" if cropped else "full")
+
+
+def observe_savings(original: Image.Image, sent: List[Image.Image]):
+    service = metrics.SERVICE
+    bands = len(original.getbands())
+    CROP_PIXELS.inc(service, "original", amount=original.width * original.height)
+    CROP_BYTES.inc(service, "original", amount=original.width * original.height * bands)
+    CROP_TOKENS.inc(service, "original", amount=estimate_image_tokens(*original.size))
+    for img in sent:
+        CROP_PIXELS.inc(service, "sent", amount=img.width * img.height)
+        CROP_BYTES.inc(service, "sent", amount=img.width * img.height * len(img.getbands()))
+        CROP_TOKENS.inc(service, "sent", amount=estimate_image_tokens(*img.size))
+
+
+if enabled():
+    print(f"✂️  Label detector: {LABEL_DETECTOR} ({'opencv' if cv2 is not None else 'pil'}), layout={LABEL_CROP_LAYOUT}")
@@ -0,0 +1,416 @@
+"""
+Reference Label Library
+Rendered reference labels per SKU, matched locally against the label in a
+VAS photo so clear matches skip Gemini.
+
+Sources live in LABEL_LIBRARY_DIR (default backend/reference_labels):
+
+- PDFs (label sheets, one or many labels per page), rasterized per page with
+  PyMuPDF (optional: pip install PyMuPDF) in the image process pool
+- PNG/JPEG renders of a label or a label sheet
+- manifest.json mapping source paths (relative to the directory, may point
+  outside it) to SKUs: {"../labels_beige.pdf": "X001B7KASV"}. Unlisted files
+  in the directory use the barcode on each label if a decoder is installed,
+  else the file name.
+
+Each page is split into label cells on blank gutters; every distinct cell
+becomes a template with two features of its ink bounding box:
+
+- coarse: 32x16 mean-centred, unit-length vector; one matrix product scores
+  the captured label against every template in the library
+- fine: 128x48 thumbnail, correlated only against the expected SKU's templates
+
+A label is a clear match when the expected SKU's fine correlation reaches
+LABEL_MATCH_THRESHOLD and its coarse score beats every other SKU by
+LABEL_MATCH_MARGIN. Anything else goes to the model as before.
+
+The built index is cached in DATA_DIR and only rebuilt when a source file,
+the manifest or the feature settings change. numpy is required; without it
+the library stays empty.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+import barcode_reader
+import image_pool
+import label_detector
+import metrics
+from metrics import REGISTRY
+from state_store import DATA_DIR
+
+try:
+    import numpy as np
+except ImportError:  # optional: no numpy, no reference library
+    np = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # optional: PDFs are skipped without it
+    fitz = None
+
+LABEL_LIBRARY_DIR = os.getenv("LABEL_LIBRARY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference_labels"))
+LABEL_LIBRARY_CACHE = os.getenv("LABEL_LIBRARY_CACHE", os.path.join(DATA_DIR, "label_library.npz"))
+LABEL_RASTER_DPI = int(os.getenv("LABEL_RASTER_DPI", "150"))
+LABEL_MATCH_THRESHOLD = float(os.getenv("LABEL_MATCH_THRESHOLD", "0.90"))
+LABEL_MATCH_MARGIN = float(os.getenv("LABEL_MATCH_MARGIN", "0.05"))
+
+FEATURE_VERSION = 1
+COARSE_SIZE = (32, 16)
+FINE_SIZE = (128, 48)
+QUERY_MAX_SIDE = 512
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg")
+
+REFERENCE_LOOKUPS = REGISTRY.counter(
+    "visionflow_reference_label_lookups_total",
+    "Reference label lookups by outcome (hit = resolved without a model call)",
+    ("service", "outcome"))
+REFERENCE_SECONDS = REGISTRY.histogram(
+    "visionflow_reference_label_seconds", "Reference label match time (features + similarity over the library)",
+    ("service",), buckets=(0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+
+
+# ----------------------------------------------------------------------------
+# Features (run in pool workers at build time, in-thread at lookup time)
+# ----------------------------------------------------------------------------
+
+def _ink_box(gray: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    ink = np.asarray(gray) < 128
+    rows, cols = np.flatnonzero(ink.any(axis=1)), np.flatnonzero(ink.any(axis=0))
+    if not len(rows) or not len(cols):
+        return None
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def normalize_label(image: Image.Image) -> Optional[Image.Image]:
+    """Grayscale, contrast-stretched crop of the label's printed area"""
+    gray = ImageOps.autocontrast(image.convert("L"), cutoff=1)
+    box = _ink_box(gray)
+    if box is None or box[2] - box[0] < 8 or box[3] - box[1] < 8:
+        return None
+    return gray.crop(box)
+
+
+def coarse_vector(label: Image.Image):
+    v = 255.0 - np.asarray(label.resize(COARSE_SIZE, Image.Resampling.BOX), dtype=np.float32).ravel()
+    v -= v.mean()
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+def fine_thumbnail(label: Image.Image):
+    return np.asarray(label.resize(FINE_SIZE, Image.Resampling.BOX), dtype=np.uint8)
+
+
+def _correlate(query, thumbs) -> "np.ndarray":
+    """Pearson correlation of one fine thumbnail against a stack of them"""
+    q = query.astype(np.float32).ravel()
+    q -= q.mean()
+    t = thumbs.reshape(len(thumbs), -1).astype(np.float32)
+    t -= t.mean(axis=1, keepdims=True)
+    denom = np.linalg.norm(t, axis=1) * (np.linalg.norm(q) or 1.0)
+    return (t @ q) / np.where(denom == 0, 1.0, denom)
+
+
+def _runs(ink_profile, min_gap: int) -> List[Tuple[int, int]]:
+    """Spans of ink separated by at least min_gap blank lines"""
+    idx = np.flatnonzero(ink_profile)
+    if not len(idx):
+        return []
+    breaks = np.flatnonzero(np.diff(idx) > min_gap)
+    starts = np.concatenate(([idx[0]], idx[breaks + 1]))
+    ends = np.concatenate((idx[breaks], [idx[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def split_sheet(gray: Image.Image) -> List[Image.Image]:
+    """Label cells on a sheet, split on blank gutters (a single label comes back whole)"""
+    ink = np.asarray(ImageOps.autocontrast(gray, cutoff=1)) < 128
+    h, w = ink.shape
+    cells = []
+    for y0, y1 in _runs(ink.any(axis=1), max(4, int(h * 0.015))):
+        for x0, x1 in _runs(ink[y0:y1].any(axis=0), max(4, int(w * 0.015))):
+            if (x1 - x0) * (y1 - y0) >= 0.002 * w * h and min(x1 - x0, y1 - y0) >= 12:
+                cells.append(gray.crop((x0, y0, x1, y1)))
+    return cells
+
+
+def _render(path: str, page: Optional[int], dpi: int) -> Image.Image:
+    if page is None:
+        return Image.open(path).convert("L")
+    with fitz.open(path) as doc:
+        pix = doc[page].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def _page_templates(path: str, page: Optional[int], dpi: int, read_codes: bool) -> List[dict]:
+    """Pool task: rasterize one page and return its distinct label templates"""
+    templates = []
+    for cell in split_sheet(_render(path, page, dpi)):
+        label = normalize_label(cell)
+        if label is None:
+            continue
+        coarse = coarse_vector(label)
+        if any(float(t["coarse"] @ coarse) > 0.97 for t in templates):
+            continue  # sheets repeat the same label many times
+        code = None
+        if read_codes:
+            codes = barcode_reader.read_codes(cell)
+            code = codes[0].value if codes else None
+        templates.append({"coarse": coarse, "fine": fine_thumbnail(label), "code": code})
+    return templates
+
+
+# ----------------------------------------------------------------------------
+# Index
+# ----------------------------------------------------------------------------
+
+@dataclass
+class ReferenceMatch:
+    sku: str
+    score: float        # fine correlation with the expected SKU's best template
+    coarse: float       # coarse similarity with the expected SKU
+    rival_sku: Optional[str]
+    rival: float        # best coarse similarity among other SKUs
+    clear: bool
+
+
+class LabelIndex:
+    """Template matrix + per-template SKU ids; immutable once built"""
+
+    def __init__(self, coarse, fine, sku_ids, skus: List[str], fingerprint: str = "", sources: int = 0):
+        self.coarse = coarse
+        self.fine = fine
+        self.sku_ids = sku_ids
+        self.skus = skus
+        self.fingerprint = fingerprint
+        self.sources = sources
+        self.rows: Dict[str, "np.ndarray"] = {sku: np.flatnonzero(sku_ids == i) for i, sku in enumerate(skus)}
+
+    def __len__(self):
+        return len(self.sku_ids)
+
+    def covers(self, sku: str) -> bool:
+        return barcode_reader.normalize_sku(sku) in self.rows
+
+    def match(self, label: Image.Image, sku: str) -> Optional[ReferenceMatch]:
+        key = barcode_reader.normalize_sku(sku)
+        rows = self.rows.get(key)
+        label = normalize_label(label)
+        if rows is None or label is None:
+            return None
+        scores = self.coarse @ coarse_vector(label)
+        expected = float(scores[rows].max())
+        others = scores.copy()
+        others[rows] = -1.0
+        best_other = int(others.argmax())
+        rival = float(others[best_other])
+        rival_sku = self.skus[self.sku_ids[best_other]] if rival > -1.0 else None
+        fine = float(_correlate(fine_thumbnail(label), self.fine[rows]).max())
+        clear = fine >= LABEL_MATCH_THRESHOLD and expected - rival >= LABEL_MATCH_MARGIN
+        return ReferenceMatch(key, fine, expected, rival_sku, rival, clear)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, coarse=self.coarse, fine=self.fine, sku_ids=self.sku_ids,
+                 skus=np.array(self.skus), fingerprint=np.array(self.fingerprint), sources=np.array(self.sources))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LabelIndex":
+        with np.load(path) as data:
+            return cls(data["coarse"], data["fine"], data["sku_ids"], data["skus"].tolist(),
+                       str(data["fingerprint"]), int(data["sources"]))
+
+
+def _discover(directory: str) -> List[Tuple[str, Optional[str]]]:
+    """(path, sku or None) for every source: manifest entries first, then the directory"""
+    if not os.path.isdir(directory):
+        return []
+    sources, seen = [], set()
+    manifest_path = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            for rel, sku in json.load(f).items():
+                path = os.path.normpath(os.path.join(directory, rel))
+                if os.path.exists(path):
+                    sources.append((path, sku))
+                    seen.add(path)
+                else:
+                    print(f"⚠️  Reference label {rel} listed in manifest.json is missing")
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if path not in seen and name.lower().endswith((".pdf",) + IMAGE_SUFFIXES):
+            sources.append((path, None))
+    return sources
+
+
+def _fingerprint(sources: List[Tuple[str, Optional[str]]]) -> str:
+    h = hashlib.sha1(f"{FEATURE_VERSION}:{LABEL_RASTER_DPI}:{COARSE_SIZE}:{FINE_SIZE}".encode())
+    for path, sku in sources:
+        st = os.stat(path)
+        h.update(f"{path}:{st.st_size}:{st.st_mtime_ns}:{sku}".encode())
+    return h.hexdigest()
+
+
+def _pages(path: str) -> List[Optional[int]]:
+    if not path.lower().endswith(".pdf"):
+        return [None]
+    if fitz is None:
+        print(f"⚠️  Skipping {os.path.basename(path)}: PDF reference labels need PyMuPDF (pip install PyMuPDF)")
+        return []
+    with fitz.open(path) as doc:
+        return list(range(doc.page_count))
+
+
+async def build_index(sources: List[Tuple[str, Optional[str]]], fingerprint: str = "") -> LabelIndex:
+    """Rasterize every page in parallel (image process pool) and stack the templates"""
+    loop = asyncio.get_running_loop()
+    pool = image_pool.get_pool()
+    read_codes = barcode_reader.available()
+    jobs = [(path, sku, page) for path, sku in sources for page in _pages(path)]
+    results = await asyncio.gather(*(
+        loop.run_in_executor(pool, _page_templates, path, page, LABEL_RASTER_DPI, read_codes and sku is None)
+        for path, sku, page in jobs), return_exceptions=True)
+
+    skus: List[str] = []
+    sku_index: Dict[str, int] = {}
+    coarse, fine, sku_ids = [], [], []
+    for (path, sku, page), templates in zip(jobs, results):
+        if isinstance(templates, Exception):
+            print(f"⚠️  Could not rasterize {os.path.basename(path)} page {page}: {templates}")
+            continue
+        for t in templates:
+            key = barcode_reader.normalize_sku(sku or t["code"] or os.path.splitext(os.path.basename(path))[0])
+            if key not in sku_index:
+                sku_index[key] = len(skus)
+                skus.append(key)
+            coarse.append(t["coarse"])
+            fine.append(t["fine"])
+            sku_ids.append(sku_index[key])
+
+    if not coarse:
+        return LabelIndex(np.zeros((0, COARSE_SIZE[0] * COARSE_SIZE[1]), np.float32),
+                          np.zeros((0, FINE_SIZE[1], FINE_SIZE[0]), np.uint8),
+                          np.zeros(0, np.int32), [], fingerprint, len(sources))
+    return LabelIndex(np.stack(coarse).astype(np.float32), np.stack(fine), np.array(sku_ids, dtype=np.int32),
+                      skus, fingerprint, len(sources))
+
+
+# ----------------------------------------------------------------------------
+# Process-wide library
+# ----------------------------------------------------------------------------
+
+_index: Optional[LabelIndex] = None
+_build_lock = threading.Lock()
+_built = {"at": None, "seconds": None, "cached": False}
+
+
+def covers(sku: Optional[str]) -> bool:
+    index = _index
+    return bool(sku) and index is not None and index.covers(sku)
+
+
+def lookup(image: Image.Image, sku: str, box=None) -> Optional[ReferenceMatch]:
+    """
+    Compare the label in image (box if the caller already located it, else the
+    classic detector's box, else the whole image) against sku's templates.
+    """
+    index = _index
+    if index is None:
+        return None
+    box = box or label_detector.find_label(image)
+    label = image.crop(box) if box else image
+    if max(label.size) > QUERY_MAX_SIDE:
+        label = label.copy()
+        label.thumbnail((QUERY_MAX_SIDE, QUERY_MAX_SIDE))
+    start = time.perf_counter()
+    result = index.match(label, sku)
+    REFERENCE_SECONDS.observe(time.perf_counter() - start, metrics.SERVICE)
+    REFERENCE_LOOKUPS.inc(metrics.SERVICE, "hit" if result and result.clear else "unsure" if result else "unreadable")
+    return result
+
+
+async def load_library(directory: str = LABEL_LIBRARY_DIR, cache_path: str = LABEL_LIBRARY_CACHE,
+                       force: bool = False) -> Optional[LabelIndex]:
+    """Load the cached index if the sources are unchanged, else rebuild it"""
+    global _index
+    if np is None:
+        print("⚠️  Reference label library disabled: numpy is not installed")
+        return None
+    sources = _discover(directory)
+    if not sources:
+        return None
+    fingerprint = _fingerprint(sources)
+    start = time.perf_counter()
+    index, cached = None, False
+    if not force and os.path.exists(cache_path):
+        try:
+            index = LabelIndex.load(cache_path)
+            cached = index.fingerprint == fingerprint
+        except Exception as e:
+            print(f"⚠️  Ignoring unreadable reference label cache: {e}")
+    if not cached:
+        index = await build_index(sources, fingerprint)
+        with _build_lock:
+            index.save(cache_path)
+    _index = index
+    _built.update(at=time.time(), seconds=round(time.perf_counter() - start, 3), cached=cached)
+    origin = "cache" if cached else f"built in {_built['seconds']}s"
+    print(f"🏷️  Reference labels: {len(index)} templates for {len(index.skus)} SKUs from {index.sources} sources ({origin})")
+    return index
+
+
+def stats() -> dict:
+    index = _index
+    return {
+        "directory": LABEL_LIBRARY_DIR,
+        "ready": index is not None,
+        "templates": len(index) if index else 0,
+        "skus": len(index.skus) if index else 0,
+        "sources": index.sources if index else 0,
+        "built_at": _built["at"],
+        "build_seconds": _built["seconds"],
+        "from_cache": _built["cached"],
+        "match_threshold": LABEL_MATCH_THRESHOLD,
+        "match_margin": LABEL_MATCH_MARGIN,
+    }
+
+
+def install_label_library(app):
+    """Build/load the library in the background at startup, plus admin stats and reload"""
+    from fastapi import Header
+    from profiling import require_admin
+
+    async def build():
+        try:
+            await load_library()
+        except Exception as e:
+            print(f"⚠️  Reference label library failed to load: {e}")
+
+    async def start():
+        # Runs after the image pool is up; requests are served (via the model) meanwhile
+        app.state.label_library_task = asyncio.create_task(build())
+
+    @app.get("/admin/reference_labels", include_in_schema=False)
+    async def get_reference_labels(x_admin_token: Optional[str] = Header(None)):
+        require_admin(x_admin_token)
+        return stats()
+
+    @app.post("/admin/reference_labels/reload", include_in_schema=False)
+    async def reload_reference_labels(x_admin_token: Optional[str] = Header(None)):
+        """Re-read LABEL_LIBRARY_DIR (rebuilds only if sources changed) - this worker only; needs ADMIN_TOKEN"""
+        require_admin(x_admin_token, mutate=True)
+        await load_library()
+        return stats()
+
+    app.router.add_event_handler("startup", start)
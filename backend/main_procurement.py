@@ -3,14 +3,13 @@ VisionFlow Procurement Automation Backend
 End-to-End Procure-to-Pay Automation with Multi-Agent Orchestration
 """
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 import google.generativeai as genai
 from PIL import Image
-import requests
-from io import BytesIO
 import os
 from dotenv import load_dotenv
 from pathlib import Path
@@ -19,11 +18,42 @@ from datetime import datetime
 import time
 import random
 import re
+import asyncio
+import copy
+import hashlib
 
 # Load .env
 env_path = Path(__file__).parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# Local modules read their settings from the environment, so import them after .env is loaded
+from metrics import install_metrics, stage, GEMINI_RETRIES
+from profiling import install_profiling, require_admin
+from state_store import create_state_store
+from gemini_client import configure_gemini, parse_json
+from model_replay import REPLAY_MODE
+from image_pool import install_image_pool, decode_image_async
+import image_registry
+import document_pages
+import bulk_extraction
+import vendor_layouts
+import extraction_cache
+import budget_ledger
+import approval_policy
+import po_store
+from single_flight import SingleFlight
+from document_pages import UnsupportedDocumentError
+from image_io import install_image_limits, download, read_file, ImageTooLargeError, DOCUMENT_IMAGE_MAX_SIDE
+import model_cascade
+from model_cascade import GEMINI_MODEL, EscalationError, low_confidence
+import metrics
+
+# Number of uvicorn worker processes (WEB_CONCURRENCY is also read by the uvicorn CLI)
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Shared state (admin toggles etc.) visible to every worker
+STATE = create_state_store(WORKERS)
+
 app = FastAPI(
     title="VisionFlow Procurement Automation API",
     description="Multi-Agent System for End-to-End Procure-to-Pay Automation",
@@ -38,12 +68,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-stage latency histograms + Prometheus /metrics + Server-Timing headers
+install_metrics(app, "procurement", workers=WORKERS)
+# Sampled flame-graph profiling, toggled via POST /admin/profiling
+install_profiling(app, "procurement", state=STATE)
+# Reject oversized request bodies (413) before they are parsed
+install_image_limits(app)
+# Image decode/resize/re-encode runs in a process pool (IMAGE_POOL_SIZE)
+install_image_pool(app)
+# Model images uploaded once and then referenced by handle (IMAGE_REGISTRY)
+image_registry.configure(STATE)
+# Repeat-vendor invoices read from learned layouts (VENDOR_LAYOUTS), GET /admin/vendor_layouts
+vendor_layouts.install_vendor_layouts(app)
+
 # Initialize Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    gemini_model = genai.GenerativeModel("models/gemini-2.5-flash")
+    configure_gemini(GEMINI_API_KEY)
+    gemini_model = genai.GenerativeModel(GEMINI_MODEL)
     print("✅ Gemini initialized for procurement automation")
+elif REPLAY_MODE == "replay":
+    # Recorded responses only - no key needed for demos and benchmark runs
+    gemini_model = genai.GenerativeModel(GEMINI_MODEL)
+    print("📼 Gemini not configured, serving recorded model responses")
 else:
     gemini_model = None
     print("⚠️ Gemini not configured")
@@ -58,7 +105,9 @@ def retry_with_backoff(func, max_retries=3, initial_delay=2):
         except Exception as e:
             if "429" in str(e) or "quota" in str(e).lower():
                 wait_time = initial_delay * (2 ** retries) + random.uniform(0, 1)
-                time.sleep(wait_time)
+                GEMINI_RETRIES.inc(metrics.SERVICE)
+                with stage("retry_backoff"):
+                    time.sleep(wait_time)
                 retries += 1
             else:
                 raise e
@@ -88,45 +137,9 @@ def extract_json_from_text(text: str):
 # Agent 2: Document Intelligence Specialist
 # ============================================================================
 
-class DocumentExtractionRequest(BaseModel):
-    document_url: str
-    document_type: str  # "invoice", "po", "requisition", "receipt"
-
-class DocumentExtractionResult(BaseModel):
-    document_type: str
-    extracted_data: Dict
-    confidence: float
-    timestamp: str
-
-@app.post("/procurement/extract_document", response_model=DocumentExtractionResult, operation_id="extractDocument")
-async def extract_document(request: DocumentExtractionRequest):
-    """
-    AGENT 2: Document Intelligence Specialist
-    
-    Extracts structured data from procurement documents using OCR + Vision.
-    """
-    if not GEMINI_API_KEY:
-        raise HTTPException(status_code=500, detail="Gemini API key not configured")
-    
-    try:
-        print(f"📄 Document Intelligence: Extracting {request.document_type}...")
-        
-        # Handle local file:// URLs (from Kaggle dataset) or HTTP URLs
-        if request.document_url.startswith("file://"):
-            # Local file path
-            file_path = request.document_url.replace("file://", "")
-            img_pil = Image.open(file_path)
-            print(f"   📁 Using local file: {file_path}")
-        else:
-            # HTTP URL - download image
-            img_resp = requests.get(request.document_url, timeout=10)
-            img_resp.raise_for_status()
-            img_pil = Image.open(BytesIO(img_resp.content))
-            print(f"   🌐 Downloaded from URL: {request.document_url[:60]}...")
-        
-        # Create type-specific prompts
-        prompts = {
-            "invoice": """You are a Document Intelligence Specialist extracting data from an INVOICE.
+# Type-specific extraction prompts
+EXTRACTION_PROMPTS = {
+    "invoice": """You are a Document Intelligence Specialist extracting data from an INVOICE.
             
 Extract the following fields:
 - invoice_number: Invoice number/ID
@@ -152,7 +165,7 @@ Return ONLY valid JSON:
         {"description": "Desk Lamps", "quantity": 3, "unit_price": 50.00, "line_total": 150.00}
     ]
 }""",
-            "po": """You are extracting data from a PURCHASE ORDER.
+    "po": """You are extracting data from a PURCHASE ORDER.
             
 Extract:
 - po_number: Purchase order number
@@ -174,7 +187,7 @@ Return ONLY valid JSON:
         {"description": "Desk Lamps", "quantity": 3, "unit_price": 50.00, "line_total": 150.00}
     ]
 }""",
-            "requisition": """You are extracting data from a PURCHASE REQUISITION.
+    "requisition": """You are extracting data from a PURCHASE REQUISITION.
             
 Extract:
 - requisition_number: Req number/ID
@@ -200,7 +213,7 @@ Return ONLY valid JSON:
         {"description": "Desk Lamps", "quantity": 3, "estimated_price": 50.00}
     ]
 }""",
-            "receipt": """You are extracting data from a RECEIVING RECEIPT or GOODS RECEIPT.
+    "receipt": """You are extracting data from a RECEIVING RECEIPT or GOODS RECEIPT.
             
 Extract:
 - receipt_number: Receipt/GR number
@@ -222,34 +235,262 @@ Return ONLY valid JSON:
         {"description": "Desk Lamps", "quantity": 3}
     ]
 }"""
-        }
-        
-        prompt = prompts.get(request.document_type, prompts["invoice"])
-        
-        response = retry_with_backoff(lambda: gemini_model.generate_content([prompt, img_pil]))
-        result_text = response.text.strip()
+}
+
+# Extracted results reused for repeat documents (EXTRACTION_CACHE); entries from older prompts are dropped
+extraction_cache.configure({t: extraction_cache.prompt_version(p, GEMINI_MODEL) for t, p in EXTRACTION_PROMPTS.items()})
+
+# Concurrent extractions of the same document share one model call
+EXTRACTIONS = SingleFlight("document_extraction")
+
+def check_extraction_answer(extracted, min_confidence: float) -> Optional[str]:
+    """Model cascade check: escalate empty/non-object extractions and self-reported low confidence"""
+    if not isinstance(extracted, dict) or not extracted:
+        raise EscalationError("extraction is not a non-empty JSON object")
+    return "low_confidence" if low_confidence(extracted, min_confidence) else None
+
+class DocumentExtractionRequest(BaseModel):
+    document_url: str
+    document_type: str  # "invoice", "po", "requisition", "receipt"
+    refresh: bool = False  # ignore a cached result and extract again
+
+class DocumentExtractionResult(BaseModel):
+    document_type: str
+    extracted_data: Dict
+    confidence: float
+    timestamp: str
+    pages: int = 1
+    extracted_by: str = "model"  # "template" when read with a learned vendor layout
+    cached: bool = False  # served from the extraction cache
+    extracted_at: Optional[str] = None  # when the (possibly cached) result was extracted
+
+def extract_page(prompt: str, image: Image.Image) -> dict:
+    """One model extraction (cascade + 429 backoff) of a single image / page"""
+    extracted, _ = retry_with_backoff(lambda: model_cascade.run(
+        "document_extraction", "STANDARD", [prompt, image],
+        lambda text: parse_json(extract_json_from_text, text),
+        check=check_extraction_answer, default_model=gemini_model))
+    return extracted
+
+def load_document(document_url: str) -> bytes:
+    """Document bytes from a local file:// URL (Kaggle dataset) or an HTTP URL"""
+    if document_url.startswith("file://"):
+        file_path = document_url.replace("file://", "")
+        with stage("image_download"):
+            content = read_file(file_path)
+        print(f"   📁 Using local file: {file_path}")
+    else:
+        with stage("image_download"):
+            content = download(document_url)
+        print(f"   🌐 Downloaded from URL: {document_url[:60]}...")
+    return content
+
+async def extract_uncached(content: bytes, document_type: str) -> dict:
+    """Extract an image or (multi-page) PDF document: {"extracted_data", "pages", "extracted_by"}"""
+    start = time.perf_counter()
+    layout_page = template = None
+    if vendor_layouts.enabled_for(document_type):
+        # Repeat-vendor layout: read the learned field regions locally, no model call
+        layout_page, template, extracted_data = await asyncio.to_thread(
+            vendor_layouts.try_template, content, document_type)
+        if extracted_data is not None:
+            vendor_layouts.observe_document("template", time.perf_counter() - start)
+            return {"extracted_data": extracted_data, "pages": 1, "extracted_by": "template"}
+    
+    with stage("prompt_build"):
+        prompt = EXTRACTION_PROMPTS.get(document_type, EXTRACTION_PROMPTS["invoice"])
+    
+    if document_pages.is_pdf(content):
+        # Multi-page PDF: pages rasterized in the image pool and extracted concurrently
+        extracted_data, pages = await document_pages.extract_pdf(
+            content, lambda image, page, count: asyncio.to_thread(
+                extract_page, document_pages.page_prompt(prompt, page, count), image))
+        print(f"   📑 Merged {pages} pages")
+    else:
+        with stage("decode"):
+            img_pil = await decode_image_async(content, max_side=DOCUMENT_IMAGE_MAX_SIDE)
+        extracted_data, pages = await asyncio.to_thread(extract_page, prompt, img_pil), 1
+    
+    vendor_layouts.observe_document("model", time.perf_counter() - start)
+    if layout_page is not None:
+        await asyncio.to_thread(vendor_layouts.learn_from_model, layout_page, document_type, extracted_data, template)
+    return {"extracted_data": extracted_data, "pages": pages, "extracted_by": "model"}
+
+def extraction_prompt_version(document_type: str) -> str:
+    prompt = EXTRACTION_PROMPTS.get(document_type, EXTRACTION_PROMPTS["invoice"])
+    return extraction_cache.prompt_version(prompt, GEMINI_MODEL)
+
+async def extract_content(content: bytes, document_type: str, refresh: bool = False) -> dict:
+    """
+    extract_uncached() behind the extraction cache (document hash + type +
+    prompt version), plus "cached" and "extracted_at" (when the result was
+    produced). refresh=True skips the lookup and overwrites the entry.
+    """
+    cache = extraction_cache.get_cache()
+    version = extraction_prompt_version(document_type)
+    key = extraction_cache.ExtractionCache.key(hashlib.sha256(content).hexdigest(), document_type, version)
+    if cache is not None and not refresh:
+        with stage("cache_lookup"):
+            hit = await asyncio.to_thread(cache.get, key)
+        if hit is not None:
+            print(f"   🗃️ Cached extraction from {hit['extracted_at']}")
+            return {**hit["result"], "cached": True, "extracted_at": hit["extracted_at"]}
+    
+    async def work():
+        result = await extract_uncached(content, document_type)
+        result["extracted_at"] = datetime.now().isoformat()
+        if cache is not None:
+            await asyncio.to_thread(cache.put, key, document_type, version, result, result["extracted_at"])
+        return result
+    
+    # Concurrent requests for the same document (duplicate attachments in one run) share one extraction
+    result, shared = await EXTRACTIONS.do(key, work)
+    return {**result, "extracted_data": copy.deepcopy(result["extracted_data"]) if shared else result["extracted_data"],
+            "cached": False}
+
+@app.post("/procurement/extract_document", response_model=DocumentExtractionResult, operation_id="extractDocument")
+async def extract_document(request: DocumentExtractionRequest):
+    """
+    AGENT 2: Document Intelligence Specialist
+    
+    Extracts structured data from procurement documents using OCR + Vision.
+    """
+    if gemini_model is None:
+        raise HTTPException(status_code=500, detail="Gemini API key not configured")
+    
+    try:
+        print(f"📄 Document Intelligence: Extracting {request.document_type}...")
         
-        extracted_data = extract_json_from_text(result_text)
+        content = await asyncio.to_thread(load_document, request.document_url)
+        result = await extract_content(content, request.document_type, refresh=request.refresh)
         
-        return DocumentExtractionResult(
-            document_type=request.document_type,
-            extracted_data=extracted_data,
-            confidence=0.95,
-            timestamp=datetime.now().isoformat()
-        )
+        with stage("postprocess"):
+            return DocumentExtractionResult(
+                document_type=request.document_type,
+                extracted_data=result["extracted_data"],
+                confidence=0.95,
+                timestamp=datetime.now().isoformat(),
+                pages=result["pages"],
+                extracted_by=result["extracted_by"],
+                cached=result["cached"],
+                extracted_at=result["extracted_at"]
+            )
         
+    except ImageTooLargeError:
+        raise
+    except UnsupportedDocumentError as e:
+        raise HTTPException(status_code=415, detail=str(e))
     except Exception as e:
         print(f"❌ Document Extraction Failed: {e}")
         raise HTTPException(status_code=500, detail=f"Document extraction failed: {str(e)}")
 
+class BulkDocument(BaseModel):
+    document_url: str
+    document_type: Optional[str] = None
+
+class BulkExtractionRequest(BaseModel):
+    documents: Optional[List[BulkDocument]] = None
+    directory: Optional[str] = None     # folder of PDFs/images under BULK_INPUT_DIR
+    manifest: Optional[str] = None      # .json / .csv under BULK_INPUT_DIR listing documents
+    document_type: str = "invoice"      # default for entries without a type
+    run_id: Optional[str] = None        # re-submit to resume an interrupted run
+    download_concurrency: Optional[int] = None
+    extract_concurrency: Optional[int] = None
+
+@app.post("/procurement/extract_bulk", operation_id="extractDocumentsBulk")
+async def extract_documents_bulk(request: BulkExtractionRequest):
+    """
+    Bulk document extraction for invoice backlogs.
+    
+    Accepts a list of documents, a directory or a manifest file (both inside
+    BULK_INPUT_DIR; other paths are rejected with 400). Streams NDJSON:
+    a {"run_id", "total"} line, one line per document as it finishes
+    (status ok | error | resumed) and a final {"summary": ...} line.
+    Re-submitting with the same run_id skips documents that already succeeded.
+    """
+    if gemini_model is None:
+        raise HTTPException(status_code=500, detail="Gemini API key not configured")
+    
+    try:
+        if request.documents:
+            items = bulk_extraction.items_from_list([d.dict() for d in request.documents], request.document_type)
+        elif request.directory:
+            items = bulk_extraction.items_from_directory(request.directory, request.document_type)
+        elif request.manifest:
+            items = bulk_extraction.items_from_manifest(request.manifest, request.document_type)
+        else:
+            raise HTTPException(status_code=400, detail="Provide documents, directory or manifest")
+        run_id = request.run_id or f"bulk-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{random.randint(1000, 9999)}"
+        checkpoint = bulk_extraction.Checkpoint(run_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bulk request: {e}")
+    
+    print(f"📚 Bulk extraction {run_id}: {len(items)} documents")
+    
+    async def fetch(item):
+        return await asyncio.to_thread(load_document, item.document_url)
+    
+    async def extract(item, content):
+        return await extract_content(content, item.document_type)
+    
+    async def stream():
+        yield json.dumps({"run_id": run_id, "total": len(items)}) + "\n"
+        async for record in bulk_extraction.run(
+                items, fetch, extract, checkpoint,
+                request.download_concurrency or bulk_extraction.BULK_DOWNLOAD_CONCURRENCY,
+                request.extract_concurrency or bulk_extraction.BULK_EXTRACT_CONCURRENCY):
+            yield json.dumps(record, default=str) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers={"X-Bulk-Run-Id": run_id})
+
+@app.get("/procurement/extract_bulk/{run_id}", operation_id="getBulkExtraction")
+async def get_bulk_extraction(run_id: str):
+    """Progress of a bulk run from its checkpoint (latest record per document)"""
+    try:
+        records = bulk_extraction.Checkpoint(run_id).records()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not records:
+        raise HTTPException(status_code=404, detail=f"No bulk run {run_id}")
+    latest = {r["key"]: r for r in records}
+    return {
+        "run_id": run_id,
+        "documents": len(latest),
+        "ok": sum(1 for r in latest.values() if r.get("status") == "ok"),
+        "error": sum(1 for r in latest.values() if r.get("status") == "error"),
+        "results": sorted(latest.values(), key=lambda r: r.get("index", 0))
+    }
+
 # ============================================================================
 # Agent 3: Budget & Compliance Specialist
 # ============================================================================
 
+# Opening balances, loaded into the ledger for departments it doesn't know yet
+DEFAULT_BUDGETS = {
+    "IT": {"total": 50000.0, "spent": 35000.0},
+    "HR": {"total": 30000.0, "spent": 12000.0},
+    "Finance": {"total": 25000.0, "spent": 20000.0},
+    "Operations": {"total": 100000.0, "spent": 75000.0}
+}
+
+# Budgets with atomic reservations (BUDGET_DB_PATH), shared by all workers
+BUDGETS = budget_ledger.BudgetLedger()
+budget_ledger.seed(BUDGETS, DEFAULT_BUDGETS)
+
+# Approval chains from a declarative policy, compiled and hot-reloaded (APPROVAL_POLICY)
+APPROVALS = approval_policy.PolicyStore()
+
 class BudgetCheckRequest(BaseModel):
     department: str
     amount: float
     cost_center: Optional[str] = None
+    category: Optional[str] = None     # approval policy conditions
+    vendor: Optional[str] = None
+    vendor_risk: Optional[str] = None  # e.g. "low", "medium", "high"
+    reserve: bool = False  # encumber the amount when it fits; commit it via create_po or release it
+    reference: Optional[str] = None  # e.g. the requisition number, stored with the reservation
 
 class BudgetCheckResult(BaseModel):
     budget_available: bool
@@ -258,6 +499,8 @@ class BudgetCheckResult(BaseModel):
     approval_chain: List[str]
     compliance_status: str
     timestamp: str
+    reservation_id: Optional[str] = None
+    advisory: bool = False  # nothing was reserved: a concurrent requisition can still take the budget
 
 @app.post("/procurement/check_budget", response_model=BudgetCheckResult, operation_id="checkBudget")
 async def check_budget(request: BudgetCheckRequest):
@@ -265,53 +508,137 @@ async def check_budget(request: BudgetCheckRequest):
     AGENT 3: Budget & Compliance Specialist
     
     Validates budget availability and determines approval requirements.
+    With reserve the amount is encumbered atomically, so concurrent
+    requisitions can't overspend a budget; available_budget is what remains
+    and the returned reservation_id must be passed to create_po (or released).
+    Without it (default) this is a read-only check against the balance and
+    the result is marked advisory: two concurrent checks can both see the
+    same budget as available. Pass reserve=true before committing spend.
     """
     print(f"💰 Budget Specialist: Checking budget for {request.department}...")
     
-    # Mock budget database
-    mock_budgets = {
-        "IT": {"total": 50000.0, "spent": 35000.0, "available": 15000.0},
-        "HR": {"total": 30000.0, "spent": 12000.0, "available": 18000.0},
-        "Finance": {"total": 25000.0, "spent": 20000.0, "available": 5000.0},
-        "Operations": {"total": 100000.0, "spent": 75000.0, "available": 25000.0}
-    }
-    
-    dept_budget = mock_budgets.get(request.department, {"total": 0.0, "spent": 0.0, "available": 0.0})
-    available = dept_budget["available"]
-    
-    budget_available = available >= request.amount
-    
-    # Determine approval chain based on amount
-    approval_required = request.amount > 1000.0
-    approval_chain = []
-    
-    if approval_required:
-        if request.amount <= 5000.0:
-            approval_chain = [f"{request.department} Manager"]
-        elif request.amount <= 20000.0:
-            approval_chain = [f"{request.department} Manager", "VP Finance"]
-        else:
-            approval_chain = [f"{request.department} Manager", "VP Finance", "CFO"]
+    account = await asyncio.to_thread(BUDGETS.resolve_account, request.department, request.cost_center)
+    reservation_id = None
+    if request.reserve and request.amount > 0:
+        with stage("budget_reserve"):
+            reservation = await BUDGETS.reserve(account, request.amount, reference=request.reference)
+        budget_available = reservation["ok"]
+        available = reservation["available"]
+        reservation_id = reservation["reservation_id"]
+        advisory = False
+    else:
+        balance = await asyncio.to_thread(BUDGETS.balance, account)
+        available = balance["available"] if balance else 0.0
+        budget_available = available >= request.amount
+        advisory = True
     
-    compliance_status = "COMPLIANT" if budget_available else "BUDGET_EXCEEDED"
+    # Approval chain from the compiled policy (APPROVAL_POLICY)
+    approval_chain, status_override = APPROVALS.current().decide(request.dict())
+    approval_policy.POLICY_DECISIONS.inc(metrics.SERVICE, "single")
     
     return BudgetCheckResult(
         budget_available=budget_available,
         available_budget=available,
-        approval_required=approval_required,
-        approval_chain=approval_chain,
-        compliance_status=compliance_status,
-        timestamp=datetime.now().isoformat()
+        approval_required=bool(approval_chain),
+        approval_chain=list(approval_chain),
+        compliance_status=approval_policy.compliance_status(status_override, budget_available),
+        timestamp=datetime.now().isoformat(),
+        reservation_id=reservation_id,
+        advisory=advisory
     )
 
+class ApprovalRequisition(BaseModel):
+    department: str
+    amount: float
+    cost_center: Optional[str] = None
+    category: Optional[str] = None
+    vendor: Optional[str] = None
+    vendor_risk: Optional[str] = None
+
+class BulkApprovalRequest(BaseModel):
+    requisitions: List[ApprovalRequisition]
+    check_budget: bool = True  # compliance_status against current balances (nothing is reserved)
+
+@app.post("/procurement/approval_chains", operation_id="evaluateApprovalChains")
+async def evaluate_approval_chains(request: BulkApprovalRequest):
+    """
+    Bulk approval decisions: the approval_chain and compliance_status
+    check_budget would return for each requisition, in order. Budgets are
+    compared against the balances at the time of the call, one requisition
+    at a time; nothing is reserved.
+    """
+    policy = APPROVALS.current()
+    balances = {}
+    start = time.perf_counter()
+    results = []
+    for requisition in request.requisitions:
+        fields = requisition.dict()
+        chain, status_override = policy.decide(fields)
+        budget_available = True
+        if request.check_budget:
+            account = (requisition.department, requisition.cost_center)
+            if account not in balances:
+                balances[account] = await asyncio.to_thread(
+                    lambda: BUDGETS.balance(BUDGETS.resolve_account(*account)))
+            balance = balances[account]
+            budget_available = balance is not None and balance["available"] >= requisition.amount
+        results.append({
+            "approval_required": bool(chain),
+            "approval_chain": list(chain),
+            "compliance_status": approval_policy.compliance_status(status_override, budget_available),
+            "budget_available": budget_available
+        })
+    elapsed = time.perf_counter() - start
+    approval_policy.POLICY_DECISIONS.inc(metrics.SERVICE, "bulk", amount=len(results))
+    return {
+        "policy_version": policy.version,
+        "count": len(results),
+        "microseconds_per_requisition": round(elapsed * 1e6 / max(1, len(results)), 2),
+        "results": results,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/admin/approval_policy", include_in_schema=False)
+async def get_approval_policy(x_admin_token: Optional[str] = Header(None)):
+    """Loaded approval policy: source, version, rule count, last load error"""
+    require_admin(x_admin_token)
+    APPROVALS.current()
+    return APPROVALS.info()
+
+@app.post("/admin/approval_policy/reload", include_in_schema=False)
+async def reload_approval_policy(x_admin_token: Optional[str] = Header(None)):
+    """Re-read the policy file now instead of waiting for the change check; needs ADMIN_TOKEN"""
+    require_admin(x_admin_token, mutate=True)
+    if not APPROVALS.reload(force=True):
+        raise HTTPException(status_code=422, detail=f"Policy rejected: {APPROVALS.error}")
+    return APPROVALS.info()
+
+@app.get("/procurement/budgets", operation_id="getBudgets")
+async def get_budgets():
+    """Budget balances per department / cost center (total, spent, encumbered, available)"""
+    return {"budgets": await asyncio.to_thread(BUDGETS.balances)}
+
+@app.post("/procurement/budget/reservations/{reservation_id}/release", operation_id="releaseBudget")
+async def release_budget(reservation_id: str):
+    """Give an open reservation back to the budget (requisition rejected or cancelled)"""
+    try:
+        return await BUDGETS.release(reservation_id)
+    except budget_ledger.LedgerError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 # ============================================================================
 # Agent 4: Purchase Order Specialist
 # ============================================================================
 
+# Purchase orders with sequence-based numbers (PO_DB_PATH); the demo PO is seeded
+PO_STORE = po_store.POStore()
+PO_STORE.seed()
+
 class CreatePORequest(BaseModel):
     requisition_data: Dict
     vendor_name: str
     department: str
+    reservation_id: Optional[str] = None  # from check_budget: committed (reserved -> spent) with the PO total
 
 class POResult(BaseModel):
     po_number: str
@@ -330,9 +657,6 @@ async def create_purchase_order(request: CreatePORequest):
     """
     print(f"📋 PO Specialist: Creating PO for {request.vendor_name}...")
     
-    # Generate PO number
-    po_number = f"PO-{datetime.now().strftime('%Y%m%d')}-{random.randint(1000, 9999)}"
-    
     # Extract total from requisition, handle None/null values
     total_amount = request.requisition_data.get("total_estimated_cost", 0.0)
     if total_amount is None or total_amount == 'null':
@@ -342,15 +666,50 @@ async def create_purchase_order(request: CreatePORequest):
     except (TypeError, ValueError):
         total_amount = 0.0
     
+    # Stored under the next number of the day's sequence (PO-YYYYMMDD-000001)
+    with stage("po_insert"):
+        po = await asyncio.to_thread(
+            PO_STORE.create, request.vendor_name, request.department, total_amount,
+            request.requisition_data.get("line_items"),
+            requisition_number=request.requisition_data.get("requisition_number"),
+            reservation_id=request.reservation_id)
+    
+    # The budget is spent only once the PO exists; a failed commit takes the PO back
+    if request.reservation_id:
+        try:
+            with stage("budget_commit"):
+                await BUDGETS.commit(request.reservation_id, total_amount or None)
+        except Exception as e:
+            await asyncio.to_thread(PO_STORE.delete, po["po_number"])
+            if isinstance(e, budget_ledger.LedgerError):
+                raise HTTPException(status_code=409, detail=str(e))
+            raise
+    
     return POResult(
-        po_number=po_number,
+        po_number=po["po_number"],
         status="CREATED",
         vendor_name=request.vendor_name,
         total_amount=total_amount,
-        created_date=datetime.now().strftime("%Y-%m-%d"),
+        created_date=po["created_date"],
         timestamp=datetime.now().isoformat()
     )
 
+@app.get("/procurement/purchase_orders/{po_number}", operation_id="getPurchaseOrder")
+async def get_purchase_order(po_number: str):
+    """A stored PO with its line items"""
+    po = await asyncio.to_thread(PO_STORE.get, po_number)
+    if po is None:
+        raise HTTPException(status_code=404, detail=f"No purchase order {po_number}")
+    return po
+
+@app.get("/procurement/purchase_orders", operation_id="searchPurchaseOrders")
+async def search_purchase_orders(vendor_name: Optional[str] = None, department: Optional[str] = None,
+                                 date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                 limit: int = Query(100, ge=1, le=1000)):
+    """Stored PO headers by vendor, department and/or created_date range (YYYY-MM-DD), newest first"""
+    return {"purchase_orders": await asyncio.to_thread(
+        PO_STORE.search, vendor_name, department, date_from, date_to, limit)}
+
 class MatchInvoiceRequest(BaseModel):
     invoice_data: Dict
     po_number: str
@@ -374,18 +733,9 @@ async def match_invoice_to_po(request: MatchInvoiceRequest):
     try:
         print(f"🔍 PO Specialist: Matching invoice to PO {request.po_number}...")
         
-        # Mock PO data (in real system, would query database)
-        mock_pos = {
-            "PO-20250110-1234": {
-                "total_amount": 1250.00,
-                "line_items": [
-                    {"description": "Office Chairs", "quantity": 5, "unit_price": 200.00},
-                    {"description": "Desk Lamps", "quantity": 3, "unit_price": 50.00}
-                ]
-            }
-        }
-        
-        po_data = mock_pos.get(request.po_number, {})
+        # PO with its line items from the PO store (single indexed lookup)
+        with stage("po_lookup"):
+            po_data = await asyncio.to_thread(PO_STORE.get, request.po_number) or {}
         
         # Extract invoice total first
         invoice_total = request.invoice_data.get("total_amount", 0.0)
@@ -396,7 +746,7 @@ async def match_invoice_to_po(request: MatchInvoiceRequest):
         except (TypeError, ValueError):
             invoice_total = 0.0
         
-        # If PO not found in mock data, use invoice amount as fallback (for testing)
+        # If PO not found in the store, use invoice amount as fallback (for testing)
         if not po_data:
             # Use invoice amount as PO amount (assumes they match for testing)
             po_total = invoice_total if invoice_total > 0 else 1000.0
@@ -783,8 +1133,9 @@ async def health():
         "status": "healthy",
         "service": "procurement_automation",
         "gemini": GEMINI_API_KEY is not None,
+        "model_replay": REPLAY_MODE,
         "version": "1.0.0",
-        "features": ["procurement", "inventory_management"]
+        "features": ["procurement", "inventory_management", "metrics"]
     }
 
 if __name__ == "__main__":
@@ -805,5 +1156,9 @@ if __name__ == "__main__":
     print("   POST /inventory/adjust - Streamline Adjustments")
     print("   POST /inventory/optimize - Optimize Inventory")
     print("=" * 80 + "\n")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if WORKERS > 1:
+        uvicorn.run("main_procurement:app", host="0.0.0.0", port=8000, workers=WORKERS,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -0,0 +1,369 @@
+"""
+Lightweight Metrics (Prometheus text format)
+Per-stage latency histograms and error/retry/cache counters shared by both backends.
+
+Hot-path cost is two perf_counter() calls and a list append per stage; the
+histograms are updated once per request after the response has been sent.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.responses import PlainTextResponse
+
+# Upper bounds in seconds, sized for anything from a cache hit to a slow Gemini call
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Monotonic counter keyed by label values"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {json.dumps(k): v for k, v in self._values.items()}
+
+    def merge(self, snap: dict, into: Dict[tuple, float]):
+        for k, v in snap.items():
+            key = tuple(json.loads(k))
+            into[key] = into.get(key, 0.0) + v
+
+    def render(self, values: Dict[tuple, float]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values: Dict[tuple, list] = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[idx] += 1
+            entry[-1] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {json.dumps(k): list(v) for k, v in self._values.items()}
+
+    def merge(self, snap: dict, into: Dict[tuple, list]):
+        for k, v in snap.items():
+            key = tuple(json.loads(k))
+            if key in into:
+                into[key] = [a + b for a, b in zip(into[key], v)]
+            else:
+                into[key] = list(v)
+
+    def render(self, values: Dict[tuple, list]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, entry in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            cumulative += entry[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {entry[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name, help_text, labelnames=()) -> Counter:
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, help_text, tuple(labelnames))
+        return self.metrics[name]
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, help_text, tuple(labelnames), buckets)
+        return self.metrics[name]
+
+    def snapshot(self) -> dict:
+        return {name: m.snapshot() for name, m in self.metrics.items()}
+
+    def render(self, extra_snapshots: Optional[List[dict]] = None) -> str:
+        lines = []
+        for name, metric in self.metrics.items():
+            values = {}
+            metric.merge(metric.snapshot(), values)
+            for snap in extra_snapshots or []:
+                metric.merge(snap.get(name, {}), values)
+            lines.extend(metric.render(values))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Core metrics ---------------------------------------------------------------
+REQUEST_SECONDS = REGISTRY.histogram(
+    "visionflow_request_seconds", "End-to-end request latency", ("service", "endpoint", "method", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "visionflow_stage_seconds", "Latency of each processing stage within a request", ("service", "endpoint", "stage"))
+GEMINI_CALLS = REGISTRY.counter(
+    "visionflow_gemini_calls_total", "Model generate_content calls", ("service", "model"))
+GEMINI_ERRORS = REGISTRY.counter(
+    "visionflow_gemini_errors_total", "Model calls that raised an error", ("service", "model", "kind"))
+GEMINI_RETRIES = REGISTRY.counter(
+    "visionflow_gemini_retries_total", "Model calls retried after a rate-limit/quota error", ("service",))
+CACHE_HITS = REGISTRY.counter(
+    "visionflow_cache_hits_total", "Cache hits", ("service", "cache"))
+CACHE_MISSES = REGISTRY.counter(
+    "visionflow_cache_misses_total", "Cache misses", ("service", "cache"))
+PARSE_FAILURES = REGISTRY.counter(
+    "visionflow_json_parse_failures_total", "Model responses that could not be parsed as JSON", ("service",))
+
+# Per-request stage timings ----------------------------------------------------
+
+SERVICE = "unknown"  # set by install_metrics()
+
+
+class RequestTimings:
+    """Stage durations collected while a single request is handled"""
+
+    __slots__ = ("stages", "start")
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+        self.start = time.perf_counter()
+
+    def add(self, name: str, seconds: float):
+        self.stages.append((name, seconds))
+
+    def server_timing(self) -> str:
+        """Render stages as a Server-Timing header value (repeated stages are summed)"""
+        totals: Dict[str, float] = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current_timings.get()
+
+
+class stage:
+    """
+    Time a processing stage:
+
+        with stage("model_call"):
+            response = model.generate_content(...)
+    """
+
+    __slots__ = ("name", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(self.name, elapsed)
+        else:
+            # Outside a request (startup, background work): record immediately
+            STAGE_SECONDS.observe(elapsed, SERVICE, "background", self.name)
+        return False
+
+
+def record_stage(name: str, seconds: float):
+    """Record a stage measured elsewhere (e.g. inside a worker thread)"""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+    else:
+        STAGE_SECONDS.observe(seconds, SERVICE, "background", name)
+
+
+def current_endpoint(scope: dict) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("path", "unknown")
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware: opens a RequestTimings per request, adds a
+    Server-Timing header with the stage breakdown and flushes the
+    timings to the histograms once the request is done.
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                headers.append((b"timing-allow-origin", b"*"))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_timings.reset(token)
+            endpoint = current_endpoint(scope)
+            if endpoint != "/metrics":
+                flush_timings(timings, self.service, endpoint, scope.get("method", ""), str(status["code"]))
+
+
+def flush_timings(timings: RequestTimings, service: str, endpoint: str, method: str, status: str):
+    REQUEST_SECONDS.observe(time.perf_counter() - timings.start, service, endpoint, method, status)
+    for name, seconds in timings.stages:
+        STAGE_SECONDS.observe(seconds, service, endpoint, name)
+
+
+class message_timings:
+    """
+    Per-message equivalent of MetricsMiddleware for work that isn't an HTTP
+    request (e.g. one WebSocket frame):
+
+        with message_timings("/ws/vas/{station_id}") as timings:
+            ...
+    """
+
+    def __init__(self, endpoint: str, method: str = "WS"):
+        self.endpoint = endpoint
+        self.method = method
+        self.status = "ok"
+        self.timings = RequestTimings()
+
+    def __enter__(self):
+        self._token = _current_timings.set(self.timings)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_timings.reset(self._token)
+        status = "error" if exc_type is not None else self.status
+        flush_timings(self.timings, SERVICE, self.endpoint, self.method, status)
+        return False
+
+
+# Multi-worker aggregation ------------------------------------------------------
+# Each worker owns its registry; with WEB_CONCURRENCY > 1 every worker periodically
+# writes a snapshot to METRICS_DIR and /metrics sums the snapshots of its peers.
+
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_STALE_AFTER = 10 * METRICS_FLUSH_INTERVAL
+
+
+def _start_snapshot_writer(metrics_dir: str):
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f"{SERVICE}-{os.getpid()}.json")
+
+    def loop():
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(REGISTRY.snapshot(), f)
+            os.replace(tmp, path)
+
+    threading.Thread(target=loop, name="metrics-snapshot", daemon=True).start()
+
+
+def _peer_snapshots(metrics_dir: str) -> List[dict]:
+    snapshots = []
+    own = f"{SERVICE}-{os.getpid()}.json"
+    now = time.time()
+    for name in os.listdir(metrics_dir):
+        if not name.startswith(f"{SERVICE}-") or not name.endswith(".json") or name == own:
+            continue
+        path = os.path.join(metrics_dir, name)
+        try:
+            if now - os.path.getmtime(path) > METRICS_STALE_AFTER:
+                continue  # worker exited
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def install_metrics(app, service: str, workers: int = 1, metrics_dir: Optional[str] = None):
+    """Attach the timing middleware and a Prometheus-text /metrics endpoint"""
+    global SERVICE
+    SERVICE = service
+    app.add_middleware(MetricsMiddleware, service=service)
+
+    if workers > 1:
+        from state_store import DATA_DIR
+        metrics_dir = metrics_dir or os.getenv("METRICS_DIR", os.path.join(DATA_DIR, "metrics"))
+        _start_snapshot_writer(metrics_dir)
+    else:
+        metrics_dir = None
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        peers = _peer_snapshots(metrics_dir) if metrics_dir else None
+        return PlainTextResponse(REGISTRY.render(peers), media_type="text/plain; version=0.0.4")
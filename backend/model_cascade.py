@@ -0,0 +1,202 @@
+"""
+Model Cascade
+Routes each vision call through a list of model tiers, cheapest first, and
+only escalates when the cheaper answer can't be trusted: invalid/unparseable
+JSON, confidence under the route's threshold, or HIGH/CRITICAL findings.
+
+Configured with MODEL_CASCADE (inline JSON or a path to a JSON file):
+
+    {
+      "tiers": {
+        "lite":  {"model": "models/gemini-2.5-flash-lite", "max_side": 768,
+                  "input_usd_per_mtok": 0.10, "output_usd_per_mtok": 0.40},
+        "flash": {"model": "models/gemini-2.5-flash",
+                  "input_usd_per_mtok": 0.30, "output_usd_per_mtok": 2.50}
+      },
+      "routes": {
+        "box_inspection":   {"CRITICAL": ["flash"], "*": ["lite", "flash"]},
+        "vas_verification": {"*": ["lite", "flash"]}
+      },
+      "min_confidence": {"*": 0.8, "vas_verification": 0.85}
+    }
+
+Routes not listed (and everything when MODEL_CASCADE is unset) use the single
+GEMINI_MODEL tier, i.e. the old behaviour. max_side downsizes images for that
+tier only. Per-tier calls, escalations (by reason), latency, tokens and
+estimated cost are exported as metrics.
+"""
+
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+from PIL import Image
+
+import metrics
+import model_replay
+from gemini_client import generate_content, model_name
+from label_detector import estimate_image_tokens
+from metrics import REGISTRY
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "models/gemini-2.5-flash")
+MODEL_CASCADE = os.getenv("MODEL_CASCADE", "")
+
+DEFAULT_TIER = "default"
+SEVERE = ("HIGH", "CRITICAL")
+
+CASCADE_RESULTS = REGISTRY.counter(
+    "visionflow_cascade_calls_total",
+    "Model calls per cascade tier by outcome (accepted, or the escalation reason)",
+    ("service", "route", "tier", "outcome"))
+CASCADE_SECONDS = REGISTRY.histogram(
+    "visionflow_cascade_seconds", "Model call latency per cascade tier", ("service", "route", "tier"))
+CASCADE_TOKENS = REGISTRY.counter(
+    "visionflow_cascade_tokens_total", "Tokens per cascade tier (estimated when the API reports none)",
+    ("service", "route", "tier", "kind"))
+CASCADE_COST = REGISTRY.counter(
+    "visionflow_cascade_cost_usd_total", "Estimated model cost per cascade tier", ("service", "route", "tier"))
+
+
+class EscalationError(ValueError):
+    """Raised by a route's check when an answer fails validation"""
+
+
+@dataclass
+class Tier:
+    name: str
+    model: str
+    max_side: Optional[int] = None
+    input_usd_per_mtok: float = 0.0
+    output_usd_per_mtok: float = 0.0
+
+
+class Cascade:
+    def __init__(self, config: Optional[dict] = None):
+        config = config or {}
+        self.tiers: Dict[str, Tier] = {DEFAULT_TIER: Tier(DEFAULT_TIER, GEMINI_MODEL)}
+        for name, spec in config.get("tiers", {}).items():
+            self.tiers[name] = Tier(name, **spec)
+        self.routes: Dict[str, Dict[str, List[str]]] = config.get("routes", {})
+        for route, by_priority in self.routes.items():
+            for tiers in by_priority.values():
+                unknown = [t for t in tiers if t not in self.tiers]
+                if unknown:
+                    raise ValueError(f"MODEL_CASCADE route {route} uses unknown tiers {unknown}")
+        min_confidence = config.get("min_confidence", 0.7)
+        self.min_confidence = min_confidence if isinstance(min_confidence, dict) else {"*": min_confidence}
+        self._models: Dict[str, Any] = {}
+
+    def tiers_for(self, route: str, priority: str = "STANDARD") -> List[Tier]:
+        by_priority = self.routes.get(route, {})
+        names = by_priority.get((priority or "STANDARD").upper()) or by_priority.get("*") or [DEFAULT_TIER]
+        return [self.tiers[n] for n in names]
+
+    def threshold(self, route: str) -> float:
+        return float(self.min_confidence.get(route, self.min_confidence.get("*", 0.7)))
+
+    def model_for(self, tier: Tier, default_model):
+        # The app's own model object serves the default tier and its model name (keeps test/replay wiring intact)
+        if default_model is not None and (tier.name == DEFAULT_TIER or model_name(default_model) == tier.model):
+            return default_model
+        if tier.model not in self._models:
+            self._models[tier.model] = genai.GenerativeModel(tier.model)
+        return self._models[tier.model]
+
+
+def load_cascade(value: str = MODEL_CASCADE) -> Cascade:
+    if not value:
+        return Cascade()
+    if not value.lstrip().startswith("{"):
+        with open(value) as f:
+            value = f.read()
+    cascade = Cascade(json.loads(value))
+    for route, by_priority in cascade.routes.items():
+        print(f"🪜 Model cascade {route}: " + "; ".join(f"{p}: {' -> '.join(t)}" for p, t in by_priority.items()))
+    return cascade
+
+
+CASCADE = load_cascade()
+
+
+def _downsized(parts: list, max_side: Optional[int]) -> list:
+    if not max_side:
+        return parts
+    out = []
+    for part in parts:
+        if isinstance(part, Image.Image) and max(part.size) > max_side:
+            part = part.copy()
+            part.thumbnail((max_side, max_side))
+        out.append(part)
+    return out
+
+
+def _usage(response, parts: list) -> Tuple[int, int]:
+    usage = model_replay.usage_dict(response)
+    if usage and usage.get("prompt_token_count"):
+        return int(usage["prompt_token_count"]), int(usage.get("candidates_token_count") or 0)
+    # No usage reported (replay of old recordings, stand-ins): ~4 chars per token + image tiles
+    text = sum(len(p) for p in parts if isinstance(p, str))
+    images = sum(estimate_image_tokens(*p.size) for p in parts if isinstance(p, Image.Image))
+    return text // 4 + images, len(getattr(response, "text", "") or "") // 4
+
+
+def _observe(route: str, tier: Tier, seconds: float, response, parts: list):
+    service = metrics.SERVICE
+    CASCADE_SECONDS.observe(seconds, service, route, tier.name)
+    if response is None:
+        return
+    tokens_in, tokens_out = _usage(response, parts)
+    CASCADE_TOKENS.inc(service, route, tier.name, "input", amount=tokens_in)
+    CASCADE_TOKENS.inc(service, route, tier.name, "output", amount=tokens_out)
+    cost = (tokens_in * tier.input_usd_per_mtok + tokens_out * tier.output_usd_per_mtok) / 1e6
+    if cost:
+        CASCADE_COST.inc(service, route, tier.name, amount=cost)
+
+
+def low_confidence(analysis: dict, threshold: float, key: str = "confidence") -> bool:
+    value = analysis.get(key)
+    return isinstance(value, (int, float)) and value < threshold
+
+
+def severe_findings(findings) -> bool:
+    return any(str((f or {}).get("severity", "")).upper() in SEVERE for f in findings or [] if isinstance(f, dict))
+
+
+def run(route: str, priority: str, parts: list, parse: Callable[[str], Any],
+        check: Optional[Callable[[Any, float], Optional[str]]] = None,
+        default_model=None, hedge: bool = False) -> Tuple[Any, str]:
+    """
+    Call each tier in turn until one's answer is accepted; returns (parsed answer, tier name).
+
+    parse(text) turns the response into the answer (raising on bad JSON); check(answer,
+    min_confidence) returns an escalation reason or None, and may raise EscalationError
+    for schema failures. The last tier's answer is returned as is; its errors propagate.
+    """
+    tiers = CASCADE.tiers_for(route, priority)
+    threshold = CASCADE.threshold(route)
+    for i, tier in enumerate(tiers):
+        last = i == len(tiers) - 1
+        tier_parts = _downsized(parts, tier.max_side)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = generate_content(CASCADE.model_for(tier, default_model), tier_parts, hedge=hedge)
+            answer = parse(response.text.strip())
+            reason = None if last or check is None else check(answer, threshold)
+        except Exception as e:
+            if last:
+                _observe(route, tier, time.perf_counter() - start, response, tier_parts)
+                CASCADE_RESULTS.inc(metrics.SERVICE, route, tier.name, "failed")
+                raise
+            reason = "invalid" if response is not None else "error"
+            print(f"  🪜 {tier.name} answer unusable ({type(e).__name__}: {e}), escalating")
+        _observe(route, tier, time.perf_counter() - start, response, tier_parts)
+        CASCADE_RESULTS.inc(metrics.SERVICE, route, tier.name, reason or "accepted")
+        if reason is None:
+            return answer, tier.name
+        if reason not in ("invalid", "error"):
+            print(f"  🪜 {tier.name} answer escalated ({reason})")
+    raise RuntimeError("unreachable: the last tier always returns or raises")
@@ -0,0 +1,112 @@
+"""
+Model Record & Replay
+Records every generate_content response to disk, keyed by prompt hash and
+image hash, and serves them back later without calling Gemini.
+
+    MODEL_REPLAY_MODE=record   call Gemini and store each response
+    MODEL_REPLAY_MODE=replay   serve stored responses, never call Gemini
+    MODEL_REPLAY_LATENCY=original|zero   sleep for the recorded latency or not at all
+    MODEL_REPLAY_MISS=error|live         what replay does when nothing was recorded
+"""
+
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from state_store import DATA_DIR
+
+REPLAY_MODE = os.getenv("MODEL_REPLAY_MODE", "off").lower()
+REPLAY_DIR = os.getenv("MODEL_REPLAY_DIR", os.path.join(DATA_DIR, "model_recordings"))
+REPLAY_LATENCY = os.getenv("MODEL_REPLAY_LATENCY", "original").lower()
+REPLAY_MISS = os.getenv("MODEL_REPLAY_MISS", "error").lower()
+
+
+class ReplayMissError(Exception):
+    """Replay mode found no recording for this prompt + image combination"""
+
+
+class ReplayedResponse:
+    """Minimal stand-in for a GenerateContentResponse"""
+
+    def __init__(self, text: str, usage: Optional[dict] = None):
+        self.text = text
+        self.usage_metadata = usage
+        self.replayed = True
+
+
+def image_hash(part) -> str:
+    # Prefer the hash of the original encoded bytes when the loader attached one
+    info = getattr(part, "info", None) or {}
+    if info.get("content_sha256"):
+        return info["content_sha256"]
+    if hasattr(part, "tobytes"):
+        h = hashlib.sha256(f"{part.mode}:{part.size}".encode())
+        h.update(part.tobytes())
+        return h.hexdigest()
+    if isinstance(part, (bytes, bytearray)):
+        return hashlib.sha256(part).hexdigest()
+    return hashlib.sha256(repr(part).encode()).hexdigest()
+
+
+def request_key(model_name: str, parts: List) -> dict:
+    texts = [p for p in parts if isinstance(p, str)]
+    images = [image_hash(p) for p in parts if not isinstance(p, str)]
+    prompt_hash = hashlib.sha256("\n".join(texts).encode()).hexdigest()
+    images_hash = hashlib.sha256("|".join(images).encode()).hexdigest()
+    return {"model": model_name, "prompt_hash": prompt_hash, "image_hashes": images, "images_hash": images_hash}
+
+
+class ReplayStore:
+    def __init__(self, root: str = REPLAY_DIR):
+        self.root = root
+
+    def _path(self, key: dict) -> str:
+        model_slug = key["model"].replace("/", "_")
+        return os.path.join(self.root, model_slug, key["prompt_hash"][:16], f"{key['images_hash'][:24]}.json")
+
+    def load(self, key: dict) -> Optional[dict]:
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, key: dict, text: str, latency_s: float, usage: Optional[dict] = None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = {**key, "text": text, "latency_s": latency_s, "usage": usage,
+                  "recorded_at": datetime.now().isoformat()}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f, indent=2)
+        os.replace(tmp, path)
+
+
+def usage_dict(response) -> Optional[dict]:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage
+    return {
+        "prompt_token_count": getattr(usage, "prompt_token_count", 0),
+        "candidates_token_count": getattr(usage, "candidates_token_count", 0),
+        "total_token_count": getattr(usage, "total_token_count", 0),
+    }
+
+
+def replay(store: ReplayStore, key: dict) -> Optional[ReplayedResponse]:
+    record = store.load(key)
+    if record is None:
+        return None
+    if REPLAY_LATENCY == "original" and record.get("latency_s"):
+        time.sleep(record["latency_s"])
+    return ReplayedResponse(record["text"], record.get("usage"))
+
+
+STORE = ReplayStore()
+if REPLAY_MODE != "off":
+    print(f"📼 Model {REPLAY_MODE} mode: {REPLAY_DIR} (latency={REPLAY_LATENCY}, miss={REPLAY_MISS})")
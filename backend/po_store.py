@@ -0,0 +1,231 @@
+"""
+Purchase Order Store
+Persists purchase orders created by the PO Specialist so invoice matching
+can read the real PO instead of a mock.
+
+    PO_DB_PATH=data/po_store.db   SQLite (WAL), shared by every worker
+
+PO numbers come from a per-day sequence in the same database:
+PO-YYYYMMDD-000001, PO-YYYYMMDD-000002, ... The sequence row is incremented
+and the PO inserted in one write transaction, so two workers can never mint
+the same number (the old random 4-digit suffix collided after a few dozen
+POs a day).
+
+Line items are stored normalized (one row per item, keyed by PO id and line
+number, WITHOUT ROWID so a PO's items are stored together), amounts in
+integer cents. Indexes: po_number (unique), vendor + date, department +
+date, date. get() reads a PO with its items in one indexed query.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from state_store import DATA_DIR
+
+PO_DB_PATH = os.getenv("PO_DB_PATH", os.path.join(DATA_DIR, "po_store.db"))
+
+# PO referenced by the demo scenarios (TEST_SCENARIOS.md, test_procurement_workflow.py)
+SEED_POS = [{
+    "po_number": "PO-20250110-1234",
+    "vendor_name": "Office Supplies Co",
+    "department": "IT",
+    "created_date": "2025-01-10",
+    "total_amount": 1250.00,
+    "line_items": [
+        {"description": "Office Chairs", "quantity": 5, "unit_price": 200.00},
+        {"description": "Desk Lamps", "quantity": 3, "unit_price": 50.00}
+    ]
+}]
+
+
+def _cents(amount) -> Optional[int]:
+    try:
+        return None if amount is None else int(round(float(amount) * 100))
+    except (TypeError, ValueError):
+        return None
+
+
+def _quantity(value):
+    # Stored as REAL; whole quantities come back as ints, like the documents they came from
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def _unit_price(item: dict):
+    # Requisitions carry estimated_price, invoices and POs unit_price
+    return item.get("unit_price", item.get("estimated_price"))
+
+
+class POStore:
+    def __init__(self, path: str = PO_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS purchase_orders (
+                id INTEGER PRIMARY KEY,
+                po_number TEXT NOT NULL UNIQUE,
+                vendor_name TEXT NOT NULL,
+                department TEXT NOT NULL,
+                created_date TEXT NOT NULL,
+                total_cents INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                requisition_number TEXT,
+                reservation_id TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_po_vendor_date ON purchase_orders(vendor_name, created_date);
+            CREATE INDEX IF NOT EXISTS idx_po_department_date ON purchase_orders(department, created_date);
+            CREATE INDEX IF NOT EXISTS idx_po_date ON purchase_orders(created_date);
+            CREATE TABLE IF NOT EXISTS po_line_items (
+                po_id INTEGER NOT NULL,
+                line_no INTEGER NOT NULL,
+                description TEXT,
+                quantity REAL,
+                unit_price_cents INTEGER,
+                PRIMARY KEY (po_id, line_no)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS po_sequences (
+                day TEXT PRIMARY KEY,
+                last INTEGER NOT NULL
+            );
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        # Same setup as SQLiteStateStore: one autocommit connection per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    # Writes --------------------------------------------------------------
+
+    @staticmethod
+    def _next_numbers(conn, day: str, count: int) -> List[str]:
+        """Allocate count consecutive sequence numbers for day (inside the caller's transaction)"""
+        conn.execute("INSERT INTO po_sequences (day, last) VALUES (?, 0) ON CONFLICT(day) DO NOTHING", (day,))
+        conn.execute("UPDATE po_sequences SET last = last + ? WHERE day = ?", (count, day))
+        last = conn.execute("SELECT last FROM po_sequences WHERE day = ?", (day,)).fetchone()[0]
+        compact = day.replace("-", "")
+        return [f"PO-{compact}-{n:06d}" for n in range(last - count + 1, last + 1)]
+
+    @staticmethod
+    def _insert(conn, po: dict) -> dict:
+        cursor = conn.execute(
+            "INSERT INTO purchase_orders (po_number, vendor_name, department, created_date, total_cents, status, "
+            "requisition_number, reservation_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (po["po_number"], po["vendor_name"], po["department"], po["created_date"],
+             _cents(po.get("total_amount")) or 0, po.get("status", "CREATED"), po.get("requisition_number"),
+             po.get("reservation_id"), time.time()))
+        conn.executemany(
+            "INSERT INTO po_line_items (po_id, line_no, description, quantity, unit_price_cents) VALUES (?, ?, ?, ?, ?)",
+            [(cursor.lastrowid, n, item.get("description"), item.get("quantity"), _cents(_unit_price(item)))
+             for n, item in enumerate(po.get("line_items") or [], start=1) if isinstance(item, dict)])
+        return po
+
+    def create(self, vendor_name: str, department: str, total_amount: float, line_items: Optional[list] = None,
+               created_date: Optional[str] = None, **extra) -> dict:
+        """Insert a PO under the next number of its day; returns it with po_number set"""
+        return self.create_many([dict(extra, vendor_name=vendor_name, department=department,
+                                      total_amount=total_amount, line_items=line_items,
+                                      created_date=created_date)])[0]
+
+    def create_many(self, pos: List[dict]) -> List[dict]:
+        """Insert several POs in one transaction (imports, benchmarks)"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            by_day: Dict[str, List[dict]] = {}
+            for po in pos:
+                po["created_date"] = po.get("created_date") or date.today().isoformat()
+                by_day.setdefault(po["created_date"], []).append(po)
+            for day, group in by_day.items():
+                for po, number in zip(group, self._next_numbers(conn, day, len(group))):
+                    po["po_number"] = number
+                    self._insert(conn, po)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return pos
+
+    def seed(self, pos: Iterable[dict] = SEED_POS):
+        """Insert POs with fixed numbers unless they exist"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for po in pos:
+                if not conn.execute("SELECT 1 FROM purchase_orders WHERE po_number = ?", (po["po_number"],)).fetchone():
+                    self._insert(conn, po)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, po_number: str) -> bool:
+        """Remove a PO and its line items (undoes a create whose follow-up failed)"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT id FROM purchase_orders WHERE po_number = ?", (po_number,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM po_line_items WHERE po_id = ?", (row[0],))
+                conn.execute("DELETE FROM purchase_orders WHERE id = ?", (row[0],))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row is not None
+
+    # Reads ---------------------------------------------------------------
+
+    def get(self, po_number: str) -> Optional[dict]:
+        """PO with its line items (one query: unique index + line item primary key)"""
+        rows = self._conn().execute("""
+            SELECT p.po_number, p.vendor_name, p.department, p.created_date, p.total_cents, p.status,
+                   p.requisition_number, p.reservation_id, l.description, l.quantity, l.unit_price_cents
+            FROM purchase_orders p LEFT JOIN po_line_items l ON l.po_id = p.id
+            WHERE p.po_number = ? ORDER BY l.line_no""", (po_number,)).fetchall()
+        if not rows:
+            return None
+        po = self._header(rows[0])
+        po["line_items"] = [{"description": r[8], "quantity": _quantity(r[9]),
+                             "unit_price": r[10] / 100 if r[10] is not None else None}
+                            for r in rows if r[8] is not None or r[9] is not None]
+        return po
+
+    @staticmethod
+    def _header(row) -> dict:
+        return {"po_number": row[0], "vendor_name": row[1], "department": row[2], "created_date": row[3],
+                "total_amount": row[4] / 100, "status": row[5], "requisition_number": row[6],
+                "reservation_id": row[7]}
+
+    def search(self, vendor_name: Optional[str] = None, department: Optional[str] = None,
+               date_from: Optional[str] = None, date_to: Optional[str] = None, limit: int = 100) -> List[dict]:
+        """PO headers, newest first; vendor or department + date range use their composite index"""
+        where, args = [], []
+        if vendor_name:
+            where.append("vendor_name = ?")
+            args.append(vendor_name)
+        if department:
+            where.append("department = ?")
+            args.append(department)
+        if date_from:
+            where.append("created_date >= ?")
+            args.append(date_from)
+        if date_to:
+            where.append("created_date <= ?")
+            args.append(date_to)
+        sql = ("SELECT po_number, vendor_name, department, created_date, total_cents, status, requisition_number, "
+               "reservation_id FROM purchase_orders" + (" WHERE " + " AND ".join(where) if where else "")
+               + " ORDER BY created_date DESC, id DESC LIMIT ?")
+        return [self._header(r) for r in self._conn().execute(sql, (*args, limit))]
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM purchase_orders").fetchone()[0]
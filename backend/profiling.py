@@ -0,0 +1,186 @@
+"""
+On-Demand Sampling Profiler
+Samples a configurable percentage of requests with a statistical (stack
+sampling) profiler and writes collapsed stacks ("folded" format) that
+flamegraph.pl, speedscope or inferno can render directly.
+
+When sampling is off, the per-request cost is a clock read and a float comparison.
+Only the newest PROFILE_MAX_FILES profiles are kept. Changing the sampling rate
+at runtime (POST /admin/profiling) requires ADMIN_TOKEN to be set.
+
+require_admin() is the X-Admin-Token check every /admin route uses: reads are
+open while ADMIN_TOKEN is unset, changes are refused until it is set.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from fastapi import Body, Header, HTTPException
+
+from metrics import current_endpoint
+from state_store import DATA_DIR, StateStore
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+SETTINGS_REFRESH_SECONDS = 2.0
+
+
+class StackSampler:
+    """Background thread that snapshots every thread's Python stack at a fixed interval"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(tid, f"thread-{tid}"))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+class ProfilingSettings:
+    """Current sampling settings, optionally shared between workers through the state store"""
+
+    def __init__(self, service: str, state: Optional[StateStore] = None):
+        self.key = f"profiling:{service}"
+        self.state = state
+        self.sample_percent = float(os.getenv("PROFILE_SAMPLE_PERCENT", "0"))
+        self.interval_ms = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+        self.output_dir = PROFILE_DIR
+        self._next_refresh = 0.0
+
+    def as_dict(self) -> dict:
+        return {"sample_percent": self.sample_percent, "interval_ms": self.interval_ms, "output_dir": self.output_dir}
+
+    def update(self, sample_percent: float, interval_ms: float):
+        self.sample_percent = max(0.0, min(100.0, sample_percent))
+        self.interval_ms = max(1.0, interval_ms)
+        if self.state is not None:
+            self.state.set("admin", self.key, {"sample_percent": self.sample_percent, "interval_ms": self.interval_ms})
+
+    def refresh(self):
+        # Picks up toggles made through another worker; at most every couple of seconds
+        now = time.monotonic()
+        if self.state is None or now < self._next_refresh:
+            return
+        self._next_refresh = now + SETTINGS_REFRESH_SECONDS
+        stored = self.state.get("admin", self.key)
+        if stored:
+            self.sample_percent = stored["sample_percent"]
+            self.interval_ms = stored["interval_ms"]
+
+    def should_sample(self) -> bool:
+        self.refresh()
+        return self.sample_percent > 0 and random.random() * 100 < self.sample_percent
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, settings: ProfilingSettings, service: str):
+        self.app = app
+        self.settings = settings
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.settings.should_sample():
+            return await self.app(scope, receive, send)
+
+        sampler = StackSampler(self.settings.interval_ms / 1000).start()
+        started = time.time()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            counts = sampler.stop()
+            write_folded(self.settings.output_dir, self.service, current_endpoint(scope), started, counts)
+
+
+def write_folded(output_dir: str, service: str, endpoint: str, started: float, counts: Counter) -> Optional[str]:
+    if not counts:
+        return None
+    os.makedirs(output_dir, exist_ok=True)
+    slug = endpoint.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+    path = os.path.join(output_dir, f"{service}-{slug}-{stamp}-{int(started * 1000) % 1000:03d}-{os.getpid()}.folded")
+    with open(path, "w") as f:
+        for stack, count in counts.most_common():
+            f.write(f"{stack} {count}\n")
+    prune_profiles(output_dir)
+    return path
+
+
+def require_admin(token: Optional[str], mutate: bool = False):
+    """403 unless token matches ADMIN_TOKEN; without ADMIN_TOKEN only reads (mutate=False) pass"""
+    if not ADMIN_TOKEN:
+        if mutate:
+            raise HTTPException(status_code=403, detail="Set ADMIN_TOKEN to use admin endpoints that change state")
+        return
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def prune_profiles(output_dir: str, keep: int = PROFILE_MAX_FILES):
+    """Delete the oldest .folded files beyond keep"""
+    try:
+        entries = [e for e in os.scandir(output_dir) if e.name.endswith(".folded")]
+        if len(entries) <= keep:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - keep]:
+            os.remove(entry.path)
+    except OSError:
+        pass  # another worker pruned the same file first
+
+
+def install_profiling(app, service: str, state: Optional[StateStore] = None) -> ProfilingSettings:
+    """Add the sampling middleware and the /admin/profiling toggle"""
+    settings = ProfilingSettings(service, state)
+    app.add_middleware(ProfilingMiddleware, settings=settings, service=service)
+
+    @app.get("/admin/profiling", include_in_schema=False)
+    async def get_profiling(x_admin_token: Optional[str] = Header(None)):
+        require_admin(x_admin_token)
+        settings.refresh()
+        files = sorted(os.listdir(settings.output_dir)) if os.path.isdir(settings.output_dir) else []
+        return {**settings.as_dict(), "profiles": files[-50:]}
+
+    @app.post("/admin/profiling", include_in_schema=False)
+    async def set_profiling(
+        sample_percent: float = Body(..., embed=True),
+        interval_ms: float = Body(5.0, embed=True),
+        x_admin_token: Optional[str] = Header(None)
+    ):
+        """Set the percentage of requests to profile (0 disables profiling); needs ADMIN_TOKEN"""
+        require_admin(x_admin_token, mutate=True)
+        settings.update(sample_percent, interval_ms)
+        print(f"🔬 Profiling: sampling {settings.sample_percent}% of requests every {settings.interval_ms}ms")
+        return settings.as_dict()
+
+    return settings
@@ -0,0 +1,60 @@
+"""
+Single-Flight Request Coalescing
+Concurrent requests that need the same work (same image, same effective
+parameters) share one execution instead of each downloading the image and
+calling Gemini.
+
+    flight = SingleFlight("box_inspection")
+    result, shared = await flight.do(key, lambda: asyncio.to_thread(work))
+
+The first caller (leader) starts the work as its own task; callers arriving
+with the same key while it runs (followers) await that task. The task is
+shielded, so a leader whose client disconnects doesn't cancel the work for
+everyone else. Results are shared objects: callers copy before changing them.
+Only in-flight work is shared, nothing is cached, and coalescing is per worker
+process.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+import metrics
+from metrics import REGISTRY, record_stage
+
+COALESCED_CALLS = REGISTRY.counter(
+    "visionflow_coalesced_calls_total",
+    "Calls through single-flight groups by role (follower = a duplicate call saved)",
+    ("service", "flight", "role"))
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run fn() once per key at a time; returns (result, shared with an earlier caller)"""
+        task = self._flights.get(key)
+        if task is None:
+            COALESCED_CALLS.inc(metrics.SERVICE, self.name, "leader")
+            task = asyncio.ensure_future(fn())
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+            return await asyncio.shield(task), False
+
+        COALESCED_CALLS.inc(metrics.SERVICE, self.name, "follower")
+        start = time.perf_counter()
+        try:
+            return await asyncio.shield(task), True
+        finally:
+            record_stage("coalesced_wait", time.perf_counter() - start)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an abandoned failure isn't logged as unhandled
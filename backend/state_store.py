@@ -0,0 +1,179 @@
+"""
+Shared State Backends
+Keeps cross-request state (shipment history, station sequencing, handles)
+out of module globals so the API can run with several uvicorn workers.
+
+Backends:
+- memory: plain dicts, single worker only
+- sqlite: SQLite file under DATA_DIR (durable, shared between workers)
+- shm:    SQLite file on /dev/shm (shared memory, fast, lost on reboot)
+
+A networked store (Redis, Postgres...) only has to subclass StateStore.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+SHM_DIR = "/dev/shm"
+
+
+class StateStore:
+    """Interface every shared-state backend implements"""
+
+    name = "base"
+    shared = False  # True when other worker processes see the same state
+
+    # Event log (append-only, per key) ---------------------------------------
+    def append_event(self, key: str, event: dict) -> None:
+        raise NotImplementedError
+
+    def get_events(self, key: str, limit: Optional[int] = None) -> List[dict]:
+        raise NotImplementedError
+
+    # Namespaced key/value with optional TTL ---------------------------------
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+
+class InMemoryStateStore(StateStore):
+    """Process-local state. Only correct with a single worker."""
+
+    name = "memory"
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: Dict[str, List[dict]] = {}
+        self._kv: Dict[tuple, tuple] = {}  # (namespace, key) -> (value, expires_at)
+
+    def append_event(self, key, event):
+        with self._lock:
+            self._events.setdefault(key, []).append(event)
+
+    def get_events(self, key, limit=None):
+        with self._lock:
+            events = list(self._events.get(key, []))
+        return events[-limit:] if limit else events
+
+    def get(self, namespace, key):
+        entry = self._kv.get((namespace, key))
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            self.delete(namespace, key)
+            return None
+        return value
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._kv[(namespace, key)] = (value, expires_at)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._kv.pop((namespace, key), None)
+
+
+class SQLiteStateStore(StateStore):
+    """SQLite-backed state shared by every worker that opens the same file"""
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_events_key ON events(key, id);
+            CREATE TABLE IF NOT EXISTS kv (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            );
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; autocommit so each statement is atomic
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append_event(self, key, event):
+        self._conn().execute("INSERT INTO events (key, payload) VALUES (?, ?)", (key, json.dumps(event)))
+
+    def get_events(self, key, limit=None):
+        if limit:
+            rows = self._conn().execute(
+                "SELECT payload FROM (SELECT id, payload FROM events WHERE key = ? ORDER BY id DESC LIMIT ?) ORDER BY id",
+                (key, limit),
+            ).fetchall()
+        else:
+            rows = self._conn().execute("SELECT payload FROM events WHERE key = ? ORDER BY id", (key,)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def get(self, namespace, key):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            self.delete(namespace, key)
+            return None
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), expires_at),
+        )
+
+    def delete(self, namespace, key):
+        self._conn().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+
+def create_state_store(workers: int = 1, backend: Optional[str] = None, path: Optional[str] = None) -> StateStore:
+    """Build the configured store (STATE_BACKEND / STATE_DB_PATH env vars)"""
+    backend = (backend or os.getenv("STATE_BACKEND", "memory")).lower()
+    path = path or os.getenv("STATE_DB_PATH")
+
+    if backend == "memory" and workers > 1:
+        # Process-local dicts would silently diverge between workers
+        backend = "shm" if os.path.isdir(SHM_DIR) else "sqlite"
+        print(f"⚠️ STATE_BACKEND=memory is not safe with {workers} workers, using '{backend}' instead")
+
+    if backend == "memory":
+        return InMemoryStateStore()
+    if backend == "shm":
+        store = SQLiteStateStore(path or os.path.join(SHM_DIR, "visionflow_state.db"))
+        store.name = "shm"
+        return store
+    if backend == "sqlite":
+        return SQLiteStateStore(path or os.path.join(DATA_DIR, "state.db"))
+    raise ValueError(f"Unknown STATE_BACKEND: {backend}")
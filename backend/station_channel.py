@@ -0,0 +1,175 @@
+"""
+VAS Station Channel
+Framing and session bookkeeping for the persistent /ws/vas/{station_id}
+WebSocket.
+
+Station -> server, binary message:
+
+    [4-byte big-endian header length][UTF-8 JSON header][image bytes]
+
+    header = {"seq": 17, "order_id": "ORD-1", "expected_sku": "SKU-123",
+              "kitting_list": ["Phone", "Charger"], "aesthetic_check": false}
+
+Station -> server, text message (JSON): {"type": "ping"} (answered with a pong)
+
+Server -> station, text messages (JSON):
+
+    {"type": "hello", "station_id", "next_seq", "max_in_flight", "resumed": [...]}
+    {"type": "stop_line", "seq", "order_id", "action_required", "reasoning"}
+    {"type": "result", "seq", "replayed": false, "result": LabelMatchResult}
+    {"type": "error", "seq", "detail"}
+    {"type": "pong"}
+
+seq is chosen by the station and must increase: a seq that is not higher
+than every seq the station sent before gets an error, so a failed frame is
+retried under a new seq. Verdicts are stored in the state store per
+(station, seq), so after a reconnect (possibly to another worker) the station
+sends ?last_seq=N and gets every verdict after N it missed; re-sending an
+already-answered seq returns the stored verdict instead of calling the model
+again. A verdict always goes to the station's newest socket, so a frame
+still being verified when the station reconnects to the same worker is
+answered on the new connection.
+"""
+
+import asyncio
+import json
+import os
+import struct
+from typing import Dict, Optional, Tuple
+
+WS_MAX_IN_FLIGHT = int(os.getenv("VAS_WS_MAX_IN_FLIGHT", "2"))
+WS_RESULT_TTL = float(os.getenv("VAS_WS_RESULT_TTL", "3600"))
+WS_RESUME_WINDOW = int(os.getenv("VAS_WS_RESUME_WINDOW", "100"))
+
+NAMESPACE = "vas_ws"
+HEADER_LEN = struct.Struct(">I")
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class FrameError(ValueError):
+    """Malformed binary frame or control message"""
+
+
+def decode_frame(data: bytes) -> Tuple[dict, bytes]:
+    if len(data) < HEADER_LEN.size:
+        raise FrameError("Frame shorter than its length prefix")
+    (header_len,) = HEADER_LEN.unpack_from(data)
+    if header_len > MAX_HEADER_BYTES or HEADER_LEN.size + header_len > len(data):
+        raise FrameError(f"Bad header length {header_len}")
+    try:
+        header = json.loads(data[HEADER_LEN.size:HEADER_LEN.size + header_len])
+    except ValueError as e:
+        raise FrameError(f"Header is not JSON: {e}")
+    if not isinstance(header, dict) or not isinstance(header.get("seq"), int):
+        raise FrameError("Header must be an object with an integer 'seq'")
+    return header, data[HEADER_LEN.size + header_len:]
+
+
+def decode_control(text: str) -> dict:
+    """Text frame -> control message with a string "type" """
+    try:
+        message = json.loads(text)
+    except ValueError as e:
+        raise FrameError(f"Control message is not JSON: {e}")
+    if not isinstance(message, dict) or not isinstance(message.get("type"), str):
+        raise FrameError("Control message must be an object with a string 'type'")
+    return message
+
+
+def encode_frame(header: dict, payload: bytes) -> bytes:
+    """Client-side helper (tests, station SDKs)"""
+    raw = json.dumps(header).encode()
+    return HEADER_LEN.pack(len(raw)) + raw + payload
+
+
+class StationConnection:
+    """One socket of a station; sends on it are serialized"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message: dict):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(message))
+
+    async def close(self, code: int, reason: str):
+        await self.websocket.close(code=code, reason=reason)
+
+
+class StationSessions:
+    """
+    Per-station state for this worker (in-flight limit, active socket, seqs
+    being processed) plus the cross-worker seq/verdict log in the state store.
+    """
+
+    def __init__(self, state, max_in_flight: int = WS_MAX_IN_FLIGHT):
+        self.state = state
+        self.max_in_flight = max_in_flight
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self._sockets: Dict[str, object] = {}
+        self._in_flight: Dict[str, set] = {}
+        self._highest: Dict[str, int] = {}
+
+    def slots(self, station_id: str) -> asyncio.Semaphore:
+        # Shared by every connection of the station, so a reconnect can't double its budget
+        if station_id not in self._slots:
+            self._slots[station_id] = asyncio.Semaphore(self.max_in_flight)
+        return self._slots[station_id]
+
+    def attach(self, station_id: str, connection) -> Optional[object]:
+        """Register the station's connection; returns the one it replaces, if any"""
+        previous = self._sockets.get(station_id)
+        self._sockets[station_id] = connection
+        return previous
+
+    def detach(self, station_id: str, connection):
+        if self._sockets.get(station_id) is connection:
+            del self._sockets[station_id]
+
+    def current(self, station_id: str) -> Optional[object]:
+        """The station's newest connection on this worker (None while it is away)"""
+        return self._sockets.get(station_id)
+
+    def begin(self, station_id: str, seq: int) -> bool:
+        """Mark seq as in progress; False if this worker is already on it"""
+        running = self._in_flight.setdefault(station_id, set())
+        if seq in running:
+            return False
+        running.add(seq)
+        return True
+
+    def end(self, station_id: str, seq: int):
+        self._in_flight.get(station_id, set()).discard(seq)
+
+    def advance(self, station_id: str, seq: int) -> bool:
+        """Record seq as the station's newest; False if it isn't higher than every seq seen"""
+        highest = max(self._highest.get(station_id, 0), self.last_seq(station_id))
+        if seq <= highest:
+            return False
+        self._highest[station_id] = seq
+        return True
+
+    # Cross-worker log ---------------------------------------------------------
+
+    def last_seq(self, station_id: str) -> int:
+        return self.state.get(NAMESPACE, f"{station_id}:last_seq") or 0
+
+    def stored(self, station_id: str, seq: int) -> Optional[dict]:
+        return self.state.get(NAMESPACE, f"{station_id}:{seq}")
+
+    def store(self, station_id: str, seq: int, message: dict):
+        self.state.set(NAMESPACE, f"{station_id}:{seq}", message, ttl=WS_RESULT_TTL)
+        if seq > self.last_seq(station_id):
+            self.state.set(NAMESPACE, f"{station_id}:last_seq", seq, ttl=WS_RESULT_TTL)
+
+    def missed(self, station_id: str, after_seq: int) -> list:
+        """Stored verdicts with seq > after_seq (bounded by WS_RESUME_WINDOW)"""
+        last = self.last_seq(station_id)
+        start = max(after_seq + 1, last - WS_RESUME_WINDOW + 1)
+        found = []
+        for seq in range(start, last + 1):
+            message = self.stored(station_id, seq)
+            if message is not None:
+                found.append(message)
+        return found
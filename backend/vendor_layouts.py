@@ -0,0 +1,681 @@
+"""
+Vendor Layout Templates
+Repeat-vendor invoices have fixed layouts, so after one model extraction we
+can learn where each field is printed and read later invoices of the same
+layout locally, without calling Gemini.
+
+    VENDOR_LAYOUTS=off        always use the model (default)
+    VENDOR_LAYOUTS=on         try a learned template first
+    LAYOUT_OCR=auto           words from the PDF text layer, or Tesseract for
+                              images when pytesseract is installed
+    LAYOUT_DOC_TYPES=invoice  document types that use templates
+
+A template is learned from a single-page document once the model's answer
+has been located in the page's words:
+
+- fingerprint: coarse ink grid of the page header (top 20%), compared by
+  cosine similarity; the labels of the learned fields must also be present
+- header fields: the label printed left of the value ("Invoice #", "Total")
+  plus its position; values are read right of the label, so totals pushed
+  down by longer item tables are still found. Fields without a label are
+  read from their learned box.
+- line items: the table header row and the column order of the numeric
+  columns; rows are read until the first line that isn't an item row.
+
+A template answer must pass validation (every learned field present,
+quantity x unit price = line total, items add up to the subtotal, subtotal +
+tax = total), otherwise the document goes to the model and the template is
+relearned from its answer. Multi-page documents always go to the model.
+
+Templates are kept in LAYOUT_STORE (JSON, reloaded when another worker
+changes it), capped at LAYOUT_MAX_TEMPLATES least-recently-used. Workers
+read-modify-write the file under an exclusive lock (LAYOUT_STORE.lock); hits
+are counted in memory and written with the next template change, so a hit
+never rewrites the file.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+import metrics
+from metrics import REGISTRY, stage
+from state_store import DATA_DIR
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # optional: no PDF text layer without it
+    fitz = None
+
+try:
+    import pytesseract
+except ImportError:  # optional: images need Tesseract for local OCR
+    pytesseract = None
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: the store is then only safe with one worker
+    fcntl = None
+
+VENDOR_LAYOUTS = os.getenv("VENDOR_LAYOUTS", "off").lower()
+LAYOUT_OCR = os.getenv("LAYOUT_OCR", "auto").lower()
+LAYOUT_DOC_TYPES = {t.strip() for t in os.getenv("LAYOUT_DOC_TYPES", "invoice").split(",") if t.strip()}
+LAYOUT_STORE = os.getenv("LAYOUT_STORE", os.path.join(DATA_DIR, "vendor_layouts.json"))
+LAYOUT_MATCH_THRESHOLD = float(os.getenv("LAYOUT_MATCH_THRESHOLD", "0.92"))
+LAYOUT_MAX_TEMPLATES = int(os.getenv("LAYOUT_MAX_TEMPLATES", "1000"))
+# Share of the learned field labels that must appear on a page for its template to apply
+LAYOUT_MIN_ANCHORS = float(os.getenv("LAYOUT_MIN_ANCHORS", "0.8"))
+
+FINGERPRINT_SIZE = (24, 10)
+HEADER_SHARE = 0.2
+ITEMS_FIELD = "line_items"
+TOTAL_FIELDS = ("total_amount", "subtotal", "tax_amount")
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%d.%m.%Y", "%m-%d-%Y", "%Y/%m/%d",
+                "%b %d, %Y", "%B %d, %Y", "%d %b %Y", "%d %B %Y")
+# Horizontal gaps (share of page width): between words of one label or text value,
+# and between a label and its value
+WORD_GAP = 0.06
+LABEL_GAP = 0.3
+
+LAYOUT_LOOKUPS = REGISTRY.counter(
+    "visionflow_layout_lookups_total",
+    "Vendor layout template lookups (hit, no_template, invalid, no_text, multi_page)", ("service", "outcome"))
+LAYOUT_LEARNED = REGISTRY.counter(
+    "visionflow_layout_templates_learned_total", "Templates learned from model answers (or why not)",
+    ("service", "outcome"))
+DOCUMENT_SECONDS = REGISTRY.histogram(
+    "visionflow_document_extraction_seconds", "Per-document extraction latency by path (template or model)",
+    ("service", "path"))
+
+
+def enabled_for(document_type: str) -> bool:
+    return VENDOR_LAYOUTS == "on" and document_type in LAYOUT_DOC_TYPES
+
+
+def observe_document(path: str, seconds: float):
+    DOCUMENT_SECONDS.observe(seconds, metrics.SERVICE, path)
+
+
+# ----------------------------------------------------------------------------
+# Page reading: words (normalized boxes) + fingerprint
+# ----------------------------------------------------------------------------
+
+@dataclass
+class Word:
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    text: str
+
+    @property
+    def yc(self) -> float:
+        return (self.y0 + self.y1) / 2
+
+
+@dataclass
+class LayoutPage:
+    words: List[Word]
+    fingerprint: List[float]
+
+    def lines(self) -> List[List[Word]]:
+        return group_lines(self.words)
+
+
+def fingerprint(image: Image.Image) -> List[float]:
+    """Mean-centred, L2-normalized ink grid of the page header"""
+    gray = image.convert("L")
+    header = gray.crop((0, 0, gray.width, max(1, int(gray.height * HEADER_SHARE))))
+    ink = [255 - v for v in header.resize(FINGERPRINT_SIZE, Image.Resampling.BOX).getdata()]
+    mean = sum(ink) / len(ink)
+    centred = [v - mean for v in ink]
+    norm = math.sqrt(sum(v * v for v in centred)) or 1.0
+    return [round(v / norm, 4) for v in centred]
+
+
+def _similarity(a: List[float], b: List[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+def _pdf_page(content: bytes) -> Tuple[Optional[LayoutPage], str]:
+    if fitz is None:
+        return None, "no_text"
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        if doc.page_count != 1:
+            return None, "multi_page"
+        page = doc[0]
+        w, h = page.rect.width, page.rect.height
+        words = [Word(x0 / w, y0 / h, x1 / w, y1 / h, text) for x0, y0, x1, y1, text, *_ in page.get_text("words")]
+        pix = page.get_pixmap(dpi=50, colorspace=fitz.csGRAY, alpha=False)
+        image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    if len(words) < 5:
+        return None, "no_text"  # scanned PDF without a text layer
+    return LayoutPage(words, fingerprint(image)), "ok"
+
+
+def _tesseract_words(image: Image.Image) -> List[Word]:
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    w, h = image.size
+    words = []
+    for i, text in enumerate(data["text"]):
+        if text.strip() and float(data["conf"][i]) >= 30:
+            x, y, bw, bh = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
+            words.append(Word(x / w, y / h, (x + bw) / w, (y + bh) / h, text))
+    return words
+
+
+def read_page(content: bytes) -> Tuple[Optional[LayoutPage], str]:
+    """Words + fingerprint of a single-page document; (None, reason) when there is no local text"""
+    if content[:1024].lstrip().startswith(b"%PDF-"):
+        if LAYOUT_OCR in ("auto", "pdf"):
+            return _pdf_page(content)
+        return None, "no_text"
+    if pytesseract is None or LAYOUT_OCR not in ("auto", "tesseract"):
+        return None, "no_text"
+    image = Image.open(BytesIO(content))
+    image.draft("L", (2000, 2000))  # JPEG: decode at reduced scale, plenty for OCR
+    image = image.convert("L")
+    try:
+        words = _tesseract_words(image)
+    except Exception as e:  # pytesseract installed but the tesseract binary isn't
+        print(f"⚠️  Local OCR unavailable ({e})")
+        return None, "no_text"
+    if len(words) < 5:
+        return None, "no_text"
+    return LayoutPage(words, fingerprint(image)), "ok"
+
+
+def group_lines(words: List[Word]) -> List[List[Word]]:
+    """Words grouped into text lines (top to bottom, each left to right)"""
+    if not words:
+        return []
+    heights = sorted(w.y1 - w.y0 for w in words)
+    tolerance = heights[len(heights) // 2] * 0.6
+    lines: List[List[Word]] = []
+    for word in sorted(words, key=lambda w: (w.yc, w.x0)):
+        if lines and abs(word.yc - sum(w.yc for w in lines[-1]) / len(lines[-1])) <= tolerance:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda w: w.x0) for line in lines]
+
+
+# ----------------------------------------------------------------------------
+# Value parsing
+# ----------------------------------------------------------------------------
+
+def parse_number(text: str) -> Optional[float]:
+    t = text.strip().rstrip(":").replace(",", "")
+    negative = t.startswith("(") and t.endswith(")") or t.startswith("-")
+    t = t.strip("()-").lstrip("$€£").rstrip("$€£")
+    if not re.fullmatch(r"\d+(\.\d+)?|\.\d+", t):
+        return None
+    value = float(t)
+    return -value if negative else value
+
+
+def parse_date(text: str, fmt: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """(ISO date, format that matched)"""
+    text = text.strip().rstrip(":")
+    for f in ((fmt,) if fmt else DATE_FORMATS):
+        try:
+            return datetime.strptime(text, f).date().isoformat(), f
+        except ValueError:
+            continue
+    return None
+
+
+def _canon(text: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(text).lower())
+
+
+def _kind(value) -> Optional[str]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str) and value.strip():
+        return "date" if re.fullmatch(r"\d{4}-\d{2}-\d{2}", value.strip()) else "text"
+    return None
+
+
+def _join(words: List[Word]) -> str:
+    return " ".join(w.text for w in words)
+
+
+def _matches(words: List[Word], value, kind: str) -> Optional[str]:
+    """Date format (or "" for other kinds) when these words print the value"""
+    text = _join(words)
+    if kind == "number":
+        number = parse_number(text)
+        return "" if number is not None and abs(number - float(value)) < 0.005 else None
+    if kind == "date":
+        parsed = parse_date(text)
+        return parsed[1] if parsed and parsed[0] == value.strip() else None
+    return "" if _canon(text) and _canon(text) == _canon(value) else None
+
+
+def _label_before(line: List[Word], start: int) -> List[Word]:
+    """Up to 3 non-numeric words left of line[start] (values are often column-aligned away from their label)"""
+    label: List[Word] = []
+    i = start - 1
+    while i >= 0 and len(label) < 3:
+        word = line[i]
+        right = label[0].x0 if label else line[start].x0
+        if right - word.x1 > (WORD_GAP if label else LABEL_GAP) or parse_number(word.text) is not None:
+            break
+        label.insert(0, word)
+        i -= 1
+    return label
+
+
+# ----------------------------------------------------------------------------
+# Learning
+# ----------------------------------------------------------------------------
+
+def _locate(lines: List[List[Word]], value, kind: str, prefer_last: bool) -> Optional[dict]:
+    found = []
+    for li, line in enumerate(lines):
+        for i in range(len(line)):
+            for n in range(1, min(8, len(line) - i) + 1):
+                fmt = _matches(line[i:i + n], value, kind)
+                if fmt is not None:
+                    label = _label_before(line, i)
+                    found.append({"line": li, "start": i, "n": n, "format": fmt, "label": label})
+                    break
+    if not found:
+        return None
+    labelled = [f for f in found if f["label"]] or found
+    return labelled[-1] if prefer_last else labelled[0]
+
+
+def _learn_items(lines: List[List[Word]], items: list) -> Optional[dict]:
+    if not items or not all(isinstance(i, dict) for i in items):
+        return None
+    numeric = [k for k, v in items[0].items() if _kind(v) == "number"]
+    texts = [k for k, v in items[0].items() if _kind(v) == "text"]
+    if not numeric:
+        return None
+    rows, order = [], None
+    for item in items:
+        for li, line in enumerate(lines):
+            if li in rows:
+                continue
+            positions = {}
+            for key in numeric:
+                hits = [w.x0 for w in line if _matches([w], item.get(key, ""), "number") is not None]
+                if not hits:
+                    break
+                positions[key] = hits[-1]
+            else:
+                # Column order left to right; every row must agree
+                row_order = sorted(positions, key=positions.get)
+                if order is None or order == row_order:
+                    order = row_order
+                    rows.append(li)
+                    break
+        else:
+            return None
+    if rows != sorted(rows) or rows[-1] - rows[0] != len(rows) - 1:
+        return None  # not one contiguous table
+    first = rows[0]
+    header = lines[first - 1] if first > 0 else []
+    return {"numeric": order, "text": texts[0] if texts else None,
+            "header": _canon(_join(header)) if header else None,
+            "y": lines[first][0].y0}
+
+
+def learn(page: LayoutPage, document_type: str, extracted: dict) -> Optional[dict]:
+    """Template from a model answer and the page it came from (None if it can't be located)"""
+    lines = page.lines()
+    fields, anchors = {}, []
+    for name, value in extracted.items():
+        kind = _kind(value)
+        if kind is None:
+            continue
+        spot = _locate(lines, value, kind, prefer_last=name in TOTAL_FIELDS)
+        if spot is None:
+            continue
+        words = lines[spot["line"]][spot["start"]:spot["start"] + spot["n"]]
+        label = _canon(_join(spot["label"])) if spot["label"] else None
+        fields[name] = {"kind": kind, "format": spot["format"] or None, "label": label, "n": spot["n"],
+                        "box": [round(min(w.x0 for w in words), 4), round(min(w.y0 for w in words), 4),
+                                round(max(w.x1 for w in words), 4), round(max(w.y1 for w in words), 4)]}
+        if label:
+            anchors.append(label)
+
+    scalar = [k for k, v in extracted.items() if _kind(v)]
+    items = None
+    if isinstance(extracted.get(ITEMS_FIELD), list) and extracted[ITEMS_FIELD]:
+        items = _learn_items(lines, extracted[ITEMS_FIELD])
+        if items is None:
+            LAYOUT_LEARNED.inc(metrics.SERVICE, "items_not_found")
+            return None
+    # Every scalar the model returned must be locatable, or template answers would silently drop fields
+    if not fields or len(fields) < len(scalar) or not anchors:
+        LAYOUT_LEARNED.inc(metrics.SERVICE, "fields_not_found")
+        return None
+    LAYOUT_LEARNED.inc(metrics.SERVICE, "learned")
+    return {"id": f"tpl-{uuid.uuid4().hex[:10]}", "document_type": document_type,
+            "vendor": extracted.get("vendor_name"), "fingerprint": page.fingerprint, "anchors": anchors,
+            "fields": fields, "order": list(extracted), "items": items,
+            "created": time.time(), "last_used": time.time(), "hits": 0}
+
+
+# ----------------------------------------------------------------------------
+# Template extraction + validation
+# ----------------------------------------------------------------------------
+
+def _find_label(lines: List[List[Word]], label: str, near_y: float) -> Optional[Tuple[int, int]]:
+    """(line, index after the label) of the occurrence closest to near_y"""
+    best = None
+    for li, line in enumerate(lines):
+        canon = [_canon(w.text) for w in line]
+        for i in range(len(line)):
+            text = ""
+            for j in range(i, min(i + 4, len(line))):
+                text += canon[j]
+                if text == label:
+                    end = j + 1
+                    while end < len(line) and not canon[end]:
+                        end += 1  # trailing punctuation of the label ("Invoice #", "Total :")
+                    distance = abs(line[i].y0 - near_y)
+                    if best is None or distance < best[0]:
+                        best = (distance, li, end)
+                    break
+                if not label.startswith(text):
+                    break
+    return (best[1], best[2]) if best else None
+
+
+def _read_value(words: List[Word], spec: dict):
+    if spec["kind"] == "number":
+        for word in words[:3]:
+            number = parse_number(word.text)
+            if number is not None:
+                return number
+        return None
+    if spec["kind"] == "date":
+        for n in range(1, min(4, len(words)) + 1):
+            parsed = parse_date(_join(words[:n]), spec.get("format"))
+            if parsed:
+                return parsed[0]
+        return None
+    taken: List[Word] = []
+    for word in words:
+        if taken and word.x0 - taken[-1].x1 > WORD_GAP:
+            break
+        taken.append(word)
+    return _join(taken) or None
+
+
+def _read_field(lines: List[List[Word]], words: List[Word], spec: dict):
+    if spec["label"]:
+        spot = _find_label(lines, spec["label"], spec["box"][1])
+        if spot is None:
+            return None
+        return _read_value(lines[spot[0]][spot[1]:], spec)
+    x0, y0, x1, y1 = spec["box"]
+    pad = (y1 - y0) * 0.6
+    inside = [w for w in words if x0 - 0.01 <= w.x0 and w.x1 <= x1 + 0.15 and y0 - pad <= w.yc <= y1 + pad]
+    return _read_value(sorted(inside, key=lambda w: (round(w.yc, 2), w.x0)), spec)
+
+
+def _read_items(lines: List[List[Word]], spec: dict, stop_labels: List[str]) -> list:
+    start = None
+    if spec["header"]:
+        for li, line in enumerate(lines):
+            if _canon(_join(line)) == spec["header"]:
+                start = li + 1
+                break
+    if start is None:
+        start = next((li for li, line in enumerate(lines) if line[0].y0 >= spec["y"] - 0.005), len(lines))
+    items = []
+    width = len(spec["numeric"])
+    for line in lines[start:]:
+        if any(_canon(_join(line)).startswith(label) for label in stop_labels):
+            break
+        numbers = [parse_number(w.text) for w in line[-width:]]
+        if len(line) < width or any(n is None for n in numbers):
+            break
+        item = {}
+        if spec["text"]:
+            item[spec["text"]] = _join(line[:-width])
+        item.update(zip(spec["numeric"], numbers))
+        items.append(item)
+    return items
+
+
+def _close(a: float, b: float) -> bool:
+    return abs(a - b) <= 0.01 + 0.001 * abs(b)
+
+
+def validate(template: dict, extracted: dict) -> Optional[str]:
+    """Why a template answer can't be trusted (None = valid)"""
+    for name in template["fields"]:
+        if extracted.get(name) in (None, ""):
+            return f"{name} not found"
+    total, subtotal, tax = (extracted.get(k) for k in TOTAL_FIELDS)
+    if subtotal is not None and tax is not None and total is not None and not _close(subtotal + tax, total):
+        return "subtotal + tax != total"
+    if template["items"]:
+        items = extracted.get(ITEMS_FIELD) or []
+        if not items:
+            return "no line items"
+        numeric = template["items"]["numeric"]
+        if {"quantity", "unit_price", "line_total"} <= set(numeric):
+            if any(not _close(i["quantity"] * i["unit_price"], i["line_total"]) for i in items):
+                return "quantity x unit_price != line_total"
+        amount_key = "line_total" if "line_total" in numeric else numeric[-1]
+        items_sum = sum(i[amount_key] for i in items)
+        expected = subtotal if subtotal is not None else (total - (tax or 0) if total is not None else None)
+        if expected is not None and not _close(items_sum, expected):
+            return "line items don't add up"
+    return None
+
+
+def apply(template: dict, page: LayoutPage) -> Tuple[dict, Optional[str]]:
+    lines = page.lines()
+    values = {name: _read_field(lines, page.words, spec) for name, spec in template["fields"].items()}
+    extracted = {}
+    for name in template["order"]:
+        if name in values:
+            extracted[name] = values[name]
+        elif name == ITEMS_FIELD and template["items"]:
+            stop = [spec["label"] for spec in template["fields"].values() if spec["label"]]
+            extracted[name] = _read_items(lines, template["items"], stop)
+    return extracted, validate(template, extracted)
+
+
+# ----------------------------------------------------------------------------
+# Template store
+# ----------------------------------------------------------------------------
+
+class LayoutStore:
+    def __init__(self, path: str = LAYOUT_STORE, max_templates: int = LAYOUT_MAX_TEMPLATES):
+        self.path = path
+        self.max_templates = max_templates
+        self.templates: Dict[str, dict] = {}
+        # Hits since this worker last wrote the file: {id: (count, last used)}
+        self.pending_hits: Dict[str, Tuple[int, float]] = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self, locked: bool = False):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        # Inode too: every save replaces the file, and mtimes can repeat within a tick
+        if (st.st_ino, st.st_mtime_ns, st.st_size) != self._version:
+            with self._file_lock(exclusive=False) if not locked else nullcontext():
+                with open(self.path) as f:
+                    self.templates = {t["id"]: t for t in json.load(f)}
+                st = os.stat(self.path)
+            self._version = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _save(self):
+        # Caller holds the exclusive file lock and has just refreshed
+        for template_id, (count, last_used) in self.pending_hits.items():
+            stored = self.templates.get(template_id)
+            if stored is not None:
+                stored["hits"] = stored.get("hits", 0) + count
+                stored["last_used"] = max(stored.get("last_used", 0), last_used)
+        self.pending_hits.clear()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(list(self.templates.values()), f)
+        os.replace(tmp, self.path)
+        st = os.stat(self.path)
+        self._version = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def match(self, page: LayoutPage, document_type: str) -> Optional[dict]:
+        with self._lock:
+            self._refresh()
+            candidates = [t for t in self.templates.values() if t["document_type"] == document_type]
+        if not candidates:
+            return None
+        present = {_canon(_join(line[i:j])) for line in page.lines()
+                   for i in range(len(line)) for j in range(i + 1, min(i + 4, len(line)) + 1)}
+        best, best_score = None, LAYOUT_MATCH_THRESHOLD
+        for template in candidates:
+            score = _similarity(page.fingerprint, template["fingerprint"])
+            if score < best_score:
+                continue
+            anchors = template["anchors"]
+            if sum(a in present for a in anchors) < LAYOUT_MIN_ANCHORS * len(anchors):
+                continue
+            best, best_score = template, score
+        return best
+
+    def add(self, template: dict, replaces: Optional[str] = None):
+        with self._lock, self._file_lock(exclusive=True):
+            self._refresh(locked=True)
+            self.templates.pop(replaces, None)
+            self.templates[template["id"]] = template
+            while len(self.templates) > self.max_templates:
+                del self.templates[min(self.templates.values(), key=lambda t: self._last_used(t))["id"]]
+            self._save()
+
+    def used(self, template: dict):
+        with self._lock:
+            count, _ = self.pending_hits.get(template["id"], (0, 0.0))
+            self.pending_hits[template["id"]] = (count + 1, time.time())
+
+    def remove(self, template_id: str) -> bool:
+        with self._lock, self._file_lock(exclusive=True):
+            self._refresh(locked=True)
+            self.pending_hits.pop(template_id, None)
+            if self.templates.pop(template_id, None) is None:
+                return False
+            self._save()
+            return True
+
+    def _last_used(self, template: dict) -> float:
+        return max(template.get("last_used", 0), self.pending_hits.get(template["id"], (0, 0.0))[1])
+
+    def hits(self, template: dict) -> int:
+        """Hits recorded in the file plus this worker's not yet written"""
+        return template.get("hits", 0) + self.pending_hits.get(template["id"], (0, 0.0))[0]
+
+
+STORE = LayoutStore()
+
+
+def try_template(content: bytes, document_type: str) -> Tuple[Optional[LayoutPage], Optional[dict], Optional[dict]]:
+    """
+    (page, template, extracted): extracted is the template answer when one
+    applied and validated; page (if readable) and the matched template are
+    returned so the model answer can (re)learn the layout.
+    """
+    with stage("layout_match"):
+        try:
+            page, reason = read_page(content)
+        except Exception as e:
+            print(f"  ⚠️ Local text extraction failed ({e})")
+            page, reason = None, "no_text"
+        if page is None:
+            LAYOUT_LOOKUPS.inc(metrics.SERVICE, reason)
+            return None, None, None
+        template = STORE.match(page, document_type)
+        if template is None:
+            LAYOUT_LOOKUPS.inc(metrics.SERVICE, "no_template")
+            return page, None, None
+        extracted, problem = apply(template, page)
+    if problem:
+        print(f"  📐 Layout {template['id']} ({template.get('vendor')}) rejected: {problem}, using the model")
+        LAYOUT_LOOKUPS.inc(metrics.SERVICE, "invalid")
+        return page, template, None
+    print(f"  📐 Extracted locally with layout {template['id']} ({template.get('vendor')})")
+    LAYOUT_LOOKUPS.inc(metrics.SERVICE, "hit")
+    STORE.used(template)
+    return page, template, extracted
+
+
+def learn_from_model(page: LayoutPage, document_type: str, extracted: dict, replaces: Optional[dict] = None):
+    template = learn(page, document_type, extracted)
+    if template is not None:
+        STORE.add(template, replaces=replaces["id"] if replaces else None)
+        print(f"  📐 Learned layout {template['id']} for {template.get('vendor')}")
+
+
+def stats() -> dict:
+    with STORE._lock:
+        STORE._refresh()
+        templates = list(STORE.templates.values())
+    lookups = {o: int(LAYOUT_LOOKUPS.get(metrics.SERVICE, o))
+               for o in ("hit", "no_template", "invalid", "no_text", "multi_page")}
+    total = sum(lookups.values())
+    return {
+        "mode": VENDOR_LAYOUTS,
+        "templates": len(templates),
+        "lookups": lookups,
+        "hit_rate": round(lookups["hit"] / total, 3) if total else None,
+        "by_template": sorted(({"id": t["id"], "vendor": t.get("vendor"), "document_type": t["document_type"],
+                                "hits": STORE.hits(t), "fields": sorted(t["fields"])} for t in templates),
+                              key=lambda t: -t["hits"]),
+    }
+
+
+def install_vendor_layouts(app):
+    """GET /admin/vendor_layouts (hit rate, templates) and DELETE /admin/vendor_layouts/{id}"""
+    from fastapi import Header, HTTPException
+    from profiling import require_admin
+
+    @app.get("/admin/vendor_layouts", include_in_schema=False)
+    async def vendor_layouts_stats(x_admin_token: Optional[str] = Header(None)):
+        require_admin(x_admin_token)
+        return stats()
+
+    @app.delete("/admin/vendor_layouts/{template_id}", include_in_schema=False)
+    async def delete_vendor_layout(template_id: str, x_admin_token: Optional[str] = Header(None)):
+        """Drop a learned template (the next document of its layout goes to the model); needs ADMIN_TOKEN"""
+        require_admin(x_admin_token, mutate=True)
+        if not STORE.remove(template_id):
+            raise HTTPException(status_code=404, detail=f"No layout template {template_id}")
+        return {"deleted": template_id}
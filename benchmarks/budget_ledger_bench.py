@@ -0,0 +1,145 @@
+"""
+Budget Ledger Benchmark
+Hammers backend/budget_ledger.py with concurrent reservations from several
+processes (like uvicorn workers) against one SQLite file, then checks that
+no budget was overspent and every cent is accounted for.
+
+    python benchmarks/budget_ledger_bench.py --processes 2 --clients 200 --ops 20000
+
+Each client loops reserve -> commit (70%) or release (30%). Half the
+accounts are deliberately too small for the load, so many reservations race
+for their last dollars; a correct ledger rejects exactly those that don't fit.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+import budget_ledger  # noqa: E402
+
+
+def accounts(count: int) -> dict:
+    # Even accounts are large, odd ones only cover a fraction of the demand
+    return {f"DEPT-{i:03d}": {"total": 1_000_000.0 if i % 2 == 0 else 2_000.0, "spent": 0.0} for i in range(count)}
+
+
+async def client(ledger, names, ops: int, seed: int, latencies: list, counts: dict):
+    rnd = random.Random(seed)
+    for _ in range(ops):
+        account = rnd.choice(names)
+        amount = round(rnd.uniform(1, 100), 2)
+        t = time.perf_counter()
+        reservation = await ledger.reserve(account, amount)
+        latencies.append(time.perf_counter() - t)
+        if not reservation["ok"]:
+            counts["rejected"] += 1
+            continue
+        counts["reserved"] += 1
+        if rnd.random() < 0.7:
+            await ledger.commit(reservation["reservation_id"])
+            counts["committed"] += 1
+        else:
+            await ledger.release(reservation["reservation_id"])
+            counts["released"] += 1
+
+
+def worker(path: str, names: list, clients: int, ops_per_client: int, seed: int, group_wait_ms: float, out):
+    ledger = budget_ledger.BudgetLedger(path, group_wait_ms=group_wait_ms)
+    latencies, counts = [], {"reserved": 0, "rejected": 0, "committed": 0, "released": 0}
+
+    async def main():
+        await asyncio.gather(*(client(ledger, names, ops_per_client, seed * 100_000 + c, latencies, counts)
+                               for c in range(clients)))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    out.put({"seconds": time.perf_counter() - start, "latencies": latencies, "counts": counts})
+
+
+def run(args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix="ledger-bench-"), "ledger.db")
+    budgets = accounts(args.accounts)
+    ledger = budget_ledger.BudgetLedger(path)
+    budget_ledger.seed(ledger, budgets)
+
+    per_process = args.clients // args.processes
+    ops_per_client = max(1, args.ops // args.clients)
+    print(f"💰 {args.processes} processes x {per_process} clients x {ops_per_client} reservations "
+          f"on {args.accounts} accounts")
+    out = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=worker, args=(path, list(budgets), per_process, ops_per_client, p,
+                                                          args.group_wait_ms, out))
+             for p in range(args.processes)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    wall = time.perf_counter() - start
+
+    latencies = sorted(lat for r in results for lat in r["latencies"])
+    counts = {k: sum(r["counts"][k] for r in results) for k in results[0]["counts"]}
+    operations = counts["reserved"] + counts["rejected"] + counts["committed"] + counts["released"]
+    pct = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+
+    # Consistency: invariants hold, nothing overspent, spent = sum of committed reservations
+    problems = ledger.check_consistency()
+    conn = ledger._connect()
+    for account, total, spent, encumbered in conn.execute("SELECT account, total, spent, encumbered FROM budgets"):
+        committed = conn.execute("SELECT COALESCE(SUM(committed_amount), 0) FROM reservations "
+                                 "WHERE account = ? AND status = 'committed'", (account,)).fetchone()[0]
+        if spent + encumbered > total:
+            problems.append(f"{account} overspent: {(spent + encumbered) / 100} > {total / 100}")
+        if spent != committed:
+            problems.append(f"{account}: spent {spent / 100} != committed reservations {committed / 100}")
+    small_left = [b["available"] for b in ledger.balances() if b["total"] == 2000.0]
+
+    report = {
+        "config": vars(args),
+        "wall_seconds": round(wall, 2),
+        "operations": operations,
+        "operations_per_second": round(operations / wall),
+        "reservations_per_second": round((counts["reserved"] + counts["rejected"]) / wall),
+        "reserve_ms": {"p50": pct(0.5), "p99": pct(0.99), "max": round(latencies[-1] * 1000, 2)},
+        "counts": counts,
+        "small_accounts_max_left": max(small_left) if small_left else None,
+        "consistency_problems": problems,
+    }
+    print(f"   {report['operations_per_second']} ops/s ({report['reservations_per_second']} reservations/s) | "
+          f"reserve p50 {report['reserve_ms']['p50']}ms p99 {report['reserve_ms']['p99']}ms")
+    print(f"   {counts['reserved']} reserved, {counts['rejected']} rejected (budget exhausted), "
+          f"{counts['committed']} committed, {counts['released']} released")
+    print("   ✅ ledger consistent" if not problems else f"   ❌ {len(problems)} problems: {problems[:5]}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Budget ledger concurrency benchmark")
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--ops", type=int, default=20000, help="reservations in total")
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--group-wait-ms", type=float, default=0.0)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Fake Gemini Server
+Local stand-in for the Gemini REST API (generateContent) so the backends can
+be load-tested without spending quota.
+
+Point a backend at it with:
+    GEMINI_API_KEY=fake GEMINI_API_ENDPOINT=http://localhost:9100 python backend/main_supply_chain.py
+
+Latency distributions (--latency):
+    fixed:0.8              always 0.8s
+    uniform:0.5,2.0        uniformly between 0.5s and 2.0s
+    normal:1.2,0.3         mean 1.2s, std-dev 0.3s (clamped at 0)
+    lognormal:1.0,0.5      median 1.0s, sigma 0.5 (long tail, closest to the real API)
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Canned responses, chosen by the first keyword found in the prompt text
+CANNED_RESPONSES = {
+    "COMBINED BOX + LABEL": {
+        "box": {
+            "box_condition": "GOOD",
+            "can_ship": True,
+            "conditional_acceptance": False,
+            "volumetric_check": "PASS",
+            "findings": [],
+            "reasoning": "No visible damage (fake model)"
+        },
+        "label": {
+            "label_text": "SKU-123 Blue Shirt - Size M",
+            "visual_object": "Blue shirt, folded, size M tag visible",
+            "match": True,
+            "kitting_verified": True,
+            "aesthetic_score": 0.96,
+            "confidence": 0.94,
+            "action_required": "PASS",
+            "reasoning": "Label text matches the visible product (fake model)"
+        }
+    },
+    "SHIPPING BOX": {
+        "box_condition": "DAMAGED",
+        "can_ship": True,
+        "conditional_acceptance": True,
+        "volumetric_check": "PASS",
+        "findings": [
+            {"defect_type": "cosmetic_dent", "severity": "LOW", "location": "top left corner",
+             "confidence": 0.91, "recommended_action": "Ship as is"}
+        ],
+        "reasoning": "Minor cosmetic dent, structure intact (fake model)"
+    },
+    "VAS": {
+        "label_text": "SKU-123 Blue Shirt - Size M",
+        "visual_object": "Blue shirt, folded, size M tag visible",
+        "match": True,
+        "kitting_verified": True,
+        "aesthetic_score": 0.96,
+        "confidence": 0.94,
+        "action_required": "PASS",
+        "reasoning": "Label text matches the visible product (fake model)"
+    },
+    "INVOICE": {
+        "invoice_number": "INV-12345",
+        "vendor_name": "Office Supplies Co",
+        "invoice_date": "2025-01-15",
+        "due_date": "2025-02-15",
+        "total_amount": 1250.00,
+        "subtotal": 1150.00,
+        "tax_amount": 100.00,
+        "line_items": [
+            {"description": "Office Chairs", "quantity": 5, "unit_price": 200.00, "line_total": 1000.00},
+            {"description": "Desk Lamps", "quantity": 3, "unit_price": 50.00, "line_total": 150.00}
+        ]
+    },
+    "PURCHASE ORDER": {
+        "po_number": "PO-2025-001",
+        "vendor_name": "Office Supplies Co",
+        "po_date": "2025-01-10",
+        "requested_by": "IT Department",
+        "total_amount": 1250.00,
+        "line_items": [
+            {"description": "Office Chairs", "quantity": 5, "unit_price": 200.00, "line_total": 1000.00}
+        ]
+    },
+    "REQUISITION": {
+        "requisition_number": "REQ-2025-001",
+        "requested_by": "John Smith",
+        "request_date": "2025-01-08",
+        "department": "IT",
+        "total_estimated_cost": 1250.00,
+        "line_items": [{"description": "Office Chairs", "quantity": 5, "estimated_price": 200.00}]
+    },
+    "RECEIPT": {
+        "receipt_number": "GR-2025-001",
+        "po_number": "PO-2025-001",
+        "received_date": "2025-01-20",
+        "vendor_name": "Office Supplies Co",
+        "condition": "good",
+        "received_items": [{"description": "Office Chairs", "quantity": 5}]
+    },
+}
+DEFAULT_RESPONSE = {"reasoning": "fake model: no canned response matched"}
+
+
+class LatencyModel:
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            return p[0]
+        if self.kind == "uniform":
+            return random.uniform(p[0], p[1])
+        if self.kind == "normal":
+            return max(0.0, random.gauss(p[0], p[1]))
+        if self.kind == "lognormal":
+            return random.lognormvariate(math.log(p[0]), p[1])
+        raise ValueError(f"Unknown latency distribution: {self.kind}")
+
+
+def prompt_text(body: dict) -> str:
+    texts = []
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                texts.append(part["text"])
+    return "\n".join(texts)
+
+
+def count_images(body: dict) -> int:
+    return sum(1 for c in body.get("contents", []) for p in c.get("parts", [])
+               if "inlineData" in p or "inline_data" in p or "fileData" in p or "file_data" in p)
+
+
+def create_app(latency: LatencyModel, error_rate: float = 0.0, error_codes=(429, 500),
+               responses: Optional[Dict[str, dict]] = None) -> FastAPI:
+    app = FastAPI(title="Fake Gemini")
+    canned = dict(CANNED_RESPONSES)
+    canned.update(responses or {})
+    stats = {"calls": 0, "errors": 0, "images": 0, "started": time.time()}
+
+    def choose_response(text: str):
+        upper = text.upper()
+        for keyword, payload in canned.items():
+            if keyword.upper() in upper:
+                return payload
+        return DEFAULT_RESPONSE
+
+    @app.post("/{version}/models/{model_action}")
+    async def generate_content(version: str, model_action: str, request: Request):
+        body = await request.json()
+        stats["calls"] += 1
+        stats["images"] += count_images(body)
+        await asyncio.sleep(latency.sample())
+
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            code = random.choice(error_codes)
+            status = "RESOURCE_EXHAUSTED" if code == 429 else "INTERNAL"
+            return JSONResponse(status_code=code, content={
+                "error": {"code": code, "message": f"fake error {code}", "status": status}})
+
+        text = prompt_text(body)
+        payload = choose_response(text)
+        return {
+            "candidates": [{
+                "content": {"parts": [{"text": json.dumps(payload)}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0
+            }],
+            "usageMetadata": {
+                "promptTokenCount": len(text) // 4 + 258 * count_images(body),
+                "candidatesTokenCount": len(json.dumps(payload)) // 4,
+                "totalTokenCount": len(text) // 4 + 258 * count_images(body) + len(json.dumps(payload)) // 4
+            },
+            "modelVersion": model_action.split(":")[0]
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return {**stats, "uptime_s": time.time() - stats["started"]}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Gemini generateContent server")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default="lognormal:1.0,0.4", help="fixed:S | uniform:A,B | normal:MU,SD | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that fail (0.0-1.0)")
+    parser.add_argument("--error-codes", default="429,500")
+    parser.add_argument("--responses", help="JSON file mapping prompt keyword -> canned JSON response")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses) as f:
+            responses = json.load(f)
+
+    import uvicorn
+    app = create_app(LatencyModel(args.latency), args.error_rate,
+                     tuple(int(c) for c in args.error_codes.split(",")), responses)
+    print(f"🧪 Fake Gemini on http://localhost:{args.port} (latency={args.latency}, error_rate={args.error_rate})")
+    uvicorn.run(app, host="0.0.0.0", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
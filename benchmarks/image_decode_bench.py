@@ -0,0 +1,118 @@
+"""
+Image Decode Benchmark
+Measures decode/resize/re-encode throughput through backend/image_pool.py for
+a range of pool sizes, plus the worst event-loop stall seen while decoding
+(what unrelated requests would have waited).
+
+    python benchmarks/image_decode_bench.py --sizes 0,1,2,4 --images 64 --width 3000 --height 2000
+
+Pool size 0 means in-thread decoding on the event loop (the old behaviour).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from PIL import Image  # noqa: E402
+
+import image_pool  # noqa: E402
+
+
+def make_jpeg(seed: int, w: int, h: int) -> bytes:
+    # Noise keeps the JPEG photo-sized rather than compressing to nothing
+    img = Image.effect_noise((w, h), 40 + seed % 20).convert("RGB")
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+async def loop_lag(stop: asyncio.Event, interval: float = 0.005) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - t - interval)
+    return worst
+
+
+async def run_size(pool_size: int, payloads, concurrency: int, max_side: int) -> dict:
+    image_pool.shutdown_pool()
+    image_pool.IMAGE_POOL_SIZE = pool_size
+    image_pool.IMAGE_POOL_MIN_BYTES = 0
+    if pool_size:
+        # Start the workers outside the timed section
+        loop = asyncio.get_running_loop()
+        pool = image_pool.get_pool()
+        await asyncio.gather(*(loop.run_in_executor(pool, image_pool._warm) for _ in range(pool_size)))
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(data):
+        async with sem:
+            await image_pool.decode_image_async(data, max_side)
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(loop_lag(stop))
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(d) for d in payloads))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    worst_lag = await lag_task
+    image_pool.shutdown_pool()
+    return {
+        "pool_size": pool_size,
+        "images": len(payloads),
+        "seconds": round(elapsed, 3),
+        "images_per_s": round(len(payloads) / elapsed, 2),
+        "max_loop_stall_ms": round(worst_lag * 1000, 1),
+    }
+
+
+async def run(args) -> dict:
+    print(f"🖼️  Rendering {args.unique} distinct {args.width}x{args.height} JPEGs...")
+    unique = [make_jpeg(i, args.width, args.height) for i in range(args.unique)]
+    payloads = [unique[i % len(unique)] for i in range(args.images)]
+    print(f"   ~{len(unique[0]) // 1024} KB each, {os.cpu_count()} CPUs")
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        r = await run_size(size, payloads, args.concurrency, args.max_side)
+        results.append(r)
+        print(f"   pool={size}: {r['images_per_s']} img/s | max event-loop stall {r['max_loop_stall_ms']}ms")
+
+    base = results[0]["images_per_s"]
+    for r in results:
+        r["speedup"] = round(r["images_per_s"] / base, 2) if base else None
+    return {"config": vars(args), "cpu_count": os.cpu_count(), "results": results}
+
+
+def main(argv=None):
+    default_sizes = ",".join(str(n) for n in sorted({0, 1, 2, 4, os.cpu_count() or 1}))
+    parser = argparse.ArgumentParser(description="Image decode pool benchmark")
+    parser.add_argument("--sizes", default=default_sizes, help="Comma-separated pool sizes (0 = in-thread)")
+    parser.add_argument("--images", type=int, default=48)
+    parser.add_argument("--unique", type=int, default=8)
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=2000)
+    parser.add_argument("--max-side", type=int, default=image_pool.MODEL_IMAGE_MAX_SIDE)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Local Image Server
+Serves synthetic box, label and invoice images so load tests don't depend on
+Unsplash or any other CDN.
+
+    GET /images/box-{n}.jpg?w=1600&h=1200      cardboard box photo stand-in
+    GET /images/label-{n}.jpg?w=1200&h=900     package with a shipping label
+    GET /documents/invoice-{n}.png             single-page invoice
+"""
+
+import argparse
+import random
+from functools import lru_cache
+from io import BytesIO
+
+from fastapi import FastAPI
+from fastapi.responses import Response
+from PIL import Image, ImageDraw
+
+
+@lru_cache(maxsize=256)
+def render_box(seed: int, w: int, h: int, quality: int) -> bytes:
+    rng = random.Random(seed)
+    img = Image.new("RGB", (w, h), (rng.randint(60, 90),) * 3)
+    draw = ImageDraw.Draw(img)
+    bx0, by0 = int(w * 0.15), int(h * 0.15)
+    bx1, by1 = int(w * 0.85), int(h * 0.9)
+    draw.rectangle([bx0, by0, bx1, by1], fill=(181 + rng.randint(-15, 15), 137, 90))
+    draw.line([bx0, (by0 + by1) // 2, bx1, (by0 + by1) // 2], fill=(150, 110, 70), width=max(2, w // 200))
+    # Texture so JPEG sizes look like real photos rather than flat colour
+    for _ in range(w * h // 400):
+        x, y = rng.randrange(w), rng.randrange(h)
+        c = rng.randint(-25, 25)
+        draw.point((x, y), fill=(150 + c, 115 + c, 75 + c))
+    if seed % 3 == 0:
+        # "Damage": a dark crease on some boxes
+        draw.line([bx0 + 20, by0 + 40, bx0 + (bx1 - bx0) // 3, by1 - 30], fill=(70, 50, 30), width=max(3, w // 150))
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+@lru_cache(maxsize=256)
+def render_label(seed: int, w: int, h: int, quality: int) -> bytes:
+    base = Image.open(BytesIO(render_box(seed, w, h, quality))).convert("RGB")
+    draw = ImageDraw.Draw(base)
+    lx0, ly0 = int(w * 0.45), int(h * 0.3)
+    lx1, ly1 = int(w * 0.78), int(h * 0.6)
+    draw.rectangle([lx0, ly0, lx1, ly1], fill=(245, 245, 240), outline=(0, 0, 0))
+    draw.text((lx0 + 10, ly0 + 10), f"SKU-{100 + seed % 900}", fill=(0, 0, 0))
+    draw.text((lx0 + 10, ly0 + 30), "Blue Shirt - Size M", fill=(0, 0, 0))
+    for i in range(40):
+        x = lx0 + 10 + i * 4
+        if x < lx1 - 10:
+            draw.rectangle([x, ly1 - 50, x + (1 if (seed + i) % 3 else 2), ly1 - 10], fill=(0, 0, 0))
+    buf = BytesIO()
+    base.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+@lru_cache(maxsize=64)
+def render_invoice(seed: int, w: int, h: int) -> bytes:
+    img = Image.new("RGB", (w, h), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    draw.text((60, 50), "Office Supplies Co", fill=(0, 0, 0))
+    draw.text((w - 300, 50), f"INVOICE INV-{10000 + seed}", fill=(0, 0, 0))
+    draw.text((w - 300, 80), "Date: 2025-01-15", fill=(0, 0, 0))
+    y = 200
+    for i in range(8):
+        draw.text((60, y), f"Item {i + 1}", fill=(0, 0, 0))
+        draw.text((w - 400, y), f"{i + 1}", fill=(0, 0, 0))
+        draw.text((w - 250, y), f"{(i + 1) * 12.5:.2f}", fill=(0, 0, 0))
+        y += 40
+    draw.text((w - 250, y + 40), "TOTAL 1250.00", fill=(0, 0, 0))
+    buf = BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="Benchmark Image Server")
+
+    def seed_of(name: str) -> int:
+        digits = "".join(ch for ch in name if ch.isdigit())
+        return int(digits) if digits else 0
+
+    @app.get("/images/{name}")
+    async def image(name: str, w: int = 1600, h: int = 1200, q: int = 85):
+        seed = seed_of(name)
+        data = render_label(seed, w, h, q) if name.startswith("label") else render_box(seed, w, h, q)
+        return Response(content=data, media_type="image/jpeg")
+
+    @app.get("/documents/{name}")
+    async def document(name: str, w: int = 1240, h: int = 1754):
+        return Response(content=render_invoice(seed_of(name), w, h), media_type="image/png")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic image server for load tests")
+    parser.add_argument("--port", type=int, default=9200)
+    args = parser.parse_args()
+
+    import uvicorn
+    print(f"🖼️  Image server on http://localhost:{args.port}")
+    uvicorn.run(create_app(), host="0.0.0.0", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
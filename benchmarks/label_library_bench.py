@@ -0,0 +1,123 @@
+"""
+Reference Label Library Benchmark
+Builds a library of synthetic barcode labels (one per SKU), then times
+lookups of photographed labels and counts how often a wrong label would have
+been accepted as a clear match.
+
+    python benchmarks/label_library_bench.py --skus 5000 --queries 200
+
+Needs numpy (as does the library itself).
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+import numpy as np  # noqa: E402
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+import label_detector  # noqa: E402
+import label_library  # noqa: E402
+
+
+def render_label(seed: int) -> Image.Image:
+    """FNSKU-style label: random bar pattern, SKU text, two text lines"""
+    rnd = random.Random(seed)
+    label = Image.new("L", (300, 110), 255)
+    draw = ImageDraw.Draw(label)
+    x = 20
+    while x < 280:
+        w = rnd.choice((1, 2, 2, 3, 4))
+        if rnd.random() < 0.5:
+            draw.rectangle((x, 6, x + w - 1, 52), fill=0)
+        x += w
+    draw.text((100, 56), f"X00{seed:07d}", fill=0)
+    draw.text((10, 74), "Item " + "".join(rnd.choice("abcdefghijklmnop ") for _ in range(30)), fill=0)
+    draw.text((10, 90), "New", fill=0)
+    return label
+
+
+def photograph(label: Image.Image, seed: int) -> Image.Image:
+    """Label on a beige carton, upscaled, blurred and JPEG-compressed"""
+    rnd = random.Random(seed)
+    scale = rnd.uniform(2.5, 4.0)
+    label = label.convert("RGB").resize((int(label.width * scale), int(label.height * scale)))
+    carton = Image.new("RGB", (1600, 1200), (196, 170, 126))
+    carton.paste(label, (rnd.randint(100, 500), rnd.randint(100, 500)))
+    buf = BytesIO()
+    carton.filter(ImageFilter.GaussianBlur(rnd.uniform(0.5, 1.5))).save(buf, "JPEG", quality=80)
+    return Image.open(BytesIO(buf.getvalue())).convert("RGB")
+
+
+def build(skus: int) -> label_library.LabelIndex:
+    coarse, fine = [], []
+    for i in range(skus):
+        label = label_library.normalize_label(render_label(i))
+        coarse.append(label_library.coarse_vector(label))
+        fine.append(label_library.fine_thumbnail(label))
+    return label_library.LabelIndex(np.stack(coarse), np.stack(fine), np.arange(skus, dtype=np.int32),
+                                    [f"X00{i:07d}" for i in range(skus)])
+
+
+def run(args) -> dict:
+    print(f"🏷️  Building a library of {args.skus} synthetic labels...")
+    start = time.perf_counter()
+    index = build(args.skus)
+    build_s = time.perf_counter() - start
+    print(f"   {build_s:.1f}s ({index.coarse.nbytes // 1024} KB coarse, {index.fine.nbytes // 1024} KB fine)")
+
+    rnd = random.Random(7)
+    timings, right_hits, wrong_hits = [], 0, 0
+    for q in range(args.queries):
+        sku = rnd.randrange(args.skus)
+        # Half the queries carry the expected label, half a different SKU's label
+        shown = sku if q % 2 == 0 else (sku + 1 + rnd.randrange(args.skus - 1)) % args.skus
+        photo = photograph(render_label(shown), q)
+        label = photo.crop(label_detector.find_label(photo) or (0, 0) + photo.size)
+        label.thumbnail((label_library.QUERY_MAX_SIDE, label_library.QUERY_MAX_SIDE))
+        t = time.perf_counter()
+        result = index.match(label, f"X00{sku:07d}")
+        timings.append(time.perf_counter() - t)
+        if result and result.clear:
+            right_hits += shown == sku
+            wrong_hits += shown != sku
+
+    timings.sort()
+    pct = lambda p: round(timings[min(len(timings) - 1, int(p * len(timings)))] * 1000, 2)
+    report = {
+        "config": vars(args),
+        "build_seconds": round(build_s, 2),
+        "lookup_ms": {"p50": pct(0.5), "p99": pct(0.99), "max": round(timings[-1] * 1000, 2)},
+        "clear_matches_on_right_label": f"{right_hits}/{(args.queries + 1) // 2}",
+        "clear_matches_on_wrong_label": f"{wrong_hits}/{args.queries // 2}",
+    }
+    print(f"   lookup p50 {report['lookup_ms']['p50']}ms | p99 {report['lookup_ms']['p99']}ms")
+    print(f"   LLM skipped on {report['clear_matches_on_right_label']} right labels, "
+          f"wrongly accepted {report['clear_matches_on_wrong_label']} wrong labels")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reference label library benchmark")
+    parser.add_argument("--skus", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Load Generator
+Drives the vision and document endpoints at a target request rate (open loop)
+and writes throughput, latency percentiles, error rates and the average
+Server-Timing stage breakdown to a JSON report.
+
+    python benchmarks/load_test.py --rps 20 --duration 60 --output bench_output.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[idx]
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    stages = {}
+    for item in (header or "").split(","):
+        name, _, rest = item.strip().partition(";")
+        if rest.startswith("dur="):
+            try:
+                stages[name] = float(rest[4:])
+            except ValueError:
+                pass
+    return stages
+
+
+# Scenarios -------------------------------------------------------------------
+# Each returns (method, url, kwargs) for one request; n is the request index.
+
+def make_scenarios(args) -> Dict[str, Callable[[int], tuple]]:
+    images = args.image_base.rstrip("/")
+    supply = args.supply_url.rstrip("/")
+    procurement = args.procurement_url.rstrip("/")
+    w, h = args.image_width, args.image_height
+
+    def box_url(n):
+        return f"{images}/images/box-{n % args.unique_images}.jpg?w={w}&h={h}"
+
+    def label_url(n):
+        return f"{images}/images/label-{n % args.unique_images}.jpg?w={w}&h={h}"
+
+    return {
+        "inspect_box": lambda n: ("POST", f"{supply}/inspect/box", {"json": {
+            "image_url": box_url(n), "shipment_id": f"LOAD-{n}", "priority": "STANDARD"}}),
+        "inspect_batch": lambda n: ("POST", f"{supply}/inspect/batch", {"json": {
+            "image_urls": [box_url(n * args.batch_size + i) for i in range(args.batch_size)]}}),
+        "verify_label": lambda n: ("POST", f"{supply}/vas/verify_label", {"json": {
+            "image_url": label_url(n), "order_id": f"ORDER-{n}", "station_id": f"Station-{n % 8}",
+            "expected_sku": f"SKU-{100 + (n % args.unique_images) % 900}"}}),
+        "inspect_fused": lambda n: ("POST", f"{supply}/inspect/fused", {"json": {
+            "image_url": label_url(n), "shipment_id": f"LOAD-{n}", "order_id": f"ORDER-{n}",
+            "station_id": f"Station-{n % 8}", "expected_sku": f"SKU-{100 + (n % args.unique_images) % 900}"}}),
+        "extract_document": lambda n: ("POST", f"{procurement}/procurement/extract_document", {"json": {
+            "document_url": f"{images}/documents/invoice-{n % args.unique_images}.png", "document_type": "invoice"}}),
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, build: Callable[[int], tuple],
+                       rps: float, duration: float, max_in_flight: int) -> dict:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = defaultdict(int)
+    stage_totals: Dict[str, float] = defaultdict(float)
+    stage_counts: Dict[str, int] = defaultdict(int)
+    late_starts = 0
+    in_flight = asyncio.Semaphore(max_in_flight)
+
+    async def one(n: int):
+        method, url, kwargs = build(n)
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+            statuses[str(resp.status_code)] += 1
+            if resp.status_code < 400:
+                latencies.append(time.perf_counter() - start)
+            for stage, ms in parse_server_timing(resp.headers.get("server-timing")).items():
+                stage_totals[stage] += ms
+                stage_counts[stage] += 1
+        except Exception as e:
+            statuses[type(e).__name__] += 1
+        finally:
+            in_flight.release()
+
+    print(f"🚀 {name}: {rps} req/s for {duration}s")
+    tasks = []
+    total = int(rps * duration)
+    t0 = time.perf_counter()
+    for n in range(total):
+        # Open loop: request n is due at t0 + n/rps regardless of earlier responses
+        delay = t0 + n / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if in_flight.locked():
+            late_starts += 1
+        await in_flight.acquire()
+        tasks.append(asyncio.create_task(one(n)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    ok = len(latencies)
+    errors = total - ok
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    return {
+        "target_rps": rps,
+        "duration_s": round(elapsed, 2),
+        "requests": total,
+        "succeeded": ok,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "throughput_rps": round(ok / elapsed, 2) if elapsed else 0.0,
+        "late_starts": late_starts,
+        "status_counts": dict(statuses),
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "mean": ms(sum(latencies) / ok) if ok else None,
+            "max": ms(latencies[-1]) if ok else None,
+        },
+        "server_timing_avg_ms": {s: round(stage_totals[s] / stage_counts[s], 1) for s in stage_totals},
+    }
+
+
+async def run(args) -> dict:
+    scenarios = make_scenarios(args)
+    selected = args.scenarios.split(",") if args.scenarios else list(scenarios)
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "scenarios": {},
+    }
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        for name in selected:
+            if name not in scenarios:
+                raise SystemExit(f"Unknown scenario '{name}'. Choose from: {', '.join(scenarios)}")
+            report["scenarios"][name] = await run_scenario(
+                client, name, scenarios[name], args.rps, args.duration, args.max_in_flight)
+            r = report["scenarios"][name]
+            print(f"   ✅ {r['throughput_rps']} req/s | p50 {r['latency_ms']['p50']}ms | "
+                  f"p95 {r['latency_ms']['p95']}ms | p99 {r['latency_ms']['p99']}ms | errors {r['error_rate']:.1%}")
+    return report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="VisionFlow load generator")
+    parser.add_argument("--supply-url", default="http://localhost:8000")
+    parser.add_argument("--procurement-url", default="http://localhost:8001")
+    parser.add_argument("--image-base", default="http://localhost:9200", help="Base URL of benchmarks/image_server.py")
+    parser.add_argument("--scenarios", default="", help="Comma-separated: inspect_box,inspect_batch,verify_label,inspect_fused,extract_document")
+    parser.add_argument("--rps", type=float, default=5.0, help="Target requests per second per scenario")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per scenario")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--unique-images", type=int, default=50, help="Distinct images to cycle through")
+    parser.add_argument("--image-width", type=int, default=1600)
+    parser.add_argument("--image-height", type=int, default=1200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_output.json")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Report written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
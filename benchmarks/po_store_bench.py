@@ -0,0 +1,127 @@
+"""
+Purchase Order Store Benchmark
+Fills backend/po_store.py with synthetic POs (3 line items each) in batched
+transactions, then times the queries the API makes: get() by PO number (what
+match_invoice does), vendor and department + date range searches.
+
+    python benchmarks/po_store_bench.py --pos 1000000 --lookups 20000
+
+Uses a fresh database under a temp directory unless --db is given.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+import po_store  # noqa: E402
+
+VENDORS = [f"Vendor {i:04d}" for i in range(2000)]
+DEPARTMENTS = ["IT", "HR", "Finance", "Operations", "Legal", "Marketing", "Facilities", "R&D"]
+ITEMS = ["Office Chairs", "Desk Lamps", "Laptops", "Monitors", "Paper", "Toner", "Cables", "Licenses"]
+
+
+def synthetic_po(rnd: random.Random, day: str) -> dict:
+    items = [{"description": rnd.choice(ITEMS), "quantity": rnd.randint(1, 50),
+              "unit_price": round(rnd.uniform(5, 900), 2)} for _ in range(3)]
+    return {"vendor_name": rnd.choice(VENDORS), "department": rnd.choice(DEPARTMENTS), "created_date": day,
+            "total_amount": round(sum(i["quantity"] * i["unit_price"] for i in items), 2), "line_items": items}
+
+
+def timed(fn, calls: int) -> dict:
+    timings = []
+    for _ in range(calls):
+        t = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t)
+    timings.sort()
+    pct = lambda p: round(timings[min(len(timings) - 1, int(p * len(timings)))] * 1e6, 1)
+    return {"per_second": round(calls / sum(timings)), "p50_us": pct(0.5), "p99_us": pct(0.99)}
+
+
+def run(args) -> dict:
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="po-bench-"), "po_store.db")
+    store = po_store.POStore(path)
+    rnd = random.Random(11)
+    start_day = date(2024, 1, 1)
+    per_day = max(1, args.pos // args.days)
+
+    print(f"📋 Inserting {args.pos:,} POs ({args.pos * 3:,} line items) over {args.days} days "
+          f"in batches of {args.batch:,}...")
+    numbers = []
+    start = time.perf_counter()
+    inserted = 0
+    while inserted < args.pos:
+        batch = []
+        for _ in range(min(args.batch, args.pos - inserted)):
+            day = (start_day + timedelta(days=min(args.days - 1, (inserted + len(batch)) // per_day))).isoformat()
+            batch.append(synthetic_po(rnd, day))
+        store.create_many(batch)
+        numbers.extend(po["po_number"] for po in batch if rnd.random() < 0.05)
+        inserted += len(batch)
+    insert_s = time.perf_counter() - start
+    duplicates = store._conn().execute(
+        "SELECT COUNT(*) - COUNT(DISTINCT po_number) FROM purchase_orders").fetchone()[0]
+    print(f"   {insert_s:.1f}s = {args.pos / insert_s:,.0f} POs/s, duplicate numbers: {duplicates}")
+
+    t = time.perf_counter()
+    store.create(VENDORS[0], "IT", 100.0, [{"description": "Paper", "quantity": 1, "unit_price": 100.0}])
+    single_ms = (time.perf_counter() - t) * 1000
+
+    get = timed(lambda: store.get(rnd.choice(numbers)), args.lookups)
+    missing = timed(lambda: store.get("PO-19990101-000001"), min(args.lookups, 2000))
+    first_week = (start_day + timedelta(days=6)).isoformat()
+    by_vendor = timed(lambda: store.search(vendor_name=rnd.choice(VENDORS), limit=50), min(args.lookups, 2000))
+    by_department = timed(lambda: store.search(department=rnd.choice(DEPARTMENTS), date_from=start_day.isoformat(),
+                                               date_to=first_week, limit=50), min(args.lookups, 2000))
+    plan = store._conn().execute("EXPLAIN QUERY PLAN SELECT * FROM purchase_orders p LEFT JOIN po_line_items l "
+                                 "ON l.po_id = p.id WHERE p.po_number = ?", ("x",)).fetchall()
+
+    report = {
+        "config": vars(args),
+        "pos": store.count(),
+        "insert_seconds": round(insert_s, 1),
+        "inserts_per_second": round(args.pos / insert_s),
+        "single_create_ms": round(single_ms, 2),
+        "duplicate_po_numbers": duplicates,
+        "get_by_po_number": get,
+        "get_missing": missing,
+        "search_vendor": by_vendor,
+        "search_department_week": by_department,
+        "get_query_plan": [row[-1] for row in plan],
+        "db_mb": round(os.path.getsize(path) / 1e6, 1),
+    }
+    print(f"   get(po_number): {get['per_second']:,}/s p50 {get['p50_us']}us p99 {get['p99_us']}us")
+    print(f"   vendor search: p50 {by_vendor['p50_us']}us | department + week: p50 {by_department['p50_us']}us")
+    print(f"   single create (own transaction, fsync): {single_ms:.2f}ms | db {report['db_mb']} MB")
+    print(f"   plan: {report['get_query_plan']}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Purchase order store benchmark")
+    parser.add_argument("--pos", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--db", default="")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+One-Shot Local Benchmark
+Starts the fake Gemini server, the image server and both backends (wired to the
+fake model), runs load_test.py against them and shuts everything down.
+
+    python benchmarks/run_local.py --latency lognormal:0.8,0.4 --workers 2 -- --rps 10 --duration 30
+
+Arguments after "--" are passed to load_test.py.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+BACKEND_DIR = os.path.join(ROOT, "backend")
+
+sys.path.insert(0, BENCH_DIR)
+import load_test  # noqa: E402
+
+
+def wait_for(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def main():
+    argv = sys.argv[1:]
+    passthrough = []
+    if "--" in argv:
+        idx = argv.index("--")
+        argv, passthrough = argv[:idx], argv[idx + 1:]
+
+    parser = argparse.ArgumentParser(description="Run the full local benchmark stack")
+    parser.add_argument("--latency", default="lognormal:1.0,0.4")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=1, help="WEB_CONCURRENCY for both backends")
+    parser.add_argument("--env", action="append", default=[], help="Extra KEY=VALUE for the backends (repeatable)")
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="visionflow-bench-")
+    env = dict(os.environ,
+               GEMINI_API_KEY="fake-key",
+               GEMINI_API_ENDPOINT="http://127.0.0.1:9100",
+               WEB_CONCURRENCY=str(args.workers),
+               DATA_DIR=data_dir,
+               STATE_DB_PATH=os.path.join(data_dir, "state.db"))
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    py = sys.executable
+    uvicorn = [py, "-m", "uvicorn", "--app-dir", BACKEND_DIR, "--host", "127.0.0.1",
+               "--log-level", "warning", "--workers", str(args.workers)]
+    commands = [
+        ([py, os.path.join(BENCH_DIR, "fake_gemini.py"), "--port", "9100", "--latency", args.latency,
+          "--error-rate", str(args.error_rate)], "http://127.0.0.1:9100/stats"),
+        ([py, os.path.join(BENCH_DIR, "image_server.py"), "--port", "9200"], "http://127.0.0.1:9200/docs"),
+        (uvicorn + ["main_supply_chain:app", "--port", "8000"], "http://127.0.0.1:8000/health"),
+        (uvicorn + ["main_procurement:app", "--port", "8001"], "http://127.0.0.1:8001/health"),
+    ]
+
+    procs = []
+    try:
+        for cmd, health_url in commands:
+            procs.append(subprocess.Popen(cmd, env=env, cwd=ROOT))
+            wait_for(health_url)
+        report = load_test.main(["--supply-url", "http://127.0.0.1:8000",
+                                 "--procurement-url", "http://127.0.0.1:8001",
+                                 "--image-base", "http://127.0.0.1:9200"] + passthrough)
+        model_stats = httpx.get("http://127.0.0.1:9100/stats").json()
+        print(f"🧪 Fake model served {model_stats['calls']} calls ({model_stats['errors']} injected errors)")
+        return report
+    finally:
+        for p in reversed(procs):
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Unit tests for the compiled approval policy (backend/approval_policy.py)
+Amount bounds, conditions, compliance overrides and hot reload.
+
+    python -m pytest test_approval_policy.py
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from approval_policy import DEFAULT_POLICY, CompiledPolicy, PolicyStore, compliance_status  # noqa: E402
+
+
+def chain(policy: CompiledPolicy, **requisition):
+    return policy.decide({"department": "IT", **requisition})[0]
+
+
+def old_chain(department: str, amount: float):
+    # The hardcoded chain the built-in policy replaces
+    result = []
+    if amount > 1000:
+        result.append(f"{department} Manager")
+    if amount > 5000:
+        result.append("VP Finance")
+    if amount > 20000:
+        result.append("CFO")
+    return result
+
+
+@pytest.mark.parametrize("amount", [0, 999.99, 1000, 1000.01, 5000, 5000.01, 19999.99, 20000, 20000.01, 1e9])
+def test_builtin_policy_matches_the_old_thresholds(amount):
+    policy = CompiledPolicy(DEFAULT_POLICY)
+    assert chain(policy, amount=amount) == old_chain("IT", amount)
+
+
+def test_min_is_exclusive_and_max_inclusive():
+    policy = CompiledPolicy({"rules": [{"approver": "Band", "min_amount": 100, "max_amount": 200}]})
+    assert chain(policy, amount=100) == []
+    assert chain(policy, amount=100.01) == ["Band"]
+    assert chain(policy, amount=200) == ["Band"]
+    assert chain(policy, amount=200.01) == []
+
+
+def test_unbounded_rule_applies_to_any_amount():
+    policy = CompiledPolicy({"rules": [{"approver": "Always"}, {"approver": "Small", "max_amount": 10}]})
+    assert chain(policy, amount=0) == ["Always", "Small"]
+    assert chain(policy, amount=None) == ["Always", "Small"]
+    assert chain(policy, amount=10.5) == ["Always"]
+
+
+def test_conditions_are_case_insensitive_and_all_must_match():
+    policy = CompiledPolicy({"rules": [
+        {"approver": "CISO", "department": ["IT"], "category": ["software", "cloud"], "min_amount": 10000},
+        {"approver": "Procurement Risk", "vendor_risk": "high"},
+    ]})
+    assert chain(policy, department="it", category="Software", amount=15000) == ["CISO"]
+    assert chain(policy, department="HR", category="software", amount=15000) == []
+    assert chain(policy, category="hardware", amount=15000) == []
+    assert chain(policy, category="cloud", amount=15000, vendor_risk="HIGH") == ["CISO", "Procurement Risk"]
+    assert chain(policy, amount=1) == []
+
+
+def test_chain_keeps_file_order_without_duplicates():
+    policy = CompiledPolicy({"rules": [
+        {"approver": "{department} Manager", "min_amount": 0},
+        {"approver": "CFO", "min_amount": 500},
+        {"approver": "{department} Manager", "vendor": ["Acme"]},
+    ]})
+    assert policy.decide({"department": "Ops", "vendor": "acme", "amount": 600})[0] == ["Ops Manager", "CFO"]
+
+
+def test_first_compliance_status_overrides_the_budget_status():
+    policy = CompiledPolicy({"rules": [
+        {"vendor": ["Blocked Supplies Ltd"], "compliance_status": "VENDOR_BLOCKED"},
+        {"vendor_risk": ["high"], "compliance_status": "RISK_REVIEW", "approver": "Risk"},
+    ]})
+    approvers, override = policy.decide({"vendor": "Blocked Supplies Ltd", "vendor_risk": "high", "amount": 5})
+    assert approvers == ["Risk"] and override == "VENDOR_BLOCKED"
+    assert compliance_status(override, budget_available=True) == "VENDOR_BLOCKED"
+    assert compliance_status(None, budget_available=True) == "COMPLIANT"
+    assert compliance_status(None, budget_available=False) == "BUDGET_EXCEEDED"
+
+
+@pytest.mark.parametrize("config", [
+    {},
+    {"rules": [{"approver": "X", "amount_over": 5}]},
+    {"rules": [{"department": ["IT"]}]},
+])
+def test_invalid_policies_are_rejected(config):
+    with pytest.raises(ValueError):
+        CompiledPolicy(config)
+
+
+def test_store_reloads_on_change_and_keeps_the_last_good_policy(tmp_path):
+    path = tmp_path / "policy.json"
+    path.write_text(json.dumps({"version": "v1", "rules": [{"approver": "A"}]}))
+    store = PolicyStore(str(path), reload_seconds=0)
+    assert store.current().version == "v1"
+
+    path.write_text(json.dumps({"version": "v2", "rules": [{"approver": "B"}]}))
+    os.utime(path, ns=(1, 10**18))
+    assert store.current().version == "v2"
+
+    path.write_text("{not json")
+    os.utime(path, ns=(1, 2 * 10**18))
+    assert store.current().version == "v2"
+    assert store.error is not None
+    assert not store.reload(force=True)
+
+
+def test_inline_policy_and_builtin_default():
+    assert PolicyStore('{"version": "inline", "rules": []}').info()["source"] == "inline"
+    builtin = PolicyStore("")
+    assert builtin.reload(force=True)
+    assert builtin.info()["version"] == "builtin"
@@ -0,0 +1,150 @@
+"""
+Unit tests for the budget ledger (backend/budget_ledger.py)
+Reservations, commits, releases, expiry and the no-overspend guarantee.
+
+    python -m pytest test_budget_ledger.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import budget_ledger  # noqa: E402
+from budget_ledger import BudgetLedger, LedgerError  # noqa: E402
+
+
+def make_ledger(tmp_path, total: float = 1000.0, spent: float = 0.0, **kwargs) -> BudgetLedger:
+    ledger = BudgetLedger(str(tmp_path / "ledger.db"), **kwargs)
+    budget_ledger.seed(ledger, {"IT": {"total": total, "spent": spent}})
+    return ledger
+
+
+def test_reserve_encumbers_and_commit_spends(tmp_path):
+    ledger = make_ledger(tmp_path, total=1000.0, spent=200.0)
+
+    async def scenario():
+        reservation = await ledger.reserve("IT", 300.0, reference="REQ-1")
+        assert reservation["ok"] and reservation["reservation_id"]
+        assert reservation["available"] == 500.0
+        assert ledger.balance("IT")["encumbered"] == 300.0
+
+        committed = await ledger.commit(reservation["reservation_id"], 250.0)
+        assert committed["status"] == "committed"
+        return committed
+
+    committed = asyncio.run(scenario())
+    assert committed["available"] == 550.0
+    assert ledger.balance("IT") == {"account": "IT", "total": 1000.0, "spent": 450.0,
+                                    "encumbered": 0.0, "available": 550.0}
+    assert ledger.check_consistency() == []
+
+
+def test_release_returns_the_amount(tmp_path):
+    ledger = make_ledger(tmp_path)
+
+    async def scenario():
+        reservation = await ledger.reserve("IT", 400.0)
+        return await ledger.release(reservation["reservation_id"])
+
+    released = asyncio.run(scenario())
+    assert released["status"] == "released"
+    assert ledger.balance("IT")["available"] == 1000.0
+    assert ledger.balance("IT")["spent"] == 0.0
+
+
+def test_reserve_rejected_when_budget_does_not_cover_it(tmp_path):
+    ledger = make_ledger(tmp_path, total=100.0)
+
+    async def scenario():
+        return await ledger.reserve("IT", 100.01), await ledger.reserve("Unknown", 1.0)
+
+    too_much, unknown = asyncio.run(scenario())
+    assert not too_much["ok"] and too_much["reservation_id"] is None
+    assert too_much["available"] == 100.0
+    assert not unknown["ok"]
+
+
+def test_concurrent_reservations_never_overspend(tmp_path):
+    ledger = make_ledger(tmp_path, total=1000.0)
+
+    async def scenario():
+        return await asyncio.gather(*(ledger.reserve("IT", 30.0) for _ in range(100)))
+
+    results = asyncio.run(scenario())
+    assert sum(r["ok"] for r in results) == 33
+    balance = ledger.balance("IT")
+    assert balance["encumbered"] == 990.0
+    assert balance["available"] == pytest.approx(10.0)
+    assert ledger.check_consistency() == []
+
+
+def test_settling_twice_raises(tmp_path):
+    ledger = make_ledger(tmp_path)
+
+    async def scenario():
+        reservation = await ledger.reserve("IT", 10.0)
+        await ledger.commit(reservation["reservation_id"])
+        with pytest.raises(LedgerError):
+            await ledger.release(reservation["reservation_id"])
+        with pytest.raises(LedgerError):
+            await ledger.commit("RSV-does-not-exist")
+
+    asyncio.run(scenario())
+    assert ledger.balance("IT")["spent"] == 10.0
+
+
+def test_commit_overrun_must_fit_the_budget(tmp_path):
+    ledger = make_ledger(tmp_path, total=100.0)
+
+    async def scenario():
+        first = await ledger.reserve("IT", 50.0)
+        second = await ledger.reserve("IT", 30.0)
+        # 50 reserved + 30 more than that, but only 20 is left
+        with pytest.raises(LedgerError):
+            await ledger.commit(first["reservation_id"], 80.0)
+        assert ledger.balance("IT")["encumbered"] == 80.0  # failed commit changed nothing
+        await ledger.commit(first["reservation_id"], 70.0)
+        await ledger.release(second["reservation_id"])
+
+    asyncio.run(scenario())
+    assert ledger.balance("IT") == {"account": "IT", "total": 100.0, "spent": 70.0,
+                                    "encumbered": 0.0, "available": 30.0}
+    assert ledger.check_consistency() == []
+
+
+def test_expired_reservations_are_released(tmp_path):
+    ledger = make_ledger(tmp_path, reservation_ttl=0.05)
+
+    async def scenario():
+        reservation = await ledger.reserve("IT", 600.0)
+        assert ledger.balance("IT")["available"] == 400.0
+        time.sleep(0.1)
+        assert await ledger.expire() == 1
+        with pytest.raises(LedgerError):
+            await ledger.commit(reservation["reservation_id"])
+
+    asyncio.run(scenario())
+    assert ledger.balance("IT")["available"] == 1000.0
+    assert ledger.check_consistency() == []
+
+
+def test_seed_keeps_existing_balances(tmp_path):
+    ledger = make_ledger(tmp_path, total=1000.0)
+    asyncio.run(ledger.reserve("IT", 100.0))
+    budget_ledger.seed(ledger, {"IT": {"total": 5.0, "spent": 0.0}, "HR": {"total": 50.0, "spent": 10.0}})
+    assert ledger.balance("IT")["total"] == 1000.0
+    assert ledger.balance("IT")["encumbered"] == 100.0
+    assert ledger.balance("HR")["available"] == 40.0
+
+
+def test_cost_center_account_falls_back_to_department(tmp_path):
+    ledger = make_ledger(tmp_path)
+    budget_ledger.seed(ledger, {budget_ledger.account_key("IT", "CC-7"): {"total": 10.0}})
+    assert ledger.resolve_account("IT", "CC-7") == "IT/CC-7"
+    assert ledger.resolve_account("IT", "CC-8") == "IT"
+    assert ledger.resolve_account("IT", None) == "IT"
@@ -0,0 +1,156 @@
+"""
+Unit tests for bulk document extraction (backend/bulk_extraction.py)
+Checkpoints, resuming a run by run_id, manifests and the input directory restriction.
+
+    python -m pytest test_bulk_extraction.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import bulk_extraction  # noqa: E402
+from bulk_extraction import Checkpoint, items_from_directory, items_from_list, items_from_manifest  # noqa: E402
+
+URLS = [f"https://example.com/invoices/{n}.pdf" for n in range(6)]
+
+
+def collect(items, fetch, extract, checkpoint=None, **kwargs):
+    async def scenario():
+        return [r async for r in bulk_extraction.run(items, fetch, extract, checkpoint, **kwargs)]
+    records = asyncio.run(scenario())
+    summary = records.pop()["summary"]
+    return sorted(records, key=lambda r: r["index"]), summary
+
+
+def test_run_id_is_validated(tmp_path):
+    for run_id in ("../escape", "a/b", "", "x" * 101):
+        with pytest.raises(ValueError):
+            Checkpoint(run_id, str(tmp_path))
+    assert Checkpoint("month-end_2025.03", str(tmp_path)).path.endswith("month-end_2025.03.ndjson")
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    checkpoint = Checkpoint("run", str(tmp_path))
+    checkpoint.append({"key": "a", "status": "ok"})
+    checkpoint.append({"key": "b", "status": "error"})
+    with open(checkpoint.path, "a") as f:
+        f.write('{"key": "c", "sta')
+    assert [r["key"] for r in checkpoint.records()] == ["a", "b"]
+    assert list(checkpoint.completed()) == ["a"]
+
+
+def test_every_document_is_yielded_with_a_summary():
+    items = items_from_list([{"document_url": u} for u in URLS])
+
+    async def fetch(item):
+        if item.index == 2:
+            raise IOError("404")
+        return item.document_url.encode()
+
+    async def extract(item, content):
+        await asyncio.sleep(0.001 * (6 - item.index))
+        return {"source": content.decode()}
+
+    records, summary = collect(items, fetch, extract, download_concurrency=2, extract_concurrency=2)
+    assert [r["index"] for r in records] == list(range(6))
+    assert records[0]["result"] == {"source": URLS[0]}
+    assert records[2]["status"] == "error" and "404" in records[2]["error"]
+    assert summary["total"] == 6 and summary["ok"] == 5 and summary["error"] == 1 and summary["resumed"] == 0
+
+
+def test_rerun_resumes_finished_documents_and_retries_failures(tmp_path):
+    items = items_from_list([{"document_url": u} for u in URLS])
+    extracted = []
+    fail = {3}
+
+    async def fetch(item):
+        return b"pdf"
+
+    async def extract(item, content):
+        extracted.append(item.index)
+        if item.index in fail:
+            raise RuntimeError("model timeout")
+        return {"invoice_number": f"INV-{item.index}"}
+
+    records, summary = collect(items, fetch, extract, Checkpoint("run-1", str(tmp_path)))
+    assert (summary["ok"], summary["error"], summary["resumed"]) == (5, 1, 0)
+    assert sorted(extracted) == list(range(6))
+
+    # Same run_id again: only the failed document goes back to the model
+    extracted.clear()
+    fail.clear()
+    records, summary = collect(items, fetch, extract, Checkpoint("run-1", str(tmp_path)))
+    assert extracted == [3]
+    assert (summary["ok"], summary["error"], summary["resumed"]) == (1, 0, 5)
+    assert [r["status"] for r in records] == ["resumed"] * 3 + ["ok"] + ["resumed"] * 2
+    assert records[0]["result"] == {"invoice_number": "INV-0"}
+
+    # A third pass has nothing left to do
+    extracted.clear()
+    _, summary = collect(items, fetch, extract, Checkpoint("run-1", str(tmp_path)))
+    assert extracted == [] and summary["resumed"] == 6
+
+
+def test_checkpoint_is_keyed_by_url_and_type_not_position(tmp_path):
+    checkpoint = Checkpoint("run-2", str(tmp_path))
+
+    async def fetch(item):
+        return b""
+
+    async def extract(item, content):
+        return {"type": item.document_type}
+
+    collect(items_from_list([{"document_url": URLS[0]}]), fetch, extract, checkpoint)
+    records, summary = collect(items_from_list([
+        {"document_url": URLS[1]},
+        {"document_url": URLS[0]},
+        {"document_url": URLS[0], "document_type": "receipt"},
+    ]), fetch, extract, checkpoint)
+    assert [r["status"] for r in records] == ["ok", "resumed", "ok"]
+    assert records[1]["index"] == 1
+
+
+def test_manifest_paths_resolve_against_the_manifest(tmp_path):
+    root = str(tmp_path)
+    (tmp_path / "docs.json").write_text(json.dumps({"documents": [
+        {"path": "scans/a.pdf"},
+        {"document_url": "https://example.com/b.pdf", "document_type": "receipt"},
+    ]}))
+    (tmp_path / "docs.csv").write_text("path,document_type\nscans/c.png,\n")
+    items = items_from_manifest("docs.json", root=root)
+    assert items[0].document_url == "file://" + os.path.realpath(tmp_path / "scans" / "a.pdf")
+    assert (items[0].document_type, items[1].document_type) == ("invoice", "receipt")
+    assert items_from_manifest("docs.csv", "receipt", root=root)[0].document_type == "receipt"
+    (tmp_path / "bad.json").write_text('[{"document_type": "invoice"}]')
+    with pytest.raises(ValueError):
+        items_from_manifest("bad.json", root=root)
+
+
+def test_inputs_outside_the_input_dir_are_rejected(tmp_path):
+    root = tmp_path / "inputs"
+    (root / "march").mkdir(parents=True)
+    (root / "march" / "a.pdf").write_bytes(b"%PDF")
+    (tmp_path / "secret.pdf").write_bytes(b"%PDF")
+    (root / "march" / "link.pdf").symlink_to(tmp_path / "secret.pdf")
+    (root / "escape").symlink_to(tmp_path)
+
+    items = items_from_directory("march", root=str(root))
+    # The symlink to a file outside is skipped
+    assert [i.document_url for i in items] == ["file://" + os.path.realpath(root / "march" / "a.pdf")]
+    for path in ("..", "/etc", str(tmp_path), "escape", "march/../../"):
+        with pytest.raises(ValueError):
+            items_from_directory(path, root=str(root))
+
+    for row in ({"path": "../secret.pdf"}, {"document_url": "file:///etc/passwd"}, {"path": "march/link.pdf"}):
+        (root / "m.json").write_text(json.dumps([row]))
+        with pytest.raises(ValueError):
+            items_from_manifest("m.json", root=str(root))
+    (tmp_path / "outside.json").write_text("[]")
+    with pytest.raises(ValueError):
+        items_from_manifest(str(tmp_path / "outside.json"), root=str(root))
@@ -0,0 +1,103 @@
+"""
+Unit tests for multi-page document handling (backend/document_pages.py)
+Merging per-page extractions, and a PDF extracted page by page.
+
+    python -m pytest test_document_pages.py
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import document_pages  # noqa: E402
+import image_pool  # noqa: E402
+from document_pages import merge_pages, page_prompt  # noqa: E402
+
+
+def test_single_page_is_returned_as_is():
+    page = {"invoice_number": "INV-1", "line_items": [], "notes": None}
+    assert merge_pages([page]) is page
+
+
+def test_header_fields_take_the_first_value_and_totals_the_last():
+    merged = merge_pages([
+        {"invoice_number": "INV-1", "vendor_name": "Acme", "subtotal": 10.0, "total_amount": None},
+        {"invoice_number": None, "vendor_name": "", "subtotal": 110.0, "total_amount": 121.0},
+    ])
+    assert merged == {"invoice_number": "INV-1", "vendor_name": "Acme", "subtotal": 110.0, "total_amount": 121.0}
+
+
+def test_line_items_are_concatenated_in_page_order():
+    a, b, c = ({"description": d, "quantity": 1} for d in "abc")
+    merged = merge_pages([{"line_items": [a]}, {"line_items": []}, {"line_items": [b, c]}])
+    assert merged["line_items"] == [a, b, c]
+
+
+def test_row_repeated_across_a_page_break_is_kept_once():
+    a, b, c = ({"description": d, "quantity": 1} for d in "abc")
+    merged = merge_pages([{"line_items": [a, b]}, {"line_items": [b, c]}])
+    assert merged["line_items"] == [a, b, c]
+    # Only the row at the break: the same item bought twice elsewhere stays
+    assert merge_pages([{"line_items": [a, b]}, {"line_items": [c, a]}])["line_items"] == [a, b, c, a]
+
+
+def test_conflicting_header_values_are_reported():
+    merged = merge_pages([
+        {"invoice_number": "INV-1", "po_number": "PO-1"},
+        {"invoice_number": "INV-1", "po_number": "PO-2"},
+        {"po_number": "PO-3"},
+    ])
+    assert merged["po_number"] == "PO-1"
+    assert merged["page_conflicts"] == {"po_number": [{"page": 2, "value": "PO-2"}, {"page": 3, "value": "PO-3"}]}
+
+
+def test_page_prompt_only_changes_for_multi_page_documents():
+    assert page_prompt("Extract.", 0, 1) == "Extract."
+    assert "PAGE 2 OF 3" in page_prompt("Extract.", 1, 3)
+
+
+def test_pdf_pages_are_extracted_and_merged():
+    fitz = pytest.importorskip("fitz")
+    doc = fitz.open()
+    for n in range(3):
+        doc.new_page().insert_text((72, 72), f"Page {n + 1}")
+    data = doc.tobytes()
+    seen = []
+
+    async def extract_page(image, page, page_count):
+        seen.append((page, page_count, image.size))
+        return {"invoice_number": "INV-7" if page == 0 else None,
+                "line_items": [{"description": f"item {page}"}],
+                "total_amount": 100.0 if page == page_count - 1 else None}
+
+    try:
+        merged, pages = asyncio.run(document_pages.extract_pdf(data, extract_page, concurrency=2))
+    finally:
+        image_pool.shutdown_pool()
+    assert pages == 3
+    assert sorted(p for p, _, _ in seen) == [0, 1, 2]
+    assert all(count == 3 and max(size) > 0 for _, count, size in seen)
+    assert merged == {"invoice_number": "INV-7", "total_amount": 100.0,
+                      "line_items": [{"description": "item 0"}, {"description": "item 1"}, {"description": "item 2"}]}
+
+
+def test_failed_page_fails_the_document():
+    fitz = pytest.importorskip("fitz")
+    doc = fitz.open()
+    doc.new_page()
+    doc.new_page()
+
+    async def extract_page(image, page, page_count):
+        if page == 1:
+            return ["not", "an", "object"]
+        return {}
+
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(document_pages.extract_pdf(doc.tobytes(), extract_page))
+    finally:
+        image_pool.shutdown_pool()
@@ -0,0 +1,137 @@
+"""
+Unit tests for conveyor frame sampling (backend/frame_sampler.py)
+MJPEG splitting, corrupt frames, the stream size cap and carton segmentation.
+
+    python -m pytest test_frame_sampler.py
+"""
+
+import asyncio
+import os
+import sys
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import frame_sampler  # noqa: E402
+from frame_sampler import FrameSampler, MJPEGSplitter  # noqa: E402
+from image_io import ImageTooLargeError  # noqa: E402
+
+
+def jpeg(draw=None, size=(320, 240), color=(128, 128, 128)) -> bytes:
+    image = Image.new("RGB", size, color)
+    if draw:
+        draw(ImageDraw.Draw(image))
+    buf = BytesIO()
+    image.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def stripes(d):
+    for x in range(0, 320, 40):
+        d.rectangle([x, 0, x + 19, 239], fill=(20, 20, 20))
+
+
+def checker(d):
+    for x in range(0, 320, 80):
+        for y in range(0, 240, 80):
+            d.rectangle([x, y, x + 39, y + 39], fill=(240, 240, 240))
+
+
+async def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def test_splitter_handles_markers_split_across_chunks():
+    frames = [jpeg(color=(i * 40, 0, 0)) for i in range(3)]
+    stream = b"--boundary\r\nContent-Type: image/jpeg\r\n\r\n".join([b""] + frames)
+    for size in (1, 2, 7, 4096):
+        splitter = MJPEGSplitter()
+        out = []
+        for i in range(0, len(stream), size):
+            out += splitter.feed(stream[i:i + size])
+        assert out == frames, size
+
+
+def test_splitter_drops_oversized_frames():
+    splitter = MJPEGSplitter(max_frame_bytes=1000)
+    big, small = jpeg(size=(640, 480)), jpeg(size=(8, 8))
+    assert len(big) > 1000
+    out = []
+    for i in range(0, len(big), 500):
+        out += splitter.feed(big[i:i + 500])
+    out += splitter.feed(small)
+    assert out == [small]
+    assert splitter.oversized == 1
+
+
+def test_corrupt_frames_are_counted_and_skipped():
+    good = jpeg(stripes)
+    truncated = good[:300] + frame_sampler.EOI
+    garbage = frame_sampler.SOI + b"not a jpeg" + frame_sampler.EOI
+    sampler = FrameSampler()
+
+    async def scenario():
+        async for frame in frame_sampler.mjpeg_frames(chunked(good + truncated + garbage + good, 1000), sampler):
+            sampler.add_frame(frame)
+
+    asyncio.run(scenario())
+    assert sampler.stats["frames_received"] == 4
+    assert sampler.stats["corrupt_frames"] == 2
+    assert sampler.stats["frames_scored"] == 2
+    assert sampler.finish() is not None
+
+
+def test_mjpeg_stream_is_capped_at_max_bytes():
+    frame = jpeg()
+    sampler = FrameSampler()
+
+    async def scenario():
+        async for f in frame_sampler.mjpeg_frames(chunked(frame * 10, 512), sampler, max_bytes=len(frame) * 3):
+            sampler.add_frame(f)
+
+    with pytest.raises(ImageTooLargeError):
+        asyncio.run(scenario())
+    assert sampler.stats["frames_received"] <= 3
+
+
+def test_distinct_settled_views_become_separate_cartons():
+    first, second = jpeg(stripes), jpeg(checker)
+    sampler = FrameSampler(top_k=2, max_stride=1)
+    finished = []
+    for frame in [first] * 4 + [second] * 4:
+        assert sampler.next_frame_wanted()
+        segment = sampler.add_frame(frame)
+        if segment:
+            finished.append(segment)
+    last = sampler.finish()
+    assert [s.index for s in finished] == [0]
+    assert last.index == 1
+    # Identical frames of one carton collapse into a single kept frame
+    assert len(finished[0].frames) == 1 and len(last.frames) == 1
+    assert finished[0].frames[0].jpeg == first and last.frames[0].jpeg == second
+    # The first view of the new carton differs from the last one: it counts as belt motion
+    assert sampler.stats["frames_moving"] == 1
+    assert sampler.stats["duplicates_dropped"] == 5
+
+
+def test_stride_grows_while_nothing_moves():
+    frame = jpeg(stripes)
+    sampler = FrameSampler(max_stride=4)
+    scored = 0
+    for _ in range(60):
+        if sampler.next_frame_wanted():
+            sampler.add_frame(frame)
+            scored += 1
+    assert sampler.stride == 4
+    assert scored < 30
+
+
+def test_looks_like_mjpeg():
+    assert frame_sampler.looks_like_mjpeg(b"\xff\xd8\xff\xe0")
+    assert frame_sampler.looks_like_mjpeg(b"--frame\r\n\r\n\xff\xd8")
+    assert frame_sampler.looks_like_mjpeg(b"", "multipart/x-mixed-replace; boundary=frame")
+    assert not frame_sampler.looks_like_mjpeg(b"\x00\x00\x00\x18ftypmp42", "video/mp4")
@@ -0,0 +1,109 @@
+"""
+Unit tests for the image decode pool (backend/image_pool.py)
+Decodes through worker processes keep pixels and format; a broken pool falls back in-thread.
+
+    python -m pytest test_image_pool.py
+"""
+
+import asyncio
+import os
+import sys
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import image_pool  # noqa: E402
+
+
+def png(image: Image.Image, **params) -> bytes:
+    buf = BytesIO()
+    image.save(buf, "PNG", **params)
+    return buf.getvalue()
+
+
+def palette_image(size=(64, 48)) -> Image.Image:
+    image = Image.new("P", size, 0)
+    image.putpalette([255, 0, 0, 0, 0, 255] + [0] * (254 * 3))
+    image.paste(1, (0, 0, size[0] // 2, size[1]))
+    return image
+
+
+@pytest.fixture
+def pooled(monkeypatch):
+    # Send every payload through the pool, however small
+    monkeypatch.setattr(image_pool, "IMAGE_POOL_MIN_BYTES", 0)
+    monkeypatch.setattr(image_pool, "IMAGE_POOL_SIZE", 1)
+    yield
+    image_pool.shutdown_pool()
+
+
+def test_palette_image_keeps_its_colors_and_format(pooled):
+    image = asyncio.run(image_pool.decode_image_async(png(palette_image()), max_side=None))
+    assert image.mode == "RGB"
+    assert image.format == "PNG"
+    assert image.getpixel((0, 0)) == (0, 0, 255)
+    assert image.getpixel((63, 0)) == (255, 0, 0)
+    assert image.info["model_blob"][1] == "image/png"
+
+
+def test_palette_transparency_is_kept(pooled):
+    image = asyncio.run(image_pool.decode_image_async(png(palette_image(), transparency=0), max_side=None))
+    assert image.mode == "RGBA"
+    assert image.getpixel((63, 0))[3] == 0
+    assert image.getpixel((0, 0)) == (0, 0, 255, 255)
+
+
+def test_jpeg_decodes_like_the_inline_path(pooled):
+    buf = BytesIO()
+    Image.new("RGB", (80, 60), (10, 200, 30)).save(buf, "JPEG")
+    data = buf.getvalue()
+    pooled_image = asyncio.run(image_pool.decode_image_async(data, max_side=None))
+    assert pooled_image.format == "JPEG"
+    assert pooled_image.tobytes() == image_pool.decode_image(data, None).tobytes()
+    assert pooled_image.info["model_blob"][1] == "image/jpeg"
+
+
+def test_broken_pool_is_shut_down_and_decoded_in_thread(monkeypatch):
+    class BrokenPool:
+        shut_down = False
+
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("worker killed")
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            self.shut_down = True
+
+    broken = BrokenPool()
+    monkeypatch.setattr(image_pool, "IMAGE_POOL_MIN_BYTES", 0)
+    monkeypatch.setattr(image_pool, "_pool", broken)
+    image = asyncio.run(image_pool.decode_image_async(png(palette_image()), max_side=None))
+    assert image.size == (64, 48)
+    assert broken.shut_down
+    assert image_pool._pool is None
+
+
+def test_cancelled_decode_does_not_leak_its_output_segment(pooled):
+    buf = BytesIO()
+    Image.effect_noise((2000, 2000), 64).convert("RGB").save(buf, "PNG")
+    data = buf.getvalue()
+    segments = lambda: {n for n in os.listdir("/dev/shm") if n.startswith("psm_")}  # noqa: E731
+
+    async def scenario():
+        await asyncio.get_running_loop().run_in_executor(image_pool.get_pool(), image_pool._warm)
+        before = segments()
+        task = asyncio.ensure_future(image_pool.decode_image_async(data, max_side=None))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The single worker picks this up only once the abandoned decode has finished
+        await asyncio.get_running_loop().run_in_executor(image_pool.get_pool(), image_pool._warm)
+        await asyncio.sleep(0.1)
+        return before, segments()
+
+    before, after = asyncio.run(scenario())
+    assert after <= before
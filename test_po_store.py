@@ -0,0 +1,108 @@
+"""
+Unit tests for the purchase order store (backend/po_store.py)
+Per-day sequence numbers, line item round trips, search and delete.
+
+    python -m pytest test_po_store.py
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from po_store import SEED_POS, POStore  # noqa: E402
+
+
+def test_numbers_follow_a_per_day_sequence(tmp_path):
+    store = POStore(str(tmp_path / "po.db"))
+    numbers = [store.create("Acme", "IT", 10.0, created_date="2025-03-01")["po_number"] for _ in range(3)]
+    assert numbers == ["PO-20250301-000001", "PO-20250301-000002", "PO-20250301-000003"]
+    assert store.create("Acme", "IT", 10.0, created_date="2025-03-02")["po_number"] == "PO-20250302-000001"
+    assert store.create("Acme", "IT", 10.0, created_date="2025-03-01")["po_number"] == "PO-20250301-000004"
+
+
+def test_create_many_numbers_each_day_consecutively(tmp_path):
+    store = POStore(str(tmp_path / "po.db"))
+    pos = store.create_many([
+        {"vendor_name": "A", "department": "IT", "total_amount": 1, "created_date": "2025-03-01"},
+        {"vendor_name": "B", "department": "IT", "total_amount": 2, "created_date": "2025-03-02"},
+        {"vendor_name": "C", "department": "IT", "total_amount": 3, "created_date": "2025-03-01"},
+    ])
+    assert [p["po_number"] for p in pos] == ["PO-20250301-000001", "PO-20250302-000001", "PO-20250301-000002"]
+
+
+def test_concurrent_creates_never_share_a_number(tmp_path):
+    path = str(tmp_path / "po.db")
+    POStore(path)
+    numbers, errors = [], []
+
+    def worker():
+        # A store per thread, like separate workers on the same file
+        store = POStore(path)
+        try:
+            for _ in range(20):
+                numbers.append(store.create("Acme", "Ops", 1.0, created_date="2025-04-01")["po_number"])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert sorted(numbers) == [f"PO-20250401-{n:06d}" for n in range(1, 101)]
+
+
+def test_get_returns_the_po_with_its_line_items(tmp_path):
+    store = POStore(str(tmp_path / "po.db"))
+    po = store.create("Office Supplies Co", "IT", 1250.0, [
+        {"description": "Office Chairs", "quantity": 5, "unit_price": 200.0},
+        {"description": "Desk Lamps", "quantity": 2.5, "estimated_price": 50.1},
+    ], created_date="2025-01-10", requisition_number="REQ-9", reservation_id="RSV-1")
+    stored = store.get(po["po_number"])
+    assert stored["vendor_name"] == "Office Supplies Co"
+    assert stored["total_amount"] == 1250.0
+    assert stored["requisition_number"] == "REQ-9" and stored["reservation_id"] == "RSV-1"
+    assert stored["line_items"] == [
+        {"description": "Office Chairs", "quantity": 5, "unit_price": 200.0},
+        {"description": "Desk Lamps", "quantity": 2.5, "unit_price": 50.1},
+    ]
+    assert isinstance(stored["line_items"][0]["quantity"], int)
+    assert store.get("PO-19990101-000001") is None
+
+
+def test_po_without_line_items(tmp_path):
+    store = POStore(str(tmp_path / "po.db"))
+    po = store.create("Acme", "IT", 99.99)
+    assert store.get(po["po_number"])["line_items"] == []
+
+
+def test_seed_is_idempotent(tmp_path):
+    store = POStore(str(tmp_path / "po.db"))
+    store.seed()
+    store.seed()
+    assert store.count() == len(SEED_POS)
+    assert store.get("PO-20250110-1234")["total_amount"] == 1250.0
+
+
+def test_search_filters_and_orders_newest_first(tmp_path):
+    store = POStore(str(tmp_path / "po.db"))
+    store.create("Acme", "IT", 1.0, created_date="2025-05-01")
+    store.create("Acme", "HR", 2.0, created_date="2025-05-03")
+    store.create("Globex", "IT", 3.0, created_date="2025-05-02")
+    assert [p["created_date"] for p in store.search(vendor_name="Acme")] == ["2025-05-03", "2025-05-01"]
+    assert [p["vendor_name"] for p in store.search(department="IT", date_from="2025-05-02")] == ["Globex"]
+    assert len(store.search(date_to="2025-05-02")) == 2
+    assert len(store.search(limit=1)) == 1
+
+
+def test_delete_removes_the_po_and_its_items(tmp_path):
+    store = POStore(str(tmp_path / "po.db"))
+    po = store.create("Acme", "IT", 5.0, [{"description": "x", "quantity": 1, "unit_price": 5.0}])
+    assert store.delete(po["po_number"])
+    assert store.get(po["po_number"]) is None
+    assert not store.delete(po["po_number"])
+    conn = store._conn()
+    assert conn.execute("SELECT COUNT(*) FROM po_line_items").fetchone()[0] == 0
@@ -0,0 +1,48 @@
+"""
+Unit tests for the sampling profiler's admin helpers (backend/profiling.py)
+The shared admin token check and profile pruning.
+
+    python -m pytest test_profiling.py
+"""
+
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import profiling  # noqa: E402
+from profiling import prune_profiles, require_admin  # noqa: E402
+
+
+def test_without_admin_token_only_reads_pass(monkeypatch):
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", None)
+    require_admin(None)
+    require_admin("anything")
+    for token in (None, "anything"):
+        with pytest.raises(HTTPException) as e:
+            require_admin(token, mutate=True)
+        assert e.value.status_code == 403
+
+
+def test_with_admin_token_every_call_needs_it(monkeypatch):
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "s3cret")
+    require_admin("s3cret")
+    require_admin("s3cret", mutate=True)
+    for token, mutate in ((None, False), ("wrong", False), (None, True), ("wrong", True)):
+        with pytest.raises(HTTPException) as e:
+            require_admin(token, mutate=mutate)
+        assert e.value.status_code == 403
+
+
+def test_only_the_newest_profiles_are_kept(tmp_path):
+    for n in range(5):
+        path = tmp_path / f"profile-{n}.folded"
+        path.write_text("a;b 1\n")
+        os.utime(path, (1000 + n, 1000 + n))
+    (tmp_path / "notes.txt").write_text("kept")
+    prune_profiles(str(tmp_path), keep=3)
+    assert sorted(os.listdir(tmp_path)) == ["notes.txt", "profile-2.folded", "profile-3.folded", "profile-4.folded"]
+    prune_profiles(str(tmp_path / "missing"), keep=3)
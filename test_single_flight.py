@@ -0,0 +1,105 @@
+"""
+Unit tests for request coalescing (backend/single_flight.py)
+
+    python -m pytest test_single_flight.py
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from single_flight import SingleFlight  # noqa: E402
+
+
+def test_concurrent_calls_with_one_key_share_one_execution():
+    flight = SingleFlight("test_shared")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"answer": 42}
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [shared for _, shared in results] == [False, True, True, True, True]
+    assert all(result is results[0][0] for result, _ in results)
+    assert flight.in_flight() == 0
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight("test_keys")
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do(k, lambda k=k: work(k)) for k in ("a", "b", ("a", "CRITICAL"))))
+
+    results = asyncio.run(scenario())
+    assert sorted(map(str, calls)) == sorted(map(str, ["a", "b", ("a", "CRITICAL")]))
+    assert [shared for _, shared in results] == [False, False, False]
+
+
+def test_only_in_flight_work_is_shared():
+    flight = SingleFlight("test_sequential")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return len(calls)
+
+    async def scenario():
+        return await flight.do("k", work), await flight.do("k", work)
+
+    first, second = asyncio.run(scenario())
+    assert first == (1, False) and second == (2, False)
+
+
+def test_failure_reaches_every_caller_and_clears_the_key():
+    flight = SingleFlight("test_failure")
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("model down")
+
+    async def scenario():
+        results = await asyncio.gather(flight.do("k", boom), flight.do("k", boom), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert flight.in_flight() == 0
+
+        async def ok():
+            return "recovered"
+        return await flight.do("k", ok)
+
+    assert asyncio.run(scenario()) == ("recovered", False)
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flight = SingleFlight("test_cancel")
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == ("done", True)
@@ -0,0 +1,150 @@
+"""
+Unit tests for the VAS station channel framing and sessions (backend/station_channel.py)
+
+    python -m pytest test_station_channel.py
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from state_store import InMemoryStateStore  # noqa: E402
+from station_channel import (HEADER_LEN, MAX_HEADER_BYTES, FrameError, StationSessions,  # noqa: E402
+                             decode_control, decode_frame, encode_frame)
+
+
+def test_frame_round_trip():
+    header = {"seq": 17, "order_id": "ORD-1", "kitting_list": ["Phone", "Charger"]}
+    payload = b"\xff\xd8 image bytes \xff\xd9"
+    assert decode_frame(encode_frame(header, payload)) == (header, payload)
+    assert decode_frame(encode_frame({"seq": 1}, b"")) == ({"seq": 1}, b"")
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"\x00\x00",
+    HEADER_LEN.pack(100) + b'{"seq": 1}',
+    HEADER_LEN.pack(MAX_HEADER_BYTES + 1) + b"x" * (MAX_HEADER_BYTES + 1),
+    HEADER_LEN.pack(5) + b"{nope",
+    encode_frame({"order_id": "no seq"}, b"img"),
+    encode_frame({"seq": "17"}, b"img"),
+    HEADER_LEN.pack(2) + b"[]",
+])
+def test_malformed_frames_are_rejected(data):
+    with pytest.raises(FrameError):
+        decode_frame(data)
+
+
+def test_control_messages_are_parsed_not_substring_matched():
+    assert decode_control('{"type": "ping"}') == {"type": "ping"}
+    assert decode_control('{"type": "ping", "ts": 1}')["type"] == "ping"
+    for text in ('{"note": "\\"ping\\""}', '"ping"', "ping", "", '{"type": 1}', "[]"):
+        with pytest.raises(FrameError):
+            decode_control(text)
+
+
+def test_seq_must_increase():
+    sessions = StationSessions(InMemoryStateStore())
+    assert sessions.advance("ST-1", 1)
+    assert sessions.advance("ST-1", 5)
+    assert not sessions.advance("ST-1", 5)
+    assert not sessions.advance("ST-1", 3)
+    assert sessions.advance("ST-1", 6)
+    # Stations are independent
+    assert sessions.advance("ST-2", 1)
+
+
+def test_seq_order_survives_a_move_to_another_worker():
+    state = InMemoryStateStore()
+    StationSessions(state).store("ST-1", 9, {"type": "result", "seq": 9})
+    other_worker = StationSessions(state)
+    assert not other_worker.advance("ST-1", 9)
+    assert other_worker.advance("ST-1", 10)
+
+
+def test_in_flight_duplicates_are_detected():
+    sessions = StationSessions(InMemoryStateStore())
+    assert sessions.begin("ST-1", 4)
+    assert not sessions.begin("ST-1", 4)
+    sessions.end("ST-1", 4)
+    assert sessions.begin("ST-1", 4)
+
+
+def test_missed_verdicts_are_replayed_after_last_seq():
+    sessions = StationSessions(InMemoryStateStore())
+    for seq in (1, 2, 4):
+        sessions.store("ST-1", seq, {"type": "result", "seq": seq})
+    assert sessions.last_seq("ST-1") == 4
+    assert [m["seq"] for m in sessions.missed("ST-1", 1)] == [2, 4]
+    assert sessions.missed("ST-1", 4) == []
+    assert sessions.stored("ST-1", 2) == {"type": "result", "seq": 2}
+    # An older verdict stored late doesn't move last_seq back
+    sessions.store("ST-1", 3, {"type": "result", "seq": 3})
+    assert sessions.last_seq("ST-1") == 4
+
+
+def test_newest_socket_replaces_the_previous_one():
+    sessions = StationSessions(InMemoryStateStore())
+    first, second = object(), object()
+    assert sessions.attach("ST-1", first) is None
+    assert sessions.attach("ST-1", second) is first
+    sessions.detach("ST-1", first)  # stale socket closing doesn't detach the new one
+    assert sessions.attach("ST-1", first) is second
+    assert sessions.slots("ST-1") is sessions.slots("ST-1")
+
+
+def test_verdict_reaches_a_station_that_reconnected_mid_frame(monkeypatch):
+    pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+    import main_supply_chain as app_module
+
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    def slow_verification(image, order_id, station_id, *args):
+        calls.append(order_id)
+        started.set()
+        release.wait(10)
+        return app_module.LabelMatchResult(
+            order_id=order_id, station_id=station_id, timestamp="2025-01-01T00:00:00", label_text="SKU-1",
+            visual_object="box", match=True, confidence=0.9, action_required="PROCEED", reasoning="ok")
+
+    monkeypatch.setattr(app_module, "model", object())
+    monkeypatch.setattr(app_module, "run_vas_verification", slow_verification)
+    station = f"ST-{uuid.uuid4().hex[:8]}"
+    buf = BytesIO()
+    Image.new("RGB", (32, 32), (200, 200, 200)).save(buf, "JPEG")
+    frame = encode_frame({"seq": 1, "order_id": "ORD-1"}, buf.getvalue())
+
+    with TestClient(app_module.app) as client:
+        with client.websocket_connect(f"/ws/vas/{station}") as old:
+            assert old.receive_json()["type"] == "hello"
+            old.send_bytes(frame)
+            assert started.wait(10)
+            # The station drops and reconnects while seq 1 is still being verified, then resends it
+            with client.websocket_connect(f"/ws/vas/{station}") as new:
+                assert new.receive_json()["resumed"] == []
+                new.send_bytes(frame)
+                new.send_text('{"type": "ping"}')
+                assert new.receive_json() == {"type": "pong"}
+                release.set()
+                for _ in range(100):
+                    if app_module.VAS_SESSIONS.stored(station, 1):
+                        break
+                    time.sleep(0.05)
+                time.sleep(0.2)
+                # Everything the new socket got before the answer to this ping
+                new.send_text('{"type": "ping"}')
+                received = []
+                while not received or received[-1] != {"type": "pong"}:
+                    received.append(new.receive_json())
+    verdicts = [m for m in received if m["type"] == "result"]
+    assert len(verdicts) == 1 and verdicts[0]["seq"] == 1 and verdicts[0]["replayed"] is False
+    assert calls == ["ORD-1"]
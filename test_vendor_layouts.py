@@ -0,0 +1,166 @@
+"""
+Unit tests for vendor layout templates (backend/vendor_layouts.py)
+Learning a layout from a model answer, reading the next invoice with it, and the shared template store.
+
+    python -m pytest test_vendor_layouts.py
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import vendor_layouts  # noqa: E402
+from vendor_layouts import LayoutPage, LayoutStore, Word, apply, learn, parse_date, parse_number  # noqa: E402
+
+FINGERPRINT = [0.5, -0.5, 0.5, -0.5]
+
+
+def page(lines) -> LayoutPage:
+    """One row of words per entry, each word (x0, text), 0.03 tall rows 0.05 apart"""
+    words = []
+    for row, line in enumerate(lines):
+        y = 0.05 + row * 0.05
+        for x0, text in line:
+            words.append(Word(x0, y, x0 + 0.015 * len(text), y + 0.03, text))
+    return LayoutPage(words, FINGERPRINT)
+
+
+def invoice(number, date, rows, total):
+    return page([
+        [(0.05, "ACME"), (0.15, "Industrial")],
+        [(0.05, "Invoice"), (0.17, "#"), (0.3, number)],
+        [(0.05, "Date:"), (0.3, date)],
+        [(0.05, "Description"), (0.5, "Qty"), (0.65, "Price"), (0.8, "Amount")],
+        *[[(0.05, d), (0.5, q), (0.65, p), (0.8, a)] for d, q, p, a in rows],
+        [(0.6, "Total"), (0.8, total)],
+    ])
+
+
+def test_parse_number_and_date():
+    assert parse_number("$1,250.00") == 1250.0
+    assert parse_number("(15.50)") == -15.5
+    assert parse_number("Total:") is None
+    assert parse_date("03/01/2025") == ("2025-03-01", "%m/%d/%Y")
+    assert parse_date("01.03.2025", "%d.%m.%Y") == ("2025-03-01", "%d.%m.%Y")
+    assert parse_date("soon") is None
+
+
+def test_learned_layout_reads_the_next_invoice():
+    first = invoice("INV-100", "03/01/2025", [("Widget", "2", "5.00", "10.00"), ("Gadget", "1", "20.00", "20.00")], "30.00")
+    template = learn(first, "invoice", {
+        "vendor_name": "ACME Industrial", "invoice_number": "INV-100", "invoice_date": "2025-03-01",
+        "line_items": [{"description": "Widget", "quantity": 2, "unit_price": 5.0, "line_total": 10.0},
+                       {"description": "Gadget", "quantity": 1, "unit_price": 20.0, "line_total": 20.0}],
+        "total_amount": 30.0,
+    })
+    assert template is not None
+    assert template["items"]["numeric"] == ["quantity", "unit_price", "line_total"]
+
+    # A longer table pushes the total down; it's still read right of its label
+    second = invoice("INV-101", "04/02/2025", [("Bolt", "10", "0.50", "5.00"), ("Nut", "10", "0.25", "2.50"),
+                                               ("Gear", "3", "4.00", "12.00")], "19.50")
+    extracted, problem = apply(template, second)
+    assert problem is None
+    assert extracted["invoice_number"] == "INV-101"
+    assert extracted["invoice_date"] == "2025-04-02"
+    assert extracted["total_amount"] == 19.5
+    assert [i["description"] for i in extracted["line_items"]] == ["Bolt", "Nut", "Gear"]
+
+    # Items that don't add up to the total send the document to the model
+    wrong = invoice("INV-102", "04/03/2025", [("Bolt", "10", "0.50", "5.00")], "99.00")
+    assert apply(template, wrong)[1] == "line items don't add up"
+
+
+def template(template_id, last_used=0.0):
+    return {"id": template_id, "document_type": "invoice", "fingerprint": FINGERPRINT, "anchors": [],
+            "fields": {}, "last_used": last_used, "hits": 0}
+
+
+def test_workers_see_each_others_changes(tmp_path):
+    path = str(tmp_path / "layouts.json")
+    a, b = LayoutStore(path), LayoutStore(path)
+    a.add(template("tpl-a"))
+    b.add(template("tpl-b"))
+    a._refresh()
+    assert set(a.templates) == {"tpl-a", "tpl-b"}
+    assert b.remove("tpl-a")
+    assert not b.remove("tpl-a")
+    a._refresh()
+    assert set(a.templates) == {"tpl-b"}
+
+
+def test_concurrent_adds_are_not_lost(tmp_path):
+    path = str(tmp_path / "layouts.json")
+
+    def worker(n):
+        store = LayoutStore(path)  # one store per worker, sharing the file
+        for i in range(25):
+            store.add(template(f"tpl-{n}-{i}"))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    store = LayoutStore(path)
+    store._refresh()
+    assert len(store.templates) == 100
+
+
+def test_hits_are_counted_in_memory_until_the_next_change(tmp_path):
+    path = str(tmp_path / "layouts.json")
+    store = LayoutStore(path)
+    store.add(template("tpl-a"))
+    size = os.path.getsize(path)
+    mtime = os.stat(path).st_mtime_ns
+    for _ in range(3):
+        store.used(store.templates["tpl-a"])
+    assert (os.path.getsize(path), os.stat(path).st_mtime_ns) == (size, mtime)
+    assert store.hits(store.templates["tpl-a"]) == 3
+
+    store.add(template("tpl-b"))
+    other = LayoutStore(path)
+    other._refresh()
+    assert other.templates["tpl-a"]["hits"] == 3
+    assert store.hits(store.templates["tpl-a"]) == 3
+
+
+def test_least_recently_used_template_is_evicted(tmp_path):
+    store = LayoutStore(str(tmp_path / "layouts.json"), max_templates=2)
+    store.add(template("tpl-old", last_used=1.0))
+    store.add(template("tpl-mid", last_used=2.0))
+    store.used(store.templates["tpl-old"])
+    store.add(template("tpl-new", last_used=3.0))
+    assert set(store.templates) == {"tpl-old", "tpl-new"}
+
+
+def test_disabled_unless_switched_on(monkeypatch):
+    monkeypatch.setattr(vendor_layouts, "VENDOR_LAYOUTS", "off")
+    assert not vendor_layouts.enabled_for("invoice")
+    monkeypatch.setattr(vendor_layouts, "VENDOR_LAYOUTS", "on")
+    assert vendor_layouts.enabled_for("invoice")
+    assert not vendor_layouts.enabled_for("packing_slip")
+
+
+def test_admin_routes_are_hidden_and_delete_needs_the_token(tmp_path, monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    import profiling
+
+    monkeypatch.setattr(vendor_layouts, "STORE", LayoutStore(str(tmp_path / "layouts.json")))
+    vendor_layouts.STORE.add(template("tpl-a"))
+    app = FastAPI()
+    vendor_layouts.install_vendor_layouts(app)
+    client = TestClient(app)
+    assert "/admin/vendor_layouts" not in str(client.get("/openapi.json").json()["paths"])
+
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", None)
+    assert client.get("/admin/vendor_layouts").json()["templates"] == 1
+    assert client.delete("/admin/vendor_layouts/tpl-a").status_code == 403
+
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "s3cret")
+    assert client.delete("/admin/vendor_layouts/tpl-a", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.delete("/admin/vendor_layouts/tpl-a", headers={"X-Admin-Token": "s3cret"}).json() == {"deleted": "tpl-a"}
+    assert client.delete("/admin/vendor_layouts/tpl-a", headers={"X-Admin-Token": "s3cret"}).status_code == 404